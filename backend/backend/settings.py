@@ -44,11 +44,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'users.instrumentation.RequestMetricsMiddleware',  # first, so it times the rest too
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -96,6 +96,33 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Holds the roles, eligibility, rosters, revocations and cached responses.
+# 'locmem' is per process, so with more than one worker use 'file' (one
+# directory on the host) or 'redis' (needs the redis package) so that a write
+# in one worker invalidates what the others serve.
+
+CACHE_BACKEND = 'locmem'
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'backend',
+        'OPTIONS': {'MAX_ENTRIES': 20000},  # the default 300 would keep evicting eligibility entries
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+}
+CACHES = {'default': CACHE_BACKENDS[CACHE_BACKEND]}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -117,10 +144,19 @@ AUTH_PASSWORD_VALIDATORS = [
 AUTH_USER_MODEL = 'users.User'#I added this also
 
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',#I also added this
+    #ModelBackend used to be first, so every login did its lookup and hash twice
     'users.backends.EmailBackend',  #I added this also
 ]
 
+PASSWORD_HASHERS = [
+    'users.hashers.ConfigurableScryptPasswordHasher',  #existing hashes are upgraded to this on login
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+PASSWORD_SCRYPT = {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1}  # 16MB and about 40 ms per hash
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -146,9 +182,106 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ]
+        'users.authentication.ClaimsJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'users.instrumentation.TimedJSONRenderer',  # JSONRenderer that counts its time as serializing
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Number of background threads rendering QR codes after a receipt is verified,
+# 0 renders them inline in the request
+QR_WORKERS = 2
+
+# Processes used to encode batches of QR codes, None uses every CPU core
+QR_PROCESSES = None
+
+# Signed qr code tokens, see users/qr_tokens.py
+CURRENT_SEASON = '2026'
+QR_TOKEN_LIFETIME = 365 * 24 * 3600  # seconds
+QR_ELIGIBILITY_CACHE_SECONDS = 300
+
+# Decoding uploaded qr code photos, see users/qr_decode.py
+QR_DECODE_PROCESSES = 2
+QR_DECODE_MAX_SIDE = 1024  # pixels, photos are shrunk to this before decoding
+QR_DECODE_MAX_PIXELS = 40_000_000  # larger images are refused, this bounds how long a decode can run
+QR_DECODE_TIMEOUT = 5  # seconds
+QR_DECODE_MAX_BATCH = 30
+
+# Offline gate checks, see users/gate.py
+GATE_SNAPSHOT_MAX_AGE = 7 * 24 * 3600  # seconds a snapshot can still be caught up, and how old an uploaded scan can be
+GATE_OFFLINE_MAX_SCANS = 500  # scans per upload
+GATE_SNAPSHOT_KEY = None  # HMAC key of the snapshot bodies shared with the umpires' devices, None derives one only the server knows
+
+# Match day check-ins, see users/attendance.py
+ATTENDANCE_BATCH_SIZE = 200  # check-ins written per insert
+ATTENDANCE_FLUSH_MS = 500  # longest a check-in waits to be written, 0 writes on the request that fills a batch
+ATTENDANCE_DUPLICATE_SECONDS = 120  # a member scanned again at a fixture within this isn't written again
+ATTENDANCE_RECENT_SIZE = 20000  # recent scans remembered per process
+
+# How long a user's resolved roles stay cached, see users/roles.py
+ROLE_CACHE_SECONDS = 600
+
+# When True, GET requests are authorized from the token claims alone and the
+# User row isn't loaded (request.user is a TokenUser), see users/authentication.py
+JWT_STATELESS_READS = False
+
+# Serving uploaded media, see users/media.py
+MEDIA_REQUIRE_AUTH = True  # needs a JWT or a signed url
+MEDIA_URL_LIFETIME = 24 * 3600  # seconds a signed media url stays valid (at least)
+MEDIA_CACHE_SECONDS = 3600
+# None serves the bytes from Django, 'x-accel' or 'x-sendfile' hands them to the proxy
+MEDIA_OFFLOAD = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'  # nginx internal location mapped to MEDIA_ROOT
+
+# Profile photo thumbnails, see users/thumbnails.py
+PROFILE_THUMBNAIL_SIZES = {'small': 96, 'medium': 320}  # longest side in pixels
+PROFILE_THUMBNAIL_FORMAT = 'WEBP'  # or 'JPEG'
+
+# Receipt uploads, see users/uploads.py
+RECEIPT_UPLOAD_QUOTAS = {  # largest receipt in bytes for the uploader's highest role
+    'club_admin': 50 * 1024 * 1024,
+    'team_admin': 25 * 1024 * 1024,
+    'player': 10 * 1024 * 1024,
+    'member': 5 * 1024 * 1024,
+}
+RECEIPT_UPLOAD_CHUNK_SIZE = 1024 * 1024  # largest chunk the client may send
+RECEIPT_UPLOAD_EXPIRY = 24 * 3600  # seconds an idle chunked upload is kept
+RECEIPT_BATCH_MAX_ITEMS = 30  # files per batch upload
+
+ROSTER_IMPORT_CHUNK_SIZE = 500  # rows per bulk_create
+ROSTER_HASH_WORKERS = None  # threads hashing imported passwords, None uses every core, 0 hashes inline
+ROSTER_INVITE_LIFETIME = 14 * 24 * 3600  # seconds an invite token from a roster import is valid
+TEAM_ROSTER_CACHE_SECONDS = 3600  # seconds a team's roster snapshot is cached, a change to the roster starts a new one
+
+# Whole responses of the dashboard listings, see users/response_cache.py
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_SECONDS = 60  # a cached body is dropped by the next write it shows anyway, this only bounds memory
+
+LOGIN_MAX_CONCURRENT_HASHES = 4  # per process, logins past this wait for a slot (None for no limit)
+LOGIN_QUEUE_TIMEOUT = 2  # seconds a login waits for a slot before a 429
+
+TOKEN_REVOCATION_LOCAL_SECONDS = 30  # how stale a process' copy of the revocations can be
+TOKEN_REVOCATION_LOCAL_SIZE = 10000  # rotated refresh tokens remembered per process
+TOKEN_REVOCATION_CACHE_SECONDS = 300  # seconds revocations are kept in the shared cache
+
+# Request metrics and logs, see users/instrumentation.py
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # addresses that may read /metrics
+REQUEST_QUERY_BUDGET = 20  # requests running more queries than this are logged and counted, None turns it off
+REQUEST_SLOW_MS = 1000  # requests slower than this are always logged
+REQUEST_LOG_SAMPLE_RATE = 0.01  # share of the other requests (and view events) that are logged
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'users': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
\ No newline at end of file
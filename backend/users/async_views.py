@@ -0,0 +1,243 @@
+"""
+Async versions of the hot read and scan endpoints, for when the project is
+served over ASGI (backend/asgi.py under uvicorn or daphne). They answer the
+same urls under async/ with the same bodies as their views.py counterparts.
+
+A threaded WSGI server answers as many requests at once as it has threads,
+and a request keeps its thread while it waits on the database, the cache or
+the decode pool, so a few slow decodes can queue every scan behind them.
+Here the waiting is done on the event loop:
+
+    - cache reads (the eligibility entries, the rosters, the fixtures) use
+      the cache's async API, so a warm scan doesn't touch the database
+    - single queries use the async ORM (afirst)
+    - a qr code photo is decoded in the process pool and awaited
+    - authentication and the permission checks, which are plain DRF code,
+      run together in one sync_to_async hop per request
+
+Django still runs every ORM query, and the sync middleware, in a thread of
+the request behind the async API, and each of those hops costs CPU. So the
+gain is in how many requests a process can hold open at once, not in the
+latency of one request or in throughput when the database answers quickly.
+benchmark_asgi measures both sides. The receipt listings page and serialize
+through DRF in one hop for the same reason.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .attendance import aget_fixture, check_in
+from .filters import parse_int
+from .models import Receipt, Team
+from .pagination import ReceiptCursorPagination
+from .permissions import IsClubAdmin, IsTeamAdmin, request_claims
+from .qr_decode import QRDecodeError, adecode_upload
+from .qr_tokens import InvalidQRToken, aget_eligibility, read_token
+from .response_cache import cached_response, receipt_scopes
+from .teams import aget_roster, roster_etag, with_media_urls
+from .views import frame_member, qr_code_data, receipt_page, require_gate_staff, scan_data
+
+
+def error_response(exc, request):
+    if isinstance(exc.detail, (list, dict)):
+        body = exc.detail
+    else:
+        body = {'detail': exc.detail}
+    response = JsonResponse(body, status=exc.status_code, safe=False)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+        if header:
+            response['WWW-Authenticate'] = header
+        else:
+            response.status_code = status.HTTP_403_FORBIDDEN
+    return response
+
+
+class AsyncAPIView(View):
+    """
+    The part of APIView the async views need: the request is wrapped in a DRF
+    Request (so request.user, request.auth, request.data and query_params
+    work as usual), authenticated with the project's authentication classes
+    and checked against permission_classes. APIExceptions become JSON
+    responses like DRF's. Handlers are async and return Django responses.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        #Tokens, not cookies, so no CSRF check, as with APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def get_permissions(self):
+        return [permission() for permission in self.permission_classes]
+
+    def initial(self, request):
+        """
+        Authenticates and checks permissions, in a thread. The body is parsed
+        here too so handlers don't parse uploads on the event loop.
+        """
+        request = Request(
+            request,
+            parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+            authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+        )
+        self.request = request
+        for permission in self.get_permissions():
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            #Reading it parses the body
+            request.data
+        return request
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or handler is None:
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+        try:
+            request = await sync_to_async(self.initial)(request)
+            return await handler(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            #initial() swaps self.request for the DRF Request first thing
+            return error_response(exc, self.request)
+
+
+"""
+PlayerQRCodeView over ASGI
+"""
+class AsyncPlayerQRCodeView(AsyncAPIView):
+    async def get(self, request):
+        receipt = await Receipt.objects.filter(
+            player_id=request.user.id, is_verified=True,
+        ).order_by('-uploaded_at').afirst()
+        return JsonResponse(qr_code_data(request, receipt))
+
+
+"""
+TeamPlayersView over ASGI, the roster comes out of the cache and the Team
+row is the only query. Supports If-None-Match.
+"""
+class AsyncTeamPlayersView(AsyncAPIView):
+    permission_classes = [IsAuthenticated, IsTeamAdmin]
+
+    def initial(self, request):
+        request = super().initial(request)
+        self.claims = request_claims(request)
+        return request
+
+    async def get(self, request):
+        team = await Team.objects.filter(name=self.claims['team_name']).afirst()
+        if team is None:
+            return JsonResponse([], safe=False)
+        etag = roster_etag(team)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse(with_media_urls(request, await aget_roster(team)), safe=False)
+        response['ETag'] = etag
+        #The photo urls in the body are signed, so only the client keeps a copy
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class AsyncReceiptListView(AsyncAPIView):
+    """
+    The receipt listings over ASGI. The page is read (or taken from the
+    response cache) and serialized in one thread hop, paging stays DRF's
+    cursor pagination.
+    """
+    pagination_class = ReceiptCursorPagination
+    endpoint = None
+    filters = {}
+
+    def page(self, request):
+        return cached_response(
+            request, self.endpoint, receipt_scopes(request.query_params),
+            lambda: receipt_page(request, self, **self.filters),
+        )
+
+    async def get(self, request):
+        return JsonResponse(await sync_to_async(self.page)(request))
+
+
+class AsyncListUnverifiedReceipts(AsyncReceiptListView):
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+    endpoint = 'receipts-unverified'
+    filters = {'is_verified': False}
+
+
+class AsyncListAllReceipts(AsyncReceiptListView):
+    endpoint = 'receipts-all'
+
+
+async def arequested_fixture(request):
+    fixture_id = request.data.get('fixture')
+    if fixture_id in (None, ''):
+        return None
+    await sync_to_async(require_gate_staff)(request)
+    fixture = await aget_fixture(parse_int('fixture', str(fixture_id)))
+    if fixture is None:
+        raise exceptions.NotFound('Fixture not found')
+    return fixture
+
+
+"""
+scan_result for the async views. Only a scan for a fixture leaves the event
+loop, to hand its check-in to the attendance buffer.
+"""
+async def ascan_result(request, member_id, season=None, fixture=None):
+    data, code = scan_data(request, await aget_eligibility(member_id), season, fixture)
+    if fixture is not None and code == status.HTTP_200_OK:
+        data['check_in'] = await sync_to_async(check_in)(
+            fixture, member_id, request.user.id, data['team_name'], data['eligible'],
+        )
+    return data, code
+
+
+"""
+ScanQRTokenView over ASGI. A scan of a member whose entry is cached runs
+entirely on the event loop.
+"""
+class AsyncScanQRTokenView(AsyncAPIView):
+    async def post(self, request):
+        token = request.data.get('token')
+        if not token:
+            return JsonResponse({'error': 'QR code token required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            parsed = read_token(token)
+        except InvalidQRToken as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data, code = await ascan_result(request, parsed.member_id, parsed.season, await arequested_fixture(request))
+        return JsonResponse(data, status=code)
+
+
+"""
+ScanQRCodeView over ASGI, the photo is decoded in the decode pool and awaited
+"""
+class AsyncScanQRCodeView(AsyncAPIView):
+    async def post(self, request):
+        qr_image = request.FILES.get('qr_code')
+        if not qr_image:
+            return JsonResponse({'error': 'QR code image required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fixture = await arequested_fixture(request)
+        try:
+            decoded = await adecode_upload(qr_image)
+        except QRDecodeError as e:
+            decoded = e
+
+        member, error = frame_member(decoded)
+        if error is not None:
+            data, code = error
+        else:
+            data, code = await ascan_result(request, *member, fixture)
+        return JsonResponse(data, status=code)
@@ -0,0 +1,238 @@
+"""
+Match day attendance.
+A scan made for a fixture records a CheckIn, but an INSERT per scan would
+double the cost of the scan path, so check-ins are appended to a per process
+buffer and written in batches:
+
+    - a batch is written once ATTENDANCE_BATCH_SIZE check-ins are waiting or
+      the oldest has waited ATTENDANCE_FLUSH_MS, on a background thread
+    - a batch is one query for the members already checked in, one bulk
+      insert and one UPDATE per fixture adding to its counters, in one
+      transaction, so the summaries are kept incrementally and never counted
+    - a member scanned again at the same fixture within
+      ATTENDANCE_DUPLICATE_SECONDS (the umpire's phone reading the same code
+      twice) is only answered, not written, using an in-memory set of recent
+      scans
+
+Check-ins still in the buffer are lost if the process dies, and the summary
+lags the gate by up to ATTENDANCE_FLUSH_MS. Whatever is waiting is written
+when the process exits.
+
+Set ATTENDANCE_FLUSH_MS = 0 to write a batch on the request that fills it and
+leave the rest to flush() (handy for tests and scripts).
+"""
+import atexit
+import logging
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Timer
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CheckIn, Fixture
+from .revocation import LRUCache
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_KEY = 'fixture:{}'
+
+CheckInEvent = namedtuple('CheckInEvent', ['fixture_id', 'member_id', 'umpire_id', 'side', 'eligible', 'scanned_at'])
+
+
+"""
+The fixture's teams and season as a dict, cached, or None if there is no such fixture
+"""
+def get_fixture(fixture_id):
+    key = FIXTURE_KEY.format(fixture_id)
+    fixture = cache.get(key)
+    if fixture is None:
+        fixture = Fixture.objects.filter(id=fixture_id).values('id', 'home_team_id', 'away_team_id', 'season').first()
+        if fixture is None:
+            return None
+        cache.set(key, fixture, 3600)
+    return fixture
+
+
+async def aget_fixture(fixture_id):
+    key = FIXTURE_KEY.format(fixture_id)
+    fixture = await cache.aget(key)
+    if fixture is None:
+        fixture = await Fixture.objects.filter(id=fixture_id).values('id', 'home_team_id', 'away_team_id', 'season').afirst()
+        if fixture is None:
+            return None
+        await cache.aset(key, fixture, 3600)
+    return fixture
+
+
+def invalidate_fixture(fixture_id):
+    cache.delete(FIXTURE_KEY.format(fixture_id))
+
+
+def side_of(fixture, team_name):
+    if team_name == fixture['home_team_id']:
+        return CheckIn.HOME
+    if team_name == fixture['away_team_id']:
+        return CheckIn.AWAY
+    return ''
+
+
+"""
+Writes a batch of check-ins and adds them to their fixtures' counters, in
+one transaction
+"""
+def write_check_ins(events):
+    if not events:
+        return
+    with transaction.atomic():
+        already = set(CheckIn.objects.filter(
+            fixture_id__in={event.fixture_id for event in events},
+            member_id__in={event.member_id for event in events},
+            eligible=True,
+        ).values_list('fixture_id', 'member_id'))
+        CheckIn.objects.bulk_create([CheckIn(**event._asdict()) for event in events])
+
+        counts = {}
+        for event in events:
+            counter = counts.setdefault(event.fixture_id, Counter())
+            counter['scans'] += 1
+            if not event.eligible:
+                counter['turned_away'] += 1
+            elif (event.fixture_id, event.member_id) not in already:
+                already.add((event.fixture_id, event.member_id))
+                counter[f"checked_in_{event.side}"] += 1
+        for fixture_id, counter in counts.items():
+            Fixture.objects.filter(id=fixture_id).update(**{
+                field: F(field) + amount for field, amount in counter.items()
+            })
+
+
+class CheckInBuffer:
+    """
+    Collects check-ins and hands them to write_check_ins in batches of
+    batch_size, or after interval seconds, whichever comes first
+    """
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._events = []
+        self._lock = Lock()
+        self._timer = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='attendance') if interval else None
+
+    def add(self, event):
+        with self._lock:
+            self._events.append(event)
+            full = len(self._events) >= self.batch_size
+            if full:
+                batch = self._take()
+            elif self.interval and self._timer is None:
+                self._timer = Timer(self.interval, self._on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self._write(batch)
+
+    def _take(self):
+        batch, self._events = self._events, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            batch, self._events = self._events, []
+        self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        if self._writer is None:
+            write_check_ins(batch)
+        else:
+            self._writer.submit(self._write_in_worker, batch)
+
+    @staticmethod
+    def _write_in_worker(batch):
+        close_old_connections()
+        try:
+            write_check_ins(batch)
+        except Exception:
+            logger.exception("Failed to write %s check-ins", len(batch))
+        finally:
+            close_old_connections()
+
+    def pending(self):
+        with self._lock:
+            return len(self._events)
+
+    def flush(self):
+        """
+        Writes whatever is waiting in this thread, returns how many check-ins
+        """
+        with self._lock:
+            batch = self._take()
+        write_check_ins(batch)
+        return len(batch)
+
+
+_buffer = None
+_recent = None
+_buffer_lock = Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = CheckInBuffer(
+                getattr(settings, 'ATTENDANCE_BATCH_SIZE', 200),
+                getattr(settings, 'ATTENDANCE_FLUSH_MS', 500) / 1000,
+            )
+            atexit.register(_buffer.flush)
+        return _buffer
+
+
+def recent_scans():
+    global _recent
+    with _buffer_lock:
+        if _recent is None:
+            _recent = LRUCache(
+                getattr(settings, 'ATTENDANCE_RECENT_SIZE', 20000),
+                getattr(settings, 'ATTENDANCE_DUPLICATE_SECONDS', 120),
+            )
+        return _recent
+
+
+def reset():
+    """
+    Drops the buffer and the recent scans without writing, for tests
+    """
+    global _buffer, _recent
+    with _buffer_lock:
+        _buffer = None
+        _recent = None
+
+
+"""
+Records that member was scanned at fixture. Returns 'recorded', or
+'duplicate' if they were scanned there moments ago with the same outcome and
+nothing was written.
+"""
+def check_in(fixture, member_id, umpire_id, team_name, eligible):
+    side = side_of(fixture, team_name)
+    eligible = bool(eligible and side)
+    recent = recent_scans()
+    key = (fixture['id'], member_id)
+    with _buffer_lock:
+        #Someone turned away who has just been sorted out is let in
+        if recent.get(key) == eligible:
+            return 'duplicate'
+        recent.set(key, eligible)
+    get_buffer().add(CheckInEvent(fixture['id'], member_id, umpire_id, side, eligible, timezone.now()))
+    return 'recorded'
@@ -0,0 +1,37 @@
+"""
+Authentication for the API.
+ClaimsJWTAuthentication behaves exactly like SimpleJWT's JWTAuthentication,
+except that when JWT_STATELESS_READS is on, safe (read) requests get a
+TokenUser built from the token instead of loading the User row. Read views
+must then only use request.user.id and the role claims.
+Tokens caught by a revocation (see revocation.py) are refused either way,
+which is a cached lookup rather than a query.
+"""
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+
+from .revocation import is_revoked
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        if not getattr(settings, 'JWT_STATELESS_READS', False) or request.method not in SAFE_METHODS:
+            return super().authenticate(request)
+
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return TokenUser(validated_token), validated_token
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if is_revoked(validated_token.payload):
+            raise InvalidToken({'detail': 'Token has been revoked', 'code': 'token_revoked'})
+        return validated_token
\ No newline at end of file
@@ -1,5 +1,6 @@
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
+from django.db.models.functions import Lower
 
 """
 @Author: Nanda Nanduri
@@ -18,11 +19,24 @@ class EmailBackend(ModelBackend):
     instead of the default username authentication.
     
     Inherits from Django's ModelBackend which provides the basic authentication logic.
+    This is the only backend in AUTHENTICATION_BACKENDS, so a login is one
+    query on the lower(email) index (user_email_lower_idx) and one hash.
+    When there is no such user the password is still hashed once, so a
+    missing account takes as long as a wrong password.
     """
     def authenticate(self, request, email=None, password=None, **kwargs):
-        try:
-            user = User.objects.get(email=email)
-            if user.check_password(password):
-                return user
-        except User.DoesNotExist:
+        if email is None:
+            email = kwargs.get(User.USERNAME_FIELD)
+        if email is None or password is None:
             return None
+
+        user = User.objects.annotate(email_lower=Lower('email')).filter(
+            email_lower=str(email).strip().lower()
+        ).order_by('id').first()
+        if user is None:
+            User().set_password(password)
+            return None
+        #check_password rehashes with the preferred hasher when it has changed
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
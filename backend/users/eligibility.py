@@ -0,0 +1,157 @@
+"""
+The per season eligibility table.
+Whether a member may play used to be worked out from their receipts on every
+scan. Instead one Eligibility row per (member, season) is written in the same
+transaction that verifies a receipt, so a scan or a dashboard reads a single
+row found through the unique (user, season) index:
+
+    eligible   paid for the season, valid until the season ends
+    grace      eligible last season and carried over for a few days by a
+               rollover, valid until valid_until
+    lapsed     was eligible or in grace in a season that has been rolled over
+
+A season rollover is one UPDATE over the old rows, plus one bulk insert of
+grace rows if the league gives players time to pay.
+"""
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Eligibility, Receipt, Season
+from .qr_tokens import current_season, invalidate_eligibility
+
+VALID_STATUSES = (Eligibility.ELIGIBLE, Eligibility.GRACE)
+
+
+"""
+The default dates of a season, a year like '2026' runs through the calendar
+year and anything else runs for a year from today
+"""
+def season_dates(name):
+    if name.isdigit() and len(name) == 4:
+        return date(int(name), 1, 1), date(int(name), 12, 31)
+    today = timezone.localdate()
+    return today, today + timedelta(days=365)
+
+
+def get_season(name=None):
+    name = str(name or current_season())
+    starts_on, ends_on = season_dates(name)
+    season, _ = Season.objects.get_or_create(name=name, defaults={'starts_on': starts_on, 'ends_on': ends_on})
+    return season
+
+
+def _invalidate_on_commit(user_ids):
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: [invalidate_eligibility(user_id) for user_id in user_ids])
+
+
+"""
+Makes members eligible for a season (the current one by default) from a list
+of (user_id, receipt_id) pairs, with one upsert. Call it in the transaction
+that verifies the receipts so the two can't disagree.
+"""
+def grant_eligibility(grants, season=None):
+    grants = dict(grants)
+    if not grants:
+        return
+    season = season if isinstance(season, Season) else get_season(season)
+    #MySQL upserts on any unique key and refuses to be told which one
+    unique_fields = ['user', 'season'] if connection.features.supports_update_conflicts_with_target else None
+    Eligibility.objects.bulk_create(
+        [
+            Eligibility(
+                user_id=user_id, season=season, status=Eligibility.ELIGIBLE,
+                valid_until=season.ends_on, receipt_id=receipt_id,
+            )
+            for user_id, receipt_id in grants.items()
+        ],
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=['status', 'valid_until', 'receipt', 'updated_at'],
+    )
+    _invalidate_on_commit(grants)
+
+
+"""
+Takes back what grant_eligibility gave for receipts that were unverified or
+are being deleted. A row paid for by one of them moves to the member's latest
+other verified receipt if they have one, and is lapsed otherwise.
+"""
+def lapse_eligibility(receipt_ids):
+    rows = list(Eligibility.objects.filter(receipt_id__in=receipt_ids, status=Eligibility.ELIGIBLE).values_list('id', 'user_id'))
+    if not rows:
+        return
+    #Oldest first, so the latest receipt of each player wins
+    others = dict(
+        Receipt.objects.filter(player_id__in={user_id for _, user_id in rows}, is_verified=True)
+        .exclude(id__in=receipt_ids).order_by('uploaded_at', 'id').values_list('player_id', 'id')
+    )
+    lapsed = [row_id for row_id, user_id in rows if user_id not in others]
+    for row_id, user_id in rows:
+        if user_id in others:
+            Eligibility.objects.filter(id=row_id).update(receipt_id=others[user_id], updated_at=timezone.now())
+    Eligibility.objects.filter(id__in=lapsed).update(status=Eligibility.LAPSED, updated_at=timezone.now())
+    _invalidate_on_commit({user_id for _, user_id in rows})
+
+
+"""
+One member's eligibility in every season they have a row for, as
+{season: [status, valid_until]} with the date in ISO format so it can be
+cached and sent to the umpire's devices as it is
+"""
+def member_seasons(user_id):
+    return {
+        season: [row_status, valid_until.isoformat()]
+        for season, row_status, valid_until in Eligibility.objects.filter(user_id=user_id).values_list(
+            'season_id', 'status', 'valid_until',
+        )
+    }
+
+
+"""
+Whether a {season: [status, valid_until]} mapping allows playing in season on today
+"""
+def is_eligible(seasons, season=None, today=None):
+    row = seasons.get(str(season or current_season()))
+    if row is None:
+        return False
+    today = today or timezone.localdate()
+    return row[0] in VALID_STATUSES and row[1] >= today.isoformat()
+
+
+"""
+Starts a new season. Every eligible or grace row of the earlier seasons is
+lapsed with one UPDATE, and with grace_days the members eligible in
+from_season (the current season by default) get a grace row in the new one
+that lasts that many days from its start. Returns (lapsed, carried over).
+CURRENT_SEASON still has to be changed to the new season in the settings.
+"""
+def rollover(name, starts_on=None, ends_on=None, grace_days=0, from_season=None):
+    name = str(name)
+    from_season = str(from_season or current_season())
+    default_starts, default_ends = season_dates(name)
+    with transaction.atomic():
+        season, _ = Season.objects.update_or_create(name=name, defaults={
+            'starts_on': starts_on or default_starts, 'ends_on': ends_on or default_ends,
+        })
+        previous = Eligibility.objects.exclude(season=season).filter(status__in=VALID_STATUSES)
+        affected = set(previous.values_list('user_id', flat=True))
+        carried = []
+        if grace_days:
+            already = Eligibility.objects.filter(season=season).values('user_id')
+            carried = list(
+                previous.filter(season_id=from_season, status=Eligibility.ELIGIBLE)
+                .exclude(user_id__in=already).values_list('user_id', flat=True)
+            )
+            Eligibility.objects.bulk_create([
+                Eligibility(
+                    user_id=user_id, season=season, status=Eligibility.GRACE,
+                    valid_until=season.starts_on + timedelta(days=grace_days),
+                )
+                for user_id in carried
+            ], batch_size=1000)
+        lapsed = previous.update(status=Eligibility.LAPSED, updated_at=timezone.now())
+        _invalidate_on_commit(affected)
+    return lapsed, len(carried)
@@ -0,0 +1,79 @@
+"""
+Query parameter filters for the listing endpoints.
+Bad values raise a ValidationError so DRF answers with a 400.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import PlayerProfile
+
+
+def parse_bool(name, value):
+    if value.lower() in ('true', '1', 'yes'):
+        return True
+    if value.lower() in ('false', '0', 'no'):
+        return False
+    raise ValidationError({name: 'Must be true or false.'})
+
+
+def parse_int(name, value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: 'Must be a number.'})
+
+
+"""
+Turns ?from= or ?to= into an aware datetime and whether it was a plain date.
+Plain dates cover the whole day, so to=2025-03-01 means up to the start of
+2025-03-02. Comparing against datetimes (rather than uploaded_at__date)
+keeps the filter on the index.
+"""
+def parse_bound(name, value, end=False):
+    try:
+        #parse_datetime accepts a bare date too, so check for a date first
+        day = parse_date(value)
+        when = parse_datetime(value) if day is None else None
+    except ValueError:
+        when = day = None
+    if when is None and day is None:
+        raise ValidationError({name: 'Must be a date (YYYY-MM-DD) or a datetime.'})
+
+    if day is not None:
+        when = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when, day is not None
+
+
+"""
+Filters receipts by ?team=, ?group=, ?verified=, ?uploaded_by=, ?from= and ?to=
+Team and group are matched through a subquery on the player profiles so a
+player with more than one profile doesn't show up twice.
+"""
+def filter_receipts(receipts, params):
+    team = params.get('team')
+    group = params.get('group')
+    if team or group:
+        profiles = PlayerProfile.objects.all()
+        if team:
+            profiles = profiles.filter(team_name=team)
+        if group:
+            profiles = profiles.filter(group=group)
+        receipts = receipts.filter(player__in=profiles.values('user'))
+
+    if params.get('verified'):
+        receipts = receipts.filter(is_verified=parse_bool('verified', params['verified']))
+    if params.get('uploaded_by'):
+        receipts = receipts.filter(uploaded_by_id=parse_int('uploaded_by', params['uploaded_by']))
+
+    if params.get('from'):
+        start, _ = parse_bound('from', params['from'])
+        receipts = receipts.filter(uploaded_at__gte=start)
+    if params.get('to'):
+        end, whole_day = parse_bound('to', params['to'], end=True)
+        receipts = receipts.filter(uploaded_at__lt=end) if whole_day else receipts.filter(uploaded_at__lte=end)
+    return receipts
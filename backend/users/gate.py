@@ -0,0 +1,271 @@
+"""
+Offline gate checks.
+Grounds often have poor signal, so instead of a round trip per player the
+umpire's device downloads a snapshot of a fixture before the match: every
+player of the two teams with their name, thumbnail url and eligibility for
+the season. Scans are then looked up on the device, and recorded there
+until they can be uploaded.
+
+The snapshot carries a version, a signed cursor holding the season, the time
+it was read and each team's roster_version. Sending it back to the delta
+endpoint returns only what changed since:
+
+    - every player of a team whose roster_version moved (someone joined,
+      left or changed), which replaces the device's copy of that team
+    - the players of the other teams whose eligibility row changed
+
+and a new version. The device can't check the version's signature itself,
+it keeps the cursor from being edited to skip changes.
+
+The body of a snapshot or delta is signed as well: signature is the hex
+HMAC-SHA256 of every other field as canonical JSON (keys sorted, no spaces,
+ASCII only). The key is GATE_SNAPSHOT_KEY, provisioned on the umpires'
+devices so they can tell a copy edited in storage or by a proxy, or one
+derived from SECRET_KEY that only the server can check (check_snapshot).
+
+Offline scans are uploaded in bulk. Each token's signature is checked then,
+the server decides eligibility from the current row (its status now, its
+valid_until against the scan date, status changes aren't dated so a row
+lapsed since the scan counts as lapsed) and the scans are stored as GateScan
+rows with one insert.
+"""
+import hashlib
+import hmac
+import json
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import salted_hmac
+from django.db.models import F, FilteredRelation, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .eligibility import VALID_STATUSES
+from .media import media_url
+from .models import Eligibility, GateScan, PlayerProfile, Team, User
+from .qr_tokens import InvalidQRToken, current_season, read_token
+from .thumbnails import current_thumbnails, thumbnail_sizes
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _signer():
+    return signing.TimestampSigner(salt='users.gate-snapshot')
+
+
+def make_version(season, rosters, as_of):
+    return _signer().sign_object({'s': season, 'r': rosters, 'at': as_of.timestamp()}, compress=True)
+
+
+"""
+Returns (season, {team: roster_version}, as_of) from a version, raises
+SnapshotError if it was tampered with or is too old to catch up from
+"""
+def read_version(version):
+    try:
+        data = _signer().unsign_object(version, max_age=getattr(settings, 'GATE_SNAPSHOT_MAX_AGE', 7 * 24 * 3600))
+    except signing.SignatureExpired:
+        raise SnapshotError('Snapshot is too old, download a new one')
+    except signing.BadSignature:
+        raise SnapshotError('Snapshot version is not valid')
+    return data['s'], data['r'], datetime.fromtimestamp(data['at'], dt_timezone.utc)
+
+
+def _body_key():
+    key = getattr(settings, 'GATE_SNAPSHOT_KEY', None)
+    if key:
+        return key.encode()
+    #Never the secret key itself, it isn't handed out
+    return salted_hmac('users.gate-snapshot-body', 'key', algorithm='sha256').digest()
+
+
+def canonical_body(body):
+    fields = {name: value for name, value in body.items() if name != 'signature'}
+    return json.dumps(fields, sort_keys=True, separators=(',', ':'), ensure_ascii=True).encode()
+
+
+def sign_snapshot(body):
+    body['signature'] = hmac.new(_body_key(), canonical_body(body), hashlib.sha256).hexdigest()
+    return body
+
+
+"""
+Whether a snapshot or delta body (as the device parsed it) is the one the
+server signed
+"""
+def check_snapshot(body):
+    expected = hmac.new(_body_key(), canonical_body(body), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, str(body.get('signature', '')))
+
+
+def _photo(profile):
+    thumbnails = current_thumbnails(profile)
+    if thumbnails:
+        smallest = min(thumbnails, key=lambda size: thumbnail_sizes().get(size, 0))
+        return thumbnails[smallest]
+    return profile.profile_photo.name if profile.profile_photo else None
+
+
+"""
+The players of the teams with their eligibility in season, in one query.
+With since only the players whose eligibility row changed after it.
+"""
+def member_rows(request, teams, season, since=None):
+    profiles = PlayerProfile.objects.filter(team_name__in=teams).select_related('user').annotate(
+        season_row=FilteredRelation('user__eligibility', condition=Q(user__eligibility__season_id=season)),
+        eligibility_status=F('season_row__status'),
+        eligible_until=F('season_row__valid_until'),
+        eligibility_updated=F('season_row__updated_at'),
+    ).order_by('team_name', 'id')
+    if since is not None:
+        profiles = profiles.filter(eligibility_updated__gte=since)
+
+    today = timezone.localdate()
+    rows = []
+    for profile in profiles:
+        valid_until = profile.eligible_until
+        rows.append({
+            'id': profile.user_id,
+            'name': f"{profile.user.fname} {profile.user.sname}",
+            'team': profile.team_name,
+            'status': profile.eligibility_status,
+            'valid_until': valid_until.isoformat() if valid_until else None,
+            'eligible': profile.eligibility_status in VALID_STATUSES and valid_until >= today,
+            'photo': media_url(request, _photo(profile)),
+        })
+    return rows
+
+
+def _by_team(rows, teams):
+    grouped = {team: [] for team in teams}
+    for row in rows:
+        grouped[row.pop('team')].append(row)
+    return grouped
+
+
+"""
+The snapshot of a fixture between teams (two team names) for season
+"""
+def build_snapshot(request, teams, season=None):
+    season = str(season or current_season())
+    rosters = dict(Team.objects.filter(name__in=teams).values_list('name', 'roster_version'))
+    missing = [team for team in teams if team not in rosters]
+    if missing:
+        raise SnapshotError(f"Unknown team: {', '.join(missing)}")
+    #Read before the rows so a change made while they are read is sent again
+    as_of = timezone.now()
+    return sign_snapshot({
+        'version': make_version(season, rosters, as_of),
+        'season': season,
+        'generated_at': as_of.isoformat(),
+        'teams': _by_team(member_rows(request, teams, season), teams),
+    })
+
+
+"""
+What changed since the snapshot with the given version, see the module docstring
+"""
+def build_delta(request, version):
+    season, rosters, since = read_version(version)
+    current = dict(Team.objects.filter(name__in=rosters).values_list('name', 'roster_version'))
+    changed = [team for team in rosters if current.get(team) != rosters[team]]
+    unchanged = [team for team in rosters if team not in changed]
+
+    as_of = timezone.now()
+    members = member_rows(request, unchanged, season, since=since) if unchanged else []
+    return sign_snapshot({
+        'version': make_version(season, {team: current.get(team, 0) for team in rosters}, as_of),
+        'season': season,
+        'generated_at': as_of.isoformat(),
+        'teams': _by_team(member_rows(request, changed, season), changed) if changed else {},
+        'members': members,
+    })
+
+
+def max_scans():
+    return getattr(settings, 'GATE_OFFLINE_MAX_SCANS', 500)
+
+
+def _check_scan(item, now):
+    if not isinstance(item, dict):
+        raise InvalidQRToken('Each scan must be an object')
+    scanned_at = parse_datetime(str(item.get('scanned_at', '')))
+    if scanned_at is None:
+        raise InvalidQRToken('scanned_at must be an ISO date and time')
+    if timezone.is_naive(scanned_at):
+        scanned_at = scanned_at.replace(tzinfo=dt_timezone.utc)
+    #A little slack for the device's clock
+    if scanned_at > now + timedelta(minutes=5):
+        raise InvalidQRToken('scanned_at is in the future')
+    if scanned_at < now - timedelta(seconds=getattr(settings, 'GATE_SNAPSHOT_MAX_AGE', 7 * 24 * 3600)):
+        raise InvalidQRToken('Scan is too old to record')
+    parsed = read_token(str(item.get('token', '')), now=scanned_at.timestamp())
+    return parsed, scanned_at
+
+
+"""
+Records scans made offline, each {'id': uuid, 'token', 'scanned_at',
+'eligible': what the device showed}. Returns a result per scan in the same
+order: recorded (with the server's decision and whether the device agreed),
+duplicate (uploaded before) or rejected with the reason.
+"""
+def record_offline_scans(umpire, items):
+    now = timezone.now()
+    results = []
+    checked = []
+    for item in items:
+        client_id = item.get('id') if isinstance(item, dict) else None
+        try:
+            try:
+                client_id = str(uuid.UUID(str(client_id)))
+            except ValueError:
+                raise InvalidQRToken('Each scan needs a UUID id')
+            parsed, scanned_at = _check_scan(item, now)
+        except InvalidQRToken as e:
+            results.append({'id': client_id, 'status': 'rejected', 'error': str(e)})
+            continue
+        result = {'id': client_id, 'status': 'recorded'}
+        results.append(result)
+        checked.append((result, parsed, scanned_at, item.get('eligible')))
+
+    member_ids = {parsed.member_id for _, parsed, _, _ in checked}
+    existing_members = set(User.objects.filter(id__in=member_ids).values_list('id', flat=True))
+    rows = {
+        (row.user_id, row.season_id): row
+        for row in Eligibility.objects.filter(
+            user_id__in=existing_members, season_id__in={parsed.season for _, parsed, _, _ in checked},
+        ).only('user_id', 'season_id', 'status', 'valid_until')
+    }
+    seen = {
+        str(client_id) for client_id in GateScan.objects.filter(
+            client_id__in=[result['id'] for result, _, _, _ in checked],
+        ).values_list('client_id', flat=True)
+    }
+
+    scans = []
+    for result, parsed, scanned_at, device_eligible in checked:
+        if parsed.member_id not in existing_members:
+            result.update(status='rejected', error='User not found')
+            continue
+        if result['id'] in seen:
+            result['status'] = 'duplicate'
+            continue
+        row = rows.get((parsed.member_id, parsed.season))
+        #The current status, only valid_until is checked as of the scan
+        eligible = row is not None and row.is_valid(timezone.localdate(scanned_at))
+        scan = GateScan(
+            client_id=result['id'], umpire=umpire, member_id=parsed.member_id, season=parsed.season,
+            scanned_at=scanned_at, eligible=eligible,
+            device_eligible=device_eligible if isinstance(device_eligible, bool) else None,
+        )
+        seen.add(result['id'])
+        scans.append(scan)
+        result.update(member=parsed.member_id, eligible=eligible, agreed=device_eligible in (None, eligible))
+
+    #ignore_conflicts covers the same upload racing itself
+    GateScan.objects.bulk_create(scans, ignore_conflicts=True)
+    return results
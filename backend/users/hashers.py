@@ -0,0 +1,41 @@
+"""
+Password hashers tuned from settings.
+Login time on match day mornings is mostly spent hashing, so the preferred
+hasher is scrypt (memory hard, in the standard library) with its cost taken
+from PASSWORD_SCRYPT instead of Django's fixed defaults:
+
+    PASSWORD_SCRYPT = {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1}
+
+The algorithm name is still "scrypt", so hashes made by Django's own scrypt
+hasher verify as normal. Older PBKDF2 hashes keep working as long as their
+hasher stays in PASSWORD_HASHERS, and since this hasher is first each one is
+rehashed with it on the user's next successful login. Changing the cost
+rehashes the same way (see must_update).
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import ScryptPasswordHasher
+
+DEFAULT_SCRYPT = {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1}
+
+
+def scrypt_setting(name):
+    return getattr(settings, 'PASSWORD_SCRYPT', {}).get(name, DEFAULT_SCRYPT[name])
+
+
+class ConfigurableScryptPasswordHasher(ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return scrypt_setting('work_factor')
+
+    @property
+    def block_size(self):
+        return scrypt_setting('block_size')
+
+    @property
+    def parallelism(self):
+        return scrypt_setting('parallelism')
+
+    @property
+    def maxmem(self):
+        #scrypt needs 128 * n * r bytes, OpenSSL's default cap is 32MB
+        return 2 * 128 * self.work_factor * self.block_size
@@ -0,0 +1,289 @@
+"""
+Request level performance metrics.
+RequestMetricsMiddleware times every request and records, per view (the url
+name, so the number of series stays bounded):
+
+    - the latency, as a histogram
+    - how many queries it ran and how long they took, through an execute
+      wrapper on every database connection (see install_query_recorder)
+    - the time spent serializing (serializer.data in the listings, the JSON
+      renderer for every DRF response, see timed_serialization)
+    - the size of the response body
+
+They are kept in memory per process and served as Prometheus text at
+/metrics (metrics_view), so each worker is scraped on its own. A request
+that runs more than REQUEST_QUERY_BUDGET queries is counted and logged as a
+warning with its numbers, that's usually an N+1 come back.
+
+Request logs are sampled, one line of JSON per request for
+REQUEST_LOG_SAMPLE_RATE of them, and always for the slow, failed and over
+budget ones. log_event() does the same for events in the views.
+
+The request's numbers live in a ContextVar, which asgiref copies into the
+threads sync_to_async runs ORM calls in, so the async views are measured the
+same way.
+"""
+import json
+import logging
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger('users.requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'query_time', 'serialize_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.serialize_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - start
+
+
+"""
+Adds record_query to a connection once. Connected to connection_created in
+UsersConfig.ready(), the middleware adds it to the connections that were
+already open when it was loaded.
+"""
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def timed_serialization():
+    stats = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.serialize_time += time.perf_counter() - start
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed_serialization():
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def lines(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(labels)} {value}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        #labels -> [count per bucket (the last is +Inf), sum]
+        self.values = {}
+
+    def observe(self, labels, value):
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+        row[0][bisect_left(self.buckets, value)] += 1
+        row[1] += value
+
+    def lines(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels((*labels, ('le', bound)))} {cumulative}"
+            yield f"{self.name}_sum{_labels(labels)} {total}"
+            yield f"{self.name}_count{_labels(labels)} {cumulative}"
+
+
+def _metrics():
+    return [
+        Counter('http_requests_total', "Requests answered, by view, method and status"),
+        Counter('http_requests_over_query_budget_total', "Requests that ran more queries than REQUEST_QUERY_BUDGET"),
+        Histogram('http_request_duration_seconds', "Time to answer a request", LATENCY_BUCKETS),
+        Histogram('http_request_db_queries', "Queries run per request", QUERY_BUCKETS),
+        Histogram('http_request_db_seconds', "Time spent in queries per request", LATENCY_BUCKETS),
+        Histogram('http_request_serialize_seconds', "Time spent serializing per request", LATENCY_BUCKETS),
+        Histogram('http_response_size_bytes', "Size of the response body", SIZE_BUCKETS),
+    ]
+
+
+_lock = Lock()
+_registry = {metric.name: metric for metric in _metrics()}
+
+
+def reset_metrics():
+    """
+    Starts every metric from zero, for tests
+    """
+    global _registry
+    with _lock:
+        _registry = {metric.name: metric for metric in _metrics()}
+
+
+def render_metrics():
+    with _lock:
+        out = []
+        for metric in _registry.values():
+            out.append(f"# HELP {metric.name} {metric.help_text}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(metric.lines())
+    return '\n'.join(out) + '\n'
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        #404s and the like, one series for all of them
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+def response_size(response):
+    if getattr(response, 'streaming', False):
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+def _sampled(rate):
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+"""
+Logs event with fields as one line of JSON, for a sample of
+REQUEST_LOG_SAMPLE_RATE of the calls below WARNING and for all the others
+"""
+def log_event(log, event, level=logging.INFO, **fields):
+    if level < logging.WARNING and not _sampled(getattr(settings, 'REQUEST_LOG_SAMPLE_RATE', 0.01)):
+        return
+    fields = {'event': event, **fields}
+    log.log(level, '%s', json.dumps(fields, default=str, sort_keys=True), extra={'fields': fields})
+
+
+def record_request(request, response, stats):
+    elapsed = time.perf_counter() - stats.started
+    view = view_label(request)
+    size = response_size(response)
+    budget = getattr(settings, 'REQUEST_QUERY_BUDGET', None)
+    over_budget = budget is not None and stats.queries > budget
+
+    with _lock:
+        _registry['http_requests_total'].inc((('view', view), ('method', request.method), ('status', response.status_code)))
+        _registry['http_request_duration_seconds'].observe((('view', view), ('method', request.method)), elapsed)
+        _registry['http_request_db_queries'].observe((('view', view),), stats.queries)
+        _registry['http_request_db_seconds'].observe((('view', view),), stats.query_time)
+        _registry['http_request_serialize_seconds'].observe((('view', view),), stats.serialize_time)
+        _registry['http_response_size_bytes'].observe((('view', view),), size)
+        if over_budget:
+            _registry['http_requests_over_query_budget_total'].inc((('view', view),))
+
+    slow = elapsed * 1000 >= getattr(settings, 'REQUEST_SLOW_MS', 1000)
+    level = logging.WARNING if over_budget or slow or response.status_code >= 500 else logging.INFO
+    log_event(
+        logger, 'over_query_budget' if over_budget else 'request', level,
+        view=view, method=request.method, status=response.status_code,
+        ms=round(elapsed * 1000, 2), queries=stats.queries, db_ms=round(stats.query_time * 1000, 2),
+        serialize_ms=round(stats.serialize_time * 1000, 2), bytes=size,
+    )
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the numbers of every request, see the module docstring. Put it
+    first in MIDDLEWARE so the other middleware is timed too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record_request(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record_request(request, response, stats)
+        return response
+
+
+"""
+The metrics in the Prometheus text format, for the addresses in
+METRICS_ALLOWED_IPS (the scraper, not the public)
+"""
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1']):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,76 @@
+"""
+Makes the profile photo thumbnails for photos uploaded before the thumbnail
+pipeline existed, or for every photo with --force (after changing
+PROFILE_THUMBNAIL_SIZES or PROFILE_THUMBNAIL_FORMAT).
+
+    python manage.py backfill_thumbnails
+    python manage.py backfill_thumbnails --force --processes 4
+
+Resizing is CPU bound, so the photos are read here and handed to a process
+pool a chunk at a time, then every profile in the chunk is saved with one
+bulk_update. bulk_update sends no signals, so the cached eligibility and the
+rosters of their teams are refreshed here.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from users.models import PlayerProfile
+from users.qr_tokens import invalidate_eligibility
+from users.teams import refresh_teams
+from users.thumbnails import make_derivatives, needs_thumbnails, read_photo, store_derivatives, thumbnail_format, thumbnail_sizes
+
+
+class Command(BaseCommand):
+    help = "Make missing profile photo thumbnails"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Remake thumbnails that already exist")
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        profiles = (
+            PlayerProfile.objects.exclude(profile_photo='').exclude(profile_photo__isnull=True)
+            .only('id', 'user_id', 'profile_photo', 'photo_thumbnails', 'team_name').order_by('id')
+        )
+        sizes, image_format = thumbnail_sizes(), thumbnail_format()
+        done = failed = 0
+
+        with ProcessPoolExecutor(max_workers=options['processes']) as pool:
+            chunk = []
+            for profile in profiles.iterator(chunk_size=options['chunk_size']):
+                if options['force'] or needs_thumbnails(profile):
+                    chunk.append(profile)
+                if len(chunk) >= options['chunk_size']:
+                    made, errors = self.process(pool, chunk, sizes, image_format)
+                    done, failed, chunk = done + made, failed + errors, []
+            if chunk:
+                made, errors = self.process(pool, chunk, sizes, image_format)
+                done, failed = done + made, failed + errors
+
+        self.stdout.write(self.style.SUCCESS(f"Made thumbnails for {done} photos, {failed} failed"))
+
+    def process(self, pool, profiles, sizes, image_format):
+        futures = []
+        for profile in profiles:
+            try:
+                futures.append((profile, pool.submit(make_derivatives, read_photo(profile), sizes, image_format)))
+            except OSError as e:
+                self.stderr.write(f"Player profile {profile.id}: {e}")
+
+        updated = []
+        for profile, future in futures:
+            try:
+                derivatives = future.result()
+            except Exception as e:
+                self.stderr.write(f"Player profile {profile.id}: {e}")
+                continue
+            profile.photo_thumbnails = store_derivatives(profile.profile_photo.name, derivatives, image_format)
+            updated.append(profile)
+
+        PlayerProfile.objects.bulk_update(updated, ['photo_thumbnails'])
+        for profile in updated:
+            invalidate_eligibility(profile.user_id)
+        refresh_teams({profile.team_name for profile in updated}, roster=True)
+        return len(updated), len(profiles) - len(updated)
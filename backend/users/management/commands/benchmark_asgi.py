@@ -0,0 +1,251 @@
+"""
+Runs the same load against the sync (WSGI) views and their async (ASGI)
+versions in async_views.py and reports both side by side.
+
+    python manage.py benchmark_asgi --concurrency 64 --requests 2000
+    python manage.py benchmark_asgi --wsgi-url http://127.0.0.1:8000 --asgi-url http://127.0.0.1:8001
+
+Without urls both sides run in this process: the WSGI side is the Django
+test client on --threads threads (a threaded WSGI server), the ASGI side is
+the async test client with --concurrency requests in flight on one event
+loop. With urls the same load is sent to two running servers, for example
+gunicorn --threads 8 backend.wsgi and uvicorn backend.asgi, which is the
+number to trust for a deployment on MySQL. In process the database is
+usually local and answers at once, which hides what ASGI is for, so
+--db-latency adds a delay to every query to stand in for the round trip to
+a database server.
+Each endpoint reports requests/sec, p50/p95 latency, errors and the most
+threads the process had at once. Seeded users have @bench-asgi.invalid
+emails and are removed afterwards unless --keep is passed, so only run it
+against a development database.
+"""
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from users.models import ClubAdmin, PlayerProfile, Receipt, Team, UmpireProfile, User
+from users.qr_tokens import make_token
+from users.tokens import RoleRefreshToken
+
+BENCH_DOMAIN = '@bench-asgi.invalid'
+
+#endpoint: (sync url name, async url name, who calls it)
+ENDPOINTS = {
+    'scan-token': ('scan-qr-token', 'scan-qr-token-async', 'umpire'),
+    'team-players': ('team-players', 'team-players-async', 'captain'),
+    'player-qr-code': ('player-qr-code', 'player-qr-code-async', 'player'),
+    'receipts-unverified': ('receipts-unverified', 'receipts-unverified-async', 'admin'),
+}
+
+
+def percentile(timings, share):
+    return timings[min(len(timings) - 1, int(len(timings) * share))]
+
+
+class ThreadPeak:
+    """
+    Samples threading.active_count() in the background and keeps the highest
+    """
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = "Compare the sync views under WSGI with their async versions under ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help="Requests per endpoint and side")
+        parser.add_argument('--concurrency', type=int, default=32, help="Requests in flight at once")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads in process")
+        parser.add_argument('--players', type=int, default=25)
+        parser.add_argument('--db-latency', type=float, default=0, help="Milliseconds added to every query in process")
+        parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+        parser.add_argument('--wsgi-url', help="Base url of a running WSGI server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--asgi-url', help="Base url of a running ASGI server")
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded users afterwards")
+
+    def handle(self, *args, **options):
+        if bool(options['wsgi_url']) != bool(options['asgi_url']):
+            raise CommandError("Give both --wsgi-url and --asgi-url, or neither")
+        callers = self.seed(options['players'])
+        try:
+            for endpoint in options['endpoints']:
+                sync_name, async_name, caller = ENDPOINTS[endpoint]
+                method, body, headers = self.request_for(endpoint, callers, caller)
+                self.stdout.write(f"{endpoint}:")
+                if options['wsgi_url']:
+                    sides = [
+                        ('wsgi', lambda: self.run_url(options['wsgi_url'], sync_name, method, body, headers, options)),
+                        ('asgi', lambda: self.run_url(options['asgi_url'], async_name, method, body, headers, options)),
+                    ]
+                else:
+                    sides = [
+                        ('wsgi', lambda: self.in_process(self.run_wsgi, sync_name, method, body, headers, options)),
+                        ('asgi', lambda: self.in_process(
+                            lambda *args: asyncio.run(self.run_asgi(*args)), async_name, method, body, headers, options,
+                        )),
+                    ]
+                for label, run in sides:
+                    with ThreadPeak() as threads:
+                        started = time.perf_counter()
+                        timings, errors = run()
+                        elapsed = time.perf_counter() - started
+                    self.stdout.write(self.line(label, sorted(timings), elapsed, errors, threads.peak))
+        finally:
+            close_old_connections()
+            if not options['keep']:
+                User.objects.filter(email__endswith=BENCH_DOMAIN).delete()
+
+    def seed(self, players):
+        team = Team.objects.order_by('name').values_list('name', flat=True).first()
+        if team is None:
+            raise CommandError("There are no teams to seed players into")
+        User.objects.filter(email__endswith=BENCH_DOMAIN).delete()
+        users = User.objects.bulk_create([
+            User(email=f"bench{n}{BENCH_DOMAIN}", password='!', fname=f"Bench{n}", sname='Async', id_num=f"BASGI{n}")
+            for n in range(players + 2)
+        ])
+        #MySQL doesn't hand back the ids from bulk_create, so read them again
+        users = list(User.objects.filter(email__endswith=BENCH_DOMAIN).order_by('id'))
+        admin, umpire, captain, *members = users
+        ClubAdmin.objects.create(user=admin)
+        UmpireProfile.objects.create(user=umpire)
+        PlayerProfile.objects.bulk_create([
+            PlayerProfile(user=user, team_name=team, group='A', is_team_admin=user is captain)
+            for user in (captain, *members)
+        ])
+        Receipt.objects.bulk_create([
+            Receipt(player=user, uploaded_by=captain, file=f"receipts/bench-asgi-{user.id}.pdf")
+            for user in members
+        ])
+        return {
+            'admin': admin, 'umpire': umpire, 'captain': captain,
+            'player': members[0] if members else captain, 'members': members or [captain],
+        }
+
+    def request_for(self, endpoint, callers, caller):
+        token = RoleRefreshToken.for_user(callers[caller]).access_token
+        headers = {'Authorization': f"Bearer {token}"}
+        if endpoint == 'scan-token':
+            member = callers['members'][0]
+            return 'POST', json.dumps({'token': make_token(member.id, 0)}), headers
+        return 'GET', None, headers
+
+    def in_process(self, run, *args):
+        latency = args[-1]['db_latency'] / 1000
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        #Each thread has its own connection, new ones get the delay as they open
+        def add_latency(connection, **kwargs):
+            connection.execute_wrappers.append(slow_query)
+
+        if latency:
+            connection.execute_wrappers.append(slow_query)
+            connection_created.connect(add_latency)
+        try:
+            #The test clients send Host: testserver
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                return run(*args)
+        finally:
+            if latency:
+                connection_created.disconnect(add_latency)
+                connection.execute_wrappers.remove(slow_query)
+
+    def run_wsgi(self, name, method, body, headers, options):
+        url = reverse(name)
+        local = threading.local()
+
+        def send(_):
+            if not hasattr(local, 'client'):
+                local.client = Client(headers=headers)
+            start = time.perf_counter()
+            if method == 'POST':
+                res = local.client.post(url, body, content_type='application/json')
+            else:
+                res = local.client.get(url)
+            return (time.perf_counter() - start) * 1000, res.status_code
+
+        def close(_):
+            close_old_connections()
+            #Hold the worker so every thread gets one
+            time.sleep(0.05)
+
+        with ThreadPoolExecutor(options['threads']) as pool:
+            results = list(pool.map(send, range(options['requests'])))
+            list(pool.map(close, range(options['threads'])))
+        return [timing for timing, _ in results], sum(code >= 400 for _, code in results)
+
+    async def run_asgi(self, name, method, body, headers, options):
+        url = reverse(name)
+        client = AsyncClient()
+        slots = asyncio.Semaphore(options['concurrency'])
+
+        async def send():
+            #ASGIHandler gives each request its own context, the test client doesn't
+            async with slots, ThreadSensitiveContext():
+                start = time.perf_counter()
+                if method == 'POST':
+                    res = await client.post(url, body, content_type='application/json', headers=headers)
+                else:
+                    res = await client.get(url, headers=headers)
+                return (time.perf_counter() - start) * 1000, res.status_code
+
+        results = await asyncio.gather(*(send() for _ in range(options['requests'])))
+        return [timing for timing, _ in results], sum(code >= 400 for _, code in results)
+
+    def run_url(self, base, name, method, body, headers, options):
+        url = base.rstrip('/') + reverse(name)
+        data = body.encode() if body else None
+
+        def send(_):
+            request = Request(url, data=data, method=method, headers={**headers, 'Content-Type': 'application/json'})
+            start = time.perf_counter()
+            try:
+                with urlopen(request) as response:
+                    response.read()
+                    code = response.status
+            except HTTPError as e:
+                code = e.code
+            return (time.perf_counter() - start) * 1000, code
+
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(send, range(options['requests'])))
+        return [timing for timing, _ in results], sum(code >= 400 for _, code in results)
+
+    def line(self, label, timings, elapsed, errors, threads):
+        if not timings:
+            return f"  {label}: no requests finished"
+        return (
+            f"  {label}: {len(timings)} requests, {len(timings) / elapsed:.1f}/s, "
+            f"p50 {statistics.median(timings):.1f} ms, p95 {percentile(timings, 0.95):.1f} ms, "
+            f"{errors} errors, {threads} threads"
+        )
@@ -0,0 +1,129 @@
+"""
+Seeds a realistic club (every team, a captain per team, a few receipts per
+player) and reports the EXPLAIN plan and latency of the hot lookups.
+
+    python manage.py benchmark_lookups
+    python manage.py benchmark_lookups --compare    # without, then with the indexes
+
+--compare drops the indexes declared on PlayerProfile and Receipt, measures,
+and puts them back, so only run it against a development database.
+Seeded users have @bench.invalid emails and are removed afterwards unless
+--keep is passed.
+"""
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from users.filters import filter_receipts
+from users.models import User, PlayerProfile, Receipt, Team
+
+BENCH_DOMAIN = '@bench.invalid'
+
+
+class Command(BaseCommand):
+    help = "Seed a benchmark dataset and report EXPLAIN plans and latencies for the hot lookups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players-per-team', type=int, default=25)
+        parser.add_argument('--receipts-per-player', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--compare', action='store_true', help="Measure without the model indexes first")
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded rows afterwards")
+
+    def handle(self, *args, **options):
+        if not User.objects.filter(email__endswith=BENCH_DOMAIN).exists():
+            self.seed(options['players_per_team'], options['receipts_per_player'])
+
+        try:
+            if options['compare']:
+                with connection.schema_editor() as editor:
+                    for model in (PlayerProfile, Receipt):
+                        for index in model._meta.indexes:
+                            editor.remove_index(model, index)
+                try:
+                    self.report('without indexes', options['repeat'])
+                finally:
+                    with connection.schema_editor() as editor:
+                        for model in (PlayerProfile, Receipt):
+                            for index in model._meta.indexes:
+                                editor.add_index(model, index)
+            self.report('with indexes', options['repeat'])
+        finally:
+            if not options['keep']:
+                User.objects.filter(email__endswith=BENCH_DOMAIN).delete()
+
+    def seed(self, players_per_team, receipts_per_player):
+        teams = list(Team.objects.values_list('name', flat=True))
+        groups = [group for group, _ in PlayerProfile.GROUP_CHOICES]
+        User.objects.bulk_create([
+            User(
+                email=f"bench{n}{BENCH_DOMAIN}", password='!', fname=f"Bench{n}",
+                sname='Player', id_num=f"BENCH{n}",
+            )
+            for n in range(len(teams) * players_per_team)
+        ], batch_size=1000)
+        #MySQL doesn't hand back the ids from bulk_create, so read them again
+        users = list(User.objects.filter(email__endswith=BENCH_DOMAIN).order_by('id'))
+
+        profiles = []
+        captains = {}
+        for n, user in enumerate(users):
+            team = teams[n % len(teams)]
+            is_captain = team not in captains
+            if is_captain:
+                captains[team] = user
+            profiles.append(PlayerProfile(
+                user=user, team_name=team, group=groups[teams.index(team) % len(groups)],
+                is_team_admin=is_captain,
+            ))
+        PlayerProfile.objects.bulk_create(profiles, batch_size=1000)
+
+        now = timezone.now()
+        Receipt.objects.bulk_create([
+            Receipt(
+                player=profile.user, uploaded_by=captains[profile.team_name],
+                file=f"receipts/bench_{profile.user.id}_{k}.pdf",
+                is_verified=random.random() < 0.7,
+            )
+            for profile in profiles
+            for k in range(receipts_per_player)
+        ], batch_size=1000)
+        receipts = list(Receipt.objects.filter(player__email__endswith=BENCH_DOMAIN).only('id'))
+        #auto_now_add stamps every row with now, spread them over two seasons
+        for receipt in receipts:
+            receipt.uploaded_at = now - timedelta(minutes=random.randint(0, 2 * 365 * 24 * 60))
+        Receipt.objects.bulk_update(receipts, ['uploaded_at'], batch_size=1000)
+        self.stdout.write(f"Seeded {len(users)} players and {len(receipts)} receipts")
+
+    def lookups(self):
+        sample = PlayerProfile.objects.filter(user__email__endswith=BENCH_DOMAIN, is_team_admin=True).first()
+        team = sample.team_name
+        return [
+            ('team players', PlayerProfile.objects.filter(team_name=team)),
+            ('unverified queue', Receipt.objects.filter(is_verified=False).order_by('-uploaded_at', '-id')[:50]),
+            ('player latest verified', Receipt.objects.filter(
+                player_id=sample.user_id, is_verified=True).order_by('-uploaded_at')[:1]),
+            ('uploader latest verified', Receipt.objects.filter(
+                uploaded_by_id=sample.user_id, is_verified=True).order_by('-uploaded_at')[:1]),
+            ('team receipts', filter_receipts(Receipt.objects.all(), {'team': team}).order_by('-uploaded_at', '-id')[:50]),
+        ]
+
+    def report(self, label, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {label} =="))
+        for name, queryset in self.lookups():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: median {statistics.median(timings):.2f} ms, p95 {p95:.2f} ms"
+            ))
+            self.stdout.write(queryset.explain())
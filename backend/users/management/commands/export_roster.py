@@ -0,0 +1,42 @@
+"""
+Exports every player and member as a roster spreadsheet, in the same columns
+import_roster reads, see users/roster.py.
+
+    python manage.py export_roster -o league.csv
+    python manage.py export_roster --team Phoenix -o phoenix.xlsx
+
+The rows are written as they are read from the database. Without -o the CSV
+goes to stdout.
+"""
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.roster import RosterError, csv_lines, export_rows, write_xlsx
+
+
+class Command(BaseCommand):
+    help = "Export players and members as a CSV or XLSX roster"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', help="File to write, .csv or .xlsx")
+        parser.add_argument('--team')
+
+    def handle(self, *args, **options):
+        rows = export_rows(options['team'])
+        output = options['output']
+        if not output:
+            for line in csv_lines(rows):
+                self.stdout.write(line, ending='')
+            return
+
+        try:
+            if os.path.splitext(output)[1].lower() == '.xlsx':
+                with open(output, 'wb') as handle:
+                    write_xlsx(rows, handle)
+            else:
+                with open(output, 'w', newline='') as handle:
+                    handle.writelines(csv_lines(rows))
+        except (OSError, RosterError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {output}"))
@@ -0,0 +1,82 @@
+"""
+Removes media blobs that no row points at any more.
+
+    python manage.py gc_media --dry-run
+    python manage.py gc_media --min-age 48
+
+Only files inside the hash shards of the content addressed folders are
+looked at (receipts/, qr_codes/ and profile_photos/ plus the thumbnails made
+next to the photos), so files from before that storage are left alone.
+Files younger than --min-age hours are kept, since an upload is written
+before the row that points at it is committed. Leftover temporary files from
+interrupted uploads are removed under the same rule, and chunked receipt
+uploads left idle past RECEIPT_UPLOAD_EXPIRY are cancelled first.
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.models import PlayerProfile, ReceiptUpload
+from users.storage import TEMP_DIR, content_addressed_fields, content_storage, in_shards
+from users.uploads import discard_upload, expired_uploads, part_path
+
+
+class Command(BaseCommand):
+    help = "Delete content addressed media files that are no longer referenced"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only list what would be deleted")
+        parser.add_argument('--min-age', type=float, default=24, help="Hours a file must be unreferenced for")
+
+    def handle(self, *args, **options):
+        cutoff = time.time() - options['min_age'] * 3600
+        if not options['dry_run']:
+            for upload in expired_uploads():
+                discard_upload(upload)
+        fields = content_addressed_fields()
+        folders = {field.upload_to.rstrip('/') for _, field in fields}
+
+        referenced = set()
+        for model, field in fields:
+            referenced.update(
+                model.objects.exclude(**{field.name: ''}).exclude(**{f"{field.name}__isnull": True})
+                .values_list(field.name, flat=True).iterator()
+            )
+        for thumbnails in PlayerProfile.objects.exclude(photo_thumbnails={}).values_list('photo_thumbnails', flat=True).iterator():
+            referenced.update(name for size, name in thumbnails.items() if size != 'source')
+        #Part files of chunked uploads that are still going
+        for upload in ReceiptUpload.objects.only('id'):
+            referenced.add(os.path.relpath(part_path(upload), content_storage.location).replace('\\', '/'))
+
+        removed = kept = freed = 0
+        for folder in sorted(folders) + [TEMP_DIR]:
+            root = content_storage.path(folder)
+            for directory, _, filenames in os.walk(root, topdown=False):
+                for filename in filenames:
+                    full_path = os.path.join(directory, filename)
+                    name = os.path.relpath(full_path, content_storage.location).replace('\\', '/')
+                    if name in referenced or (folder != TEMP_DIR and not in_shards(name, folder)):
+                        kept += 1
+                        continue
+                    stat = os.stat(full_path)
+                    if stat.st_mtime > cutoff:
+                        kept += 1
+                        continue
+                    removed += 1
+                    freed += stat.st_size
+                    if options['dry_run']:
+                        self.stdout.write(f"Would delete {name}")
+                    else:
+                        os.remove(full_path)
+                if not options['dry_run'] and directory != root:
+                    try:
+                        os.rmdir(directory)
+                    except OSError:
+                        #Not empty
+                        pass
+
+        verb = "Would free" if options['dry_run'] else "Freed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {freed / 1024 / 1024:.1f} MB in {removed} files, kept {kept}"
+        ))
@@ -0,0 +1,48 @@
+"""
+Imports a roster spreadsheet of players and members, see users/roster.py.
+
+    python manage.py import_roster thunder_cats.xlsx
+    python manage.py import_roster league.csv --dry-run
+    python manage.py import_roster league.csv --invites invites.csv
+
+Rows that can't be imported are listed with their line number. Users imported
+without a password get an invite token, written to --invites as a CSV of
+email and token for the league office to send out.
+"""
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.roster import RosterError, import_roster, read_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk import players and members from a CSV or XLSX roster"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--dry-run', action='store_true', help="Only check the rows")
+        parser.add_argument('--invites', help="Write the invite tokens to this CSV file")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as handle:
+                summary = import_roster(read_rows(handle, options['path']), dry_run=options['dry_run'])
+        except (OSError, RosterError) as e:
+            raise CommandError(str(e))
+
+        for rejected in summary['rejected']:
+            reasons = '; '.join(f"{column}: {message}" for column, message in rejected['errors'].items())
+            self.stderr.write(f"line {rejected['line']} ({rejected['email'] or 'no email'}): {reasons}")
+
+        if options['invites'] and summary['invites']:
+            with open(options['invites'], 'w', newline='') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(['email', 'token'])
+                writer.writerows([invite['email'], invite['token']] for invite in summary['invites'])
+
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {summary['created']} users, {len(summary['rejected'])} rows rejected, "
+            f"{len(summary['invites'])} invites"
+        ))
@@ -0,0 +1,145 @@
+"""
+Load tests the login endpoint and reports latency and throughput.
+
+    python manage.py loadtest_login --workers 8 --duration 20
+    python manage.py loadtest_login --url http://127.0.0.1:8000/users/login/ --workers 32
+
+Each worker is a thread logging in over and over as one of --users seeded
+accounts (a --bad-ratio share of attempts use a wrong password). Without
+--url the requests go through the Django test client in this process, with
+--url they go to a running server, which is the number to trust for a real
+deployment with several processes.
+The p50/p99 latency and logins per second are reported per worker and in
+total. Seeded users have @loadtest.invalid emails and are removed afterwards
+unless --keep is passed, so only run it against a development database.
+"""
+import json
+import random
+import statistics
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import Client
+from django.urls import reverse
+
+from users.models import User, MemberProfile
+
+LOADTEST_DOMAIN = '@loadtest.invalid'
+PASSWORD = 'loadtest-password'
+
+
+def percentile(timings, share):
+    return timings[min(len(timings) - 1, int(len(timings) * share))]
+
+
+class Command(BaseCommand):
+    help = "Hammer the login endpoint and report p50/p99 latency and logins/sec per worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to run for")
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--bad-ratio', type=float, default=0.1, help="Share of attempts with a wrong password")
+        parser.add_argument('--url', help="Login URL of a running server, instead of the in-process client")
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded users afterwards")
+
+    def handle(self, *args, **options):
+        self.seed(options['users'])
+        try:
+            emails = list(User.objects.filter(email__endswith=LOADTEST_DOMAIN).values_list('email', flat=True))
+            if not emails:
+                raise CommandError("No load test users, pass --users 1 or more")
+            results = self.run(emails, options)
+        finally:
+            if not options['keep']:
+                User.objects.filter(email__endswith=LOADTEST_DOMAIN).delete()
+        self.report(results, options['duration'])
+
+    def seed(self, count):
+        existing = User.objects.filter(email__endswith=LOADTEST_DOMAIN).count()
+        if existing >= count:
+            return
+        #One hash with the current hasher, shared by every seeded user
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(email=f"login{n}{LOADTEST_DOMAIN}", password=password, fname=f"Load{n}", sname='Test', id_num=f"LOAD{n}")
+            for n in range(existing, count)
+        ], batch_size=1000)
+        users = User.objects.filter(email__endswith=LOADTEST_DOMAIN, member_profile__isnull=True)
+        MemberProfile.objects.bulk_create([MemberProfile(user=user) for user in users], batch_size=1000)
+
+    def run(self, emails, options):
+        deadline = time.monotonic() + options['duration']
+        results = [None] * options['workers']
+        login = self.url_login(options['url']) if options['url'] else None
+
+        def worker(index):
+            post = login or self.client_login()
+            timings, failures, errors, stopped = [], 0, 0, None
+            rng = random.Random(index)
+            try:
+                while time.monotonic() < deadline:
+                    good = rng.random() >= options['bad_ratio']
+                    body = {'email': rng.choice(emails), 'password': PASSWORD if good else 'wrong'}
+                    start = time.perf_counter()
+                    status = post(body)
+                    timings.append((time.perf_counter() - start) * 1000)
+                    if status == 200 and not good or status == 401 and good:
+                        failures += 1
+                    elif status not in (200, 401):
+                        errors += 1
+            except Exception as e:
+                #Reported with the worker's numbers so far instead of losing them
+                stopped = e
+            finally:
+                close_old_connections()
+            results[index] = (timings, failures, errors, stopped)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def client_login(self):
+        #localhost passes ALLOWED_HOSTS in development, 'testserver' doesn't
+        client = Client(SERVER_NAME='localhost')
+        url = reverse('login')
+        return lambda body: client.post(url, body, content_type='application/json').status_code
+
+    def url_login(self, url):
+        def post(body):
+            request = Request(url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+            try:
+                with urlopen(request) as response:
+                    return response.status
+            except HTTPError as e:
+                return e.code
+        return post
+
+    def report(self, results, duration):
+        everything = []
+        for index, (timings, failures, errors, stopped) in enumerate(results):
+            everything.extend(timings)
+            self.stdout.write(self.line(f"worker {index}", sorted(timings), duration, failures, errors))
+            if stopped is not None:
+                self.stderr.write(f"worker {index} stopped: {stopped!r}")
+        self.stdout.write(self.style.SUCCESS(self.line(
+            'total', sorted(everything), duration,
+            sum(result[1] for result in results), sum(result[2] for result in results),
+        )))
+
+    def line(self, label, timings, duration, failures, errors):
+        if not timings:
+            return f"{label}: no requests finished"
+        return (
+            f"{label}: {len(timings)} logins, {len(timings) / duration:.1f}/s, "
+            f"p50 {statistics.median(timings):.1f} ms, p99 {percentile(timings, 0.99):.1f} ms, "
+            f"{failures} wrong results, {errors} errors"
+        )
@@ -0,0 +1,42 @@
+"""
+Queues the QR codes left pending again, see users/tasks.py.
+
+    python manage.py requeue_qr_codes
+    python manage.py requeue_qr_codes --older-than 30
+
+The render queue is held in memory, so a restart or a crashed worker leaves
+receipts pending for good. Run this from cron every few minutes. Only rows
+queued more than --older-than minutes ago are picked up, so renders that are
+still on their way aren't done twice, and it waits for the renders to finish.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from users.models import Receipt
+from users.tasks import requeue_stale_qr_codes
+
+
+class Command(BaseCommand):
+    help = "Render the QR codes that have been pending for too long again"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=10, help="Minutes a receipt must have been pending for")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batches = requeue_stale_qr_codes(timedelta(minutes=options['older_than']), batch_size=options['batch_size'])
+        counts = {Receipt.QR_READY: 0, Receipt.QR_FAILED: 0, Receipt.QR_NONE: 0}
+        for receipt_ids, future in batches:
+            try:
+                statuses = future.result()
+            except Exception as e:
+                #Left pending, the next run picks them up again
+                self.stderr.write(f"Batch of {len(receipt_ids)} receipts failed: {e}")
+                continue
+            for qr_status in statuses.values():
+                counts[qr_status] = counts.get(qr_status, 0) + 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Requeued {sum(len(receipt_ids) for receipt_ids, _ in batches)} receipts: "
+            f"{counts[Receipt.QR_READY]} ready, {counts[Receipt.QR_FAILED]} failed"
+        ))
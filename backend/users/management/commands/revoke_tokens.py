@@ -0,0 +1,39 @@
+"""
+Cuts off JWTs straight away, see users/revocation.py.
+
+    python manage.py revoke_tokens --user 42
+    python manage.py revoke_tokens --team Phoenix
+    python manage.py revoke_tokens --season 2025
+    python manage.py revoke_tokens --prune
+
+--prune deletes revocations that can't match any unexpired token any more,
+run it daily alongside gc_media.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from users.revocation import prune_revocations, revoke_season, revoke_team, revoke_user
+
+
+class Command(BaseCommand):
+    help = "Revoke the tokens of a user, team or season, or prune expired revocations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int)
+        parser.add_argument('--team')
+        parser.add_argument('--season')
+        parser.add_argument('--prune', action='store_true')
+
+    def handle(self, *args, **options):
+        if not any(options[name] for name in ('user', 'team', 'season', 'prune')):
+            raise CommandError("Pass --user, --team, --season or --prune")
+        if options['user']:
+            revoke_user(options['user'])
+            self.stdout.write(f"Revoked the tokens of user {options['user']}")
+        if options['team']:
+            revoke_team(options['team'])
+            self.stdout.write(f"Revoked the tokens of team {options['team']}")
+        if options['season']:
+            revoke_season(options['season'])
+            self.stdout.write(f"Revoked the tokens of season {options['season']}")
+        if options['prune']:
+            self.stdout.write(self.style.SUCCESS(f"Pruned {prune_revocations()} expired revocations"))
@@ -0,0 +1,44 @@
+"""
+Starts a new season in the eligibility table, see users/eligibility.py.
+
+    python manage.py rollover_season 2027
+    python manage.py rollover_season 2027 --grace-days 30
+    python manage.py rollover_season 2027 --starts-on 2027-02-01 --ends-on 2028-01-31
+
+Everyone still eligible in an earlier season is lapsed, and with --grace-days
+the members eligible in the current season stay eligible for that many days
+of the new one. Change CURRENT_SEASON in the settings afterwards.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from users.eligibility import rollover
+
+
+class Command(BaseCommand):
+    help = "Start a new season, lapsing the eligibility of the earlier ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('season')
+        parser.add_argument('--starts-on')
+        parser.add_argument('--ends-on')
+        parser.add_argument('--grace-days', type=int, default=0)
+        parser.add_argument('--from-season', help="Season to carry members over from, the current one by default")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ('starts_on', 'ends_on'):
+            if options[name]:
+                dates[name] = parse_date(options[name])
+                if dates[name] is None:
+                    raise CommandError(f"--{name.replace('_', '-')} must be a date like 2027-01-31")
+        if ':' in options['season']:
+            raise CommandError("Season can't contain ':'")
+
+        lapsed, carried = rollover(
+            options['season'], grace_days=options['grace_days'], from_season=options['from_season'], **dates,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Started season {options['season']}: {lapsed} lapsed, {carried} carried over"
+        ))
+        self.stdout.write(f"Set CURRENT_SEASON = '{options['season']}' in the settings to start scanning for it")
@@ -0,0 +1,208 @@
+"""
+Serving uploaded media (receipts, qr codes and profile photos).
+
+Files are streamed with FileResponse, carry an ETag, Last-Modified and
+Cache-Control so browsers can revalidate with a cheap 304, and single byte
+ranges are supported for large receipts. With MEDIA_OFFLOAD set to
+'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd) the view only does the
+access check and the front proxy sends the bytes.
+
+When MEDIA_REQUIRE_AUTH is on a request needs either a JWT in the
+Authorization header or a signed url. <img> tags can't send headers, so the
+API hands out signed urls made by media_url(); the signature is tied to the
+file name and an expiry that is rounded up so the url (and the browser's
+cache of it) stays the same for a while.
+
+Only the folders the media fields upload to are served, so the temporary
+files of uploads in progress (storage.TEMP_DIR) and anything else that lands
+in MEDIA_ROOT aren't found whoever asks.
+"""
+import mimetypes
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .authentication import ClaimsJWTAuthentication
+from .storage import content_addressed_fields
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def _signer():
+    return signing.Signer(salt='users.media')
+
+
+def _url_lifetime():
+    return getattr(settings, 'MEDIA_URL_LIFETIME', 24 * 3600)
+
+
+def sign_media_name(name, now=None):
+    """
+    Returns (expires, signature) for a media file name. The expiry is rounded
+    up to the next lifetime boundary, so it is always at least one lifetime away.
+    """
+    lifetime = _url_lifetime()
+    now = int(now if now is not None else time.time())
+    expires = (now // lifetime + 2) * lifetime
+    return expires, _signer().signature(f"{name}:{expires}")
+
+
+def check_media_signature(name, expires, signature, now=None):
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < (now if now is not None else time.time()):
+        return False
+    return constant_time_compare(signature or '', _signer().signature(f"{name}:{expires}"))
+
+
+"""
+Returns the url for a stored file (a FieldFile or a file name), signed when
+MEDIA_REQUIRE_AUTH is on and made absolute when there is a request.
+"""
+def media_url(request, file):
+    name = getattr(file, 'name', file)
+    if not name:
+        return None
+    url = default_storage.url(name)
+    if getattr(settings, 'MEDIA_REQUIRE_AUTH', True):
+        expires, signature = sign_media_name(name)
+        url = f"{url}?exp={expires}&sig={signature}"
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def _is_served(name):
+    folder, _, rest = name.partition('/')
+    if not rest or any(part.startswith('.') for part in name.split('/')):
+        return False
+    return folder in {field.upload_to.strip('/') for _, field in content_addressed_fields()}
+
+
+def _is_authorized(request, name):
+    if not getattr(settings, 'MEDIA_REQUIRE_AUTH', True):
+        return True
+    if check_media_signature(name, request.GET.get('exp'), request.GET.get('sig')):
+        return True
+    try:
+        return ClaimsJWTAuthentication().authenticate(request) is not None
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return False
+
+
+def _parse_range(header, size):
+    """
+    Returns (start, end) inclusive for a single byte range, None when the
+    header should be ignored, or False when the range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        #bytes=-500 means the last 500 bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _offload_response(name, path, content_type):
+    mode = getattr(settings, 'MEDIA_OFFLOAD', None)
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel':
+        response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/') + name
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    name = os.path.normpath(path).replace('\\', '/')
+    if name.startswith('../') or name == '..' or os.path.isabs(name) or not _is_served(name):
+        raise Http404("File not found")
+    if not _is_authorized(request, name):
+        return HttpResponseForbidden("Authentication required")
+
+    try:
+        full_path = default_storage.path(name)
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError, SuspiciousFileOperation):
+        raise Http404("File not found")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found")
+
+    etag = quote_etag(f"{stat.st_size:x}-{stat.st_mtime_ns:x}")
+    last_modified = int(stat.st_mtime)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    def finish(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Accept-Ranges'] = 'bytes'
+        patch_cache_control(response, private=True, max_age=getattr(settings, 'MEDIA_CACHE_SECONDS', 3600))
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return finish(not_modified)
+
+    if getattr(settings, 'MEDIA_OFFLOAD', None):
+        #The proxy handles ranges itself
+        return finish(_offload_response(name, full_path, content_type))
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or if_range == etag):
+        byte_range = _parse_range(range_header, stat.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{stat.st_size}"
+        return finish(response)
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _read_range(full_path, start, length), status=206, content_type=content_type,
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f"bytes {start}-{end}/{stat.st_size}"
+        return finish(response)
+
+    response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    return finish(response)
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:48
+
+from django.db import migrations, models
+
+
+def mark_existing_qr_codes_ready(apps, schema_editor):
+    Receipt = apps.get_model('users', 'Receipt')
+    Receipt.objects.exclude(qr_code='').exclude(qr_code__isnull=True).update(qr_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_playerprofile_team_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='qr_status',
+            field=models.CharField(choices=[('none', 'Not requested'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='none', max_length=10),
+        ),
+        migrations.RunPython(mark_existing_qr_codes_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_receipt_qr_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='receipt_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['is_verified', '-uploaded_at', '-id'], name='receipt_verified_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['uploaded_by', '-uploaded_at', '-id'], name='receipt_uploader_listing_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:54
+
+from django.db import migrations, models
+
+# Secondary indexes on InnoDB are built in place without locking the table
+# for writes, so this can be applied while the site is up. Use
+# `manage.py benchmark_lookups --compare` to see the plans with and without them.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_receipt_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='playerprofile',
+            index=models.Index(fields=['team_name', 'group'], name='profile_team_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['player', 'is_verified', '-uploaded_at'], name='receipt_player_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['uploaded_by', 'is_verified', '-uploaded_at'], name='receipt_uploader_latest_idx'),
+        ),
+    ]
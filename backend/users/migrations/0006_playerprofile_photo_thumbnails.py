@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playerprofile',
+            name='photo_thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
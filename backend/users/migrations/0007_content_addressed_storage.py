@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:00
+
+import users.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_playerprofile_photo_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='playerprofile',
+            name='profile_photo',
+            field=models.ImageField(null=True, storage=users.storage.ContentAddressedStorage(), upload_to='profile_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='receipt',
+            name='file',
+            field=models.FileField(storage=users.storage.ContentAddressedStorage(), upload_to='receipts/'),
+        ),
+        migrations.AlterField(
+            model_name='receipt',
+            name='qr_code',
+            field=models.ImageField(blank=True, null=True, storage=users.storage.ContentAddressedStorage(), upload_to='qr_codes/'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:16
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# A functional index, MySQL needs 8.0.13 or later for these.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_receiptupload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='user_email_lower_idx'),
+        ),
+    ]
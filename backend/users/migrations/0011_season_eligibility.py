@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:23
+
+from datetime import date, timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_current_season(apps, schema_editor):
+    """
+    Everyone with a verified receipt was treated as eligible before this
+    table existed, so they are made eligible for the current season.
+    """
+    Season = apps.get_model('users', 'Season')
+    Eligibility = apps.get_model('users', 'Eligibility')
+    Receipt = apps.get_model('users', 'Receipt')
+
+    name = str(getattr(settings, 'CURRENT_SEASON', date.today().year))
+    if name.isdigit() and len(name) == 4:
+        starts_on, ends_on = date(int(name), 1, 1), date(int(name), 12, 31)
+    else:
+        starts_on, ends_on = date.today(), date.today() + timedelta(days=365)
+    season, _ = Season.objects.get_or_create(name=name, defaults={'starts_on': starts_on, 'ends_on': ends_on})
+
+    latest = {}
+    for receipt_id, player_id in Receipt.objects.filter(is_verified=True).order_by('id').values_list('id', 'player_id').iterator():
+        latest[player_id] = receipt_id
+    Eligibility.objects.bulk_create([
+        Eligibility(user_id=player_id, season=season, status='eligible', valid_until=season.ends_on, receipt_id=receipt_id)
+        for player_id, receipt_id in latest.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_tokenrevocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Season',
+            fields=[
+                ('name', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('starts_on', models.DateField()),
+                ('ends_on', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Eligibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('eligible', 'Eligible'), ('grace', 'Carried over from last season'), ('lapsed', 'Lapsed')], max_length=10)),
+                ('valid_until', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('receipt', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='users.receipt')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='eligibility', to=settings.AUTH_USER_MODEL)),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='eligibility', to='users.season')),
+            ],
+            options={
+                'verbose_name_plural': 'eligibility',
+                'constraints': [models.UniqueConstraint(fields=('user', 'season'), name='eligibility_user_season_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_current_season, migrations.RunPython.noop),
+    ]
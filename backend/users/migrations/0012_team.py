@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:28
+
+from django.db import migrations, models
+from django.db.models import Count
+
+#The teams that used to be PlayerProfile.TEAM_CHOICES
+TEAMS = [
+    'Thunder Cats', 'Black Mambas 1', 'Forvis Mazars A', 'Motozone', 'Lobatse Cricket Club', 'Pioneers',
+    'United Gymkhana', 'All Stars', 'SH Tyre City', 'Gujarat Strikers B', 'Phoenix', 'Ceylon Cricket Club',
+    'DJ Devils', 'BD Cricket Club', 'SKY XI', 'Cubs XI', 'Nawabz Boys', 'Auto World', 'FD Titans',
+    'Pulse Cricket Stallion', 'Elite Sports', 'Excel Strikers', 'PWC', 'Black Mambas 2', 'Moremi Kings (Chennai)',
+    'Forvis Mazars Juniors', 'Sefalana', 'Friends', 'A-One', 'Cheetas',
+]
+
+
+def create_teams(apps, schema_editor):
+    Team = apps.get_model('users', 'Team')
+    PlayerProfile = apps.get_model('users', 'PlayerProfile')
+    Receipt = apps.get_model('users', 'Receipt')
+
+    names = set(TEAMS) | set(PlayerProfile.objects.exclude(team_name='').values_list('team_name', flat=True))
+    players = dict(PlayerProfile.objects.values('team_name').annotate(n=Count('id')).values_list('team_name', 'n'))
+    receipts = {}
+    for team_name, is_verified, n in Receipt.objects.values(
+        'player__player_profiles__team_name', 'is_verified',
+    ).annotate(n=Count('id')).values_list('player__player_profiles__team_name', 'is_verified', 'n'):
+        receipts[team_name, is_verified] = n
+    Team.objects.bulk_create([
+        Team(
+            name=name, players_count=players.get(name, 0),
+            verified_receipts=receipts.get((name, True), 0), pending_receipts=receipts.get((name, False), 0),
+        )
+        for name in sorted(names)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_season_eligibility'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Team',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('players_count', models.PositiveIntegerField(default=0)),
+                ('verified_receipts', models.PositiveIntegerField(default=0)),
+                ('pending_receipts', models.PositiveIntegerField(default=0)),
+                ('roster_version', models.PositiveIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='playerprofile',
+            name='team_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.RunPython(create_teams, migrations.RunPython.noop),
+    ]
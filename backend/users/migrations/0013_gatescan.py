@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_team'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GateScan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.UUIDField(unique=True)),
+                ('season', models.CharField(max_length=20)),
+                ('scanned_at', models.DateTimeField()),
+                ('recorded_at', models.DateTimeField(auto_now_add=True)),
+                ('eligible', models.BooleanField()),
+                ('device_eligible', models.BooleanField(null=True)),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gate_scans', to=settings.AUTH_USER_MODEL)),
+                ('umpire', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gate_scans_made', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['member', 'scanned_at'], name='gatescan_member_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_gatescan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Fixture',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('season', models.CharField(max_length=20)),
+                ('starts_at', models.DateTimeField()),
+                ('venue', models.CharField(blank=True, max_length=100)),
+                ('scans', models.PositiveIntegerField(default=0)),
+                ('checked_in_home', models.PositiveIntegerField(default=0)),
+                ('checked_in_away', models.PositiveIntegerField(default=0)),
+                ('turned_away', models.PositiveIntegerField(default=0)),
+                ('away_team', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='away_fixtures', to='users.team')),
+                ('home_team', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='home_fixtures', to='users.team')),
+            ],
+            options={
+                'ordering': ['-starts_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CheckIn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(blank=True, choices=[('home', 'Home'), ('away', 'Away')], max_length=4)),
+                ('eligible', models.BooleanField()),
+                ('scanned_at', models.DateTimeField()),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='check_ins', to=settings.AUTH_USER_MODEL)),
+                ('umpire', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='check_ins_made', to=settings.AUTH_USER_MODEL)),
+                ('fixture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='check_ins', to='users.fixture')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fixture', 'member'], name='checkin_fixture_member_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_fixture_checkin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='qr_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,13 @@
 from django.db import models
+from django.db.models import Case, Exists, OuterRef, Subquery, Value, When
+from django.db.models.functions import Lower
 from django.core.files.base import ContentFile
 import qrcode
 from io import BytesIO
+import uuid
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
+from .qr_tokens import make_token
+from .storage import content_storage
 
 """
 @Author:Nanda Nanduri
@@ -21,6 +26,33 @@ class CustomUserManager(BaseUserManager):
     def get_by_natural_key(self, email):  # 👈 ADD THIS
         return self.get(email=email.lower())
 
+    def with_roles(self):
+        """
+        Annotates every user with their role flags, primary role, team_name
+        and group computed in the database, so nothing has to probe each
+        profile per user. This is the one place the role order is defined:
+        club_admin, umpire, team_admin, player, then member (also the
+        fallback for users without any profile, which is what login expects).
+        """
+        first_profile = PlayerProfile.objects.filter(user=OuterRef('pk')).order_by('id')
+        return self.get_queryset().annotate(
+            is_club_admin=Exists(ClubAdmin.objects.filter(user=OuterRef('pk'))),
+            is_umpire=Exists(UmpireProfile.objects.filter(user=OuterRef('pk'))),
+            is_member=Exists(MemberProfile.objects.filter(user=OuterRef('pk'))),
+            team_name=Subquery(first_profile.values('team_name')[:1]),
+            group=Subquery(first_profile.values('group')[:1]),
+            is_team_admin=Subquery(first_profile.values('is_team_admin')[:1]),
+        ).annotate(
+            role=Case(
+                When(is_club_admin=True, then=Value('club_admin')),
+                When(is_umpire=True, then=Value('umpire')),
+                When(is_team_admin=True, then=Value('team_admin')),
+                When(is_team_admin=False, then=Value('player')),
+                default=Value('member'),
+                output_field=models.CharField(),
+            )
+        )
+
 
 """
 Read this 
@@ -52,6 +84,12 @@ class User(AbstractBaseUser):
 
     objects = CustomUserManager()
 
+    class Meta:
+        #Login looks users up by lower(email), see backends.EmailBackend
+        indexes = [
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+        ]
+
 
 """
 This is now for the club admin who is essentially the admin responsible
@@ -66,6 +104,27 @@ class ClubAdmin(models.Model):
     admin_level = models.CharField(max_length=50, blank=True, null=True)
 
 
+"""
+A team in the league. The counters and roster_version are kept up to date
+by teams.py when players and receipts are written, so the team screens read
+one row instead of counting. roster_version goes up whenever the players
+listed on the roster change and keys the cached roster snapshot.
+"""
+class Team(models.Model):
+    name = models.CharField(max_length=100, primary_key=True)
+    players_count = models.PositiveIntegerField(default=0)
+    verified_receipts = models.PositiveIntegerField(default=0)
+    pending_receipts = models.PositiveIntegerField(default=0)
+    roster_version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
 """
 This can be a regualr player or a team captain
 Remember player play games. Team captains also play, they are players who
@@ -74,43 +133,11 @@ upload receipts for each player in their team
 class PlayerProfile(models.Model):
     user=models.ForeignKey(User, on_delete=models.CASCADE, related_name='player_profiles')
 
-    TEAM_CHOICES = (
-        ('Thunder Cats', 'Thunder Cats'),
-        ('Black Mambas 1', 'Black Mambas 1'),
-        ('Forvis Mazars A', 'Forvis Mazars A'),
-        ('Motozone', 'Motozone'),
-        ('Lobatse Cricket Club', 'Lobatse Cricket Club'),
-        ('Pioneers', 'Pioneers'),
-        ('United Gymkhana', 'United Gymkhana'),
-        ('All Stars', 'All Stars'),
-        ('SH Tyre City', 'SH Tyre City'),
-        ('Gujarat Strikers B', 'Gujarat Strikers B'),
-        ('Phoenix', 'Phoenix'),
-        ('Ceylon Cricket Club', 'Ceylon Cricket Club'),
-        ('DJ Devils', 'DJ Devils'),
-        ('BD Cricket Club', 'BD Cricket Club'),
-        ('SKY XI', 'SKY XI'),
-        ('Cubs XI', 'Cubs XI'),
-        ('Nawabz Boys', 'Nawabz Boys'),
-        ('Auto World', 'Auto World'),
-        ('FD Titans', 'FD Titans'),
-        ('Pulse Cricket Stallion', 'Pulse Cricket Stallion'),
-        ('Elite Sports', 'Elite Sports'),
-        ('Excel Strikers', 'Excel Strikers'),
-        ('PWC', 'PWC'),
-        ('Black Mambas 2', 'Black Mambas 2'),
-        ('Moremi Kings (Chennai)', 'Moremi Kings (Chennai)'),
-        ('Forvis Mazars Juniors', 'Forvis Mazars Juniors'),
-        ('Sefalana', 'Sefalana'),
-        ('Friends', 'Friends'),
-        ('A-One', 'A-One'),
-        ('Cheetas', 'Cheetas'),
-    )
-
-    team_name = models.CharField(max_length=100, choices=TEAM_CHOICES, blank=True)
+    #The name of a Team, kept as the natural key so the team claims and filters can use it as is
+    team_name = models.CharField(max_length=100, blank=True)
 
     is_team_admin = models.BooleanField(default=False)##This will differentiate team admin from a player
-    profile_photo= models.ImageField(upload_to='profile_photos/', null=True, blank=False)
+    profile_photo= models.ImageField(upload_to='profile_photos/', storage=content_storage, null=True, blank=False)
     GROUP_CHOICES = (
         ('A', 'GROUP A'),
         ('B', 'GROUP B'),
@@ -119,6 +146,15 @@ class PlayerProfile(models.Model):
     )
     group = models.CharField(max_length=1, choices=GROUP_CHOICES, blank=True, null=True)
 
+    #Names of the smaller copies of profile_photo, see thumbnails.py
+    photo_thumbnails = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        #Team rosters and the team/group receipt filters look profiles up by team
+        indexes = [
+            models.Index(fields=['team_name', 'group'], name='profile_team_idx'),
+        ]
+
 
 """
 This is for a member, a member is someone who uses the facilities of GCC
@@ -140,6 +176,31 @@ class UmpireProfile(models.Model):
     #Additional umpire-specific fields
 
 
+"""
+Turns a qr payload into PNG bytes. This is kept as a plain function so that
+it can be sent to a process pool when rendering many qr codes at once.
+"""
+def render_qr_png(data):
+    qr = qrcode.make(data)
+    buffer = BytesIO()
+    qr.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+"""
+Queries for receipts that are reused by the views
+"""
+class ReceiptQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Joins the player and uploader and prefetches the players' profiles
+        in one extra query, which is everything ReceiptSerializer reads.
+        """
+        return self.select_related('player', 'uploaded_by').prefetch_related(
+            models.Prefetch('player__player_profiles', queryset=PlayerProfile.objects.order_by('id'))
+        )
+
+
 """
 This is a receipt model, remmeber that team captains upload receipts for each player
 Therefore we will need a receipt model
@@ -147,34 +208,224 @@ Therefore we will need a receipt model
 class Receipt(models.Model):
     player=models.ForeignKey(User, on_delete=models.CASCADE, related_name='receipts')
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_receipts')
-    file = models.FileField(upload_to='receipts/')
+    file = models.FileField(upload_to='receipts/', storage=content_storage)
     note = models.TextField(blank=True, null=True)
     is_verified = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    qr_code = models.ImageField(upload_to='qr_codes/', null=True, blank=True)
+    qr_code = models.ImageField(upload_to='qr_codes/', storage=content_storage, null=True, blank=True)
 
-    def generate_qr_code(self, for_role='player'):
+    #QR codes are rendered in the background once a receipt is verified
+    QR_NONE = 'none'
+    QR_PENDING = 'pending'
+    QR_READY = 'ready'
+    QR_FAILED = 'failed'
+    QR_STATUS_CHOICES = (
+        (QR_NONE, 'Not requested'),
+        (QR_PENDING, 'Pending'),
+        (QR_READY, 'Ready'),
+        (QR_FAILED, 'Failed'),
+    )
+    qr_status = models.CharField(max_length=10, choices=QR_STATUS_CHOICES, default=QR_NONE)
+    #When the render was queued, the requeue_qr_codes command picks up the ones left pending
+    qr_queued_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ReceiptQuerySet.as_manager()
+
+    class Meta:
+        #These match the newest first ordering of the paginated receipt lists
+        indexes = [
+            models.Index(fields=['-uploaded_at', '-id'], name='receipt_listing_idx'),
+            models.Index(fields=['is_verified', '-uploaded_at', '-id'], name='receipt_verified_listing_idx'),
+            models.Index(fields=['uploaded_by', '-uploaded_at', '-id'], name='receipt_uploader_listing_idx'),
+            #The latest verified receipt for a player or uploader (the qr code views).
+            #MySQL has no partial indexes, so is_verified comes second instead
+            models.Index(fields=['player', 'is_verified', '-uploaded_at'], name='receipt_player_latest_idx'),
+            models.Index(fields=['uploaded_by', 'is_verified', '-uploaded_at'], name='receipt_uploader_latest_idx'),
+        ]
+
+    def qr_user_id(self, for_role='player'):
         if for_role == 'player':
-            user = self.player
+            return self.player_id
         elif for_role == 'team_admin':
-            user = self.uploaded_by
-        else:
-            raise ValueError("Invalid role. Choose player or team admin")
-
-        profile = user.player_profiles.first()
-        data = {
-            'id': user.id,
-            'name': f"{user.fname} {user.sname}",
-            'team_name': getattr(profile, 'team_name', 'N/A'),
-            'profile_photo_url': profile.profile_photo.url if profile and profile.profile_photo else 'N/A',
-        }
-        qr = qrcode.make(str(data))
-        buffer = BytesIO()
-        qr.save(buffer, format='PNG')
-        filename = f"qr_{user.id}_{self.id}.png"
-        self.qr_code.save(filename, ContentFile(buffer.getvalue()), save=False)
-        self.save()
+            return self.uploaded_by_id
+        raise ValueError("Invalid role. Choose player or team admin")
+
+    def qr_payload(self, for_role='player'):
+        """
+        The data that goes into the qr code, a signed token that the scan
+        endpoint can check without looking at the image (see qr_tokens.py)
+        """
+        return make_token(self.qr_user_id(for_role), self.id)
+
+    def qr_filename(self, for_role='player'):
+        return f"qr_{self.qr_user_id(for_role)}_{self.id}.png"
+
+    def attach_qr_png(self, png, for_role='player'):
+        #Writes the image to storage but leaves saving the row to the caller
+        self.qr_code.save(self.qr_filename(for_role), ContentFile(png), save=False)
+        self.qr_status = self.QR_READY
+
+    def generate_qr_code(self, for_role='player'):
+        self.attach_qr_png(render_qr_png(self.qr_payload(for_role)), for_role)
+        self.save(update_fields=['qr_code', 'qr_status'])
 
 
     def __str__(self):
         return f"Receipt for {self.player.fname} {self.player.sname} uploaded_by {self.uploaded_by.fname}"
+
+
+"""
+A receipt being uploaded in chunks (see uploads.py)
+The bytes are appended to a part file as they arrive and the Receipt is only
+created once every byte is in, so an interrupted upload can carry on from
+the last chunk the server has.
+"""
+class ReceiptUpload(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    player = models.ForeignKey(User, on_delete=models.CASCADE, related_name='receipt_uploads')
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='started_receipt_uploads')
+    note = models.TextField(blank=True, null=True)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    #Set from the magic bytes of the first chunk
+    content_type = models.CharField(max_length=50, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.received}/{self.size} bytes)"
+
+
+
+"""
+A cut off for JWTs, see revocation.py. Tokens matching key (a jti, user,
+team or season) that were issued before revoked_before are refused. The row
+can be dropped at expires_at, when every token it could match has expired.
+"""
+class TokenRevocation(models.Model):
+    key = models.CharField(max_length=150, unique=True)
+    revoked_before = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} revoked before {self.revoked_before}"
+
+
+"""
+A playing season, named like CURRENT_SEASON ('2026'). Memberships paid for
+a season are valid until it ends.
+"""
+class Season(models.Model):
+    name = models.CharField(max_length=20, primary_key=True)
+    starts_on = models.DateField()
+    ends_on = models.DateField()
+
+    def __str__(self):
+        return self.name
+
+
+"""
+Whether a member may play in a season, kept up to date when their receipts
+are verified (see eligibility.py) so scans and dashboards read one row
+instead of working it out from the receipts.
+"""
+class Eligibility(models.Model):
+    ELIGIBLE = 'eligible'
+    GRACE = 'grace'
+    LAPSED = 'lapsed'
+    STATUS_CHOICES = (
+        (ELIGIBLE, 'Eligible'),
+        (GRACE, 'Carried over from last season'),
+        (LAPSED, 'Lapsed'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='eligibility')
+    season = models.ForeignKey(Season, on_delete=models.CASCADE, related_name='eligibility')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    valid_until = models.DateField()
+    #The receipt that paid for it, if any
+    receipt = models.ForeignKey(Receipt, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'eligibility'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'season'], name='eligibility_user_season_uniq'),
+        ]
+
+    def is_valid(self, today):
+        return self.status in (self.ELIGIBLE, self.GRACE) and self.valid_until >= today
+
+
+"""
+A qr code scanned at the gate while the umpire's device was offline, and
+uploaded later (see gate.py). eligible is what the server decided from the
+eligibility table as of scanned_at, device_eligible is what the device showed
+from its snapshot.
+"""
+class GateScan(models.Model):
+    #Made by the device so an upload that is retried records each scan once
+    client_id = models.UUIDField(unique=True)
+    umpire = models.ForeignKey(User, on_delete=models.CASCADE, related_name='gate_scans_made')
+    member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='gate_scans')
+    season = models.CharField(max_length=20)
+    scanned_at = models.DateTimeField()
+    recorded_at = models.DateTimeField(auto_now_add=True)
+    eligible = models.BooleanField()
+    device_eligible = models.BooleanField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['member', 'scanned_at'], name='gatescan_member_idx'),
+        ]
+
+
+"""
+A match between two teams. The attendance counters are added to as check-ins
+are written (see attendance.py), so the summary is one row:
+
+    scans             every scan recorded for the fixture
+    checked_in_home   home players let in, each counted once
+    checked_in_away   away players let in, each counted once
+    turned_away       scans of players who weren't eligible or aren't in either team
+"""
+class Fixture(models.Model):
+    home_team = models.ForeignKey(Team, on_delete=models.PROTECT, related_name='home_fixtures')
+    away_team = models.ForeignKey(Team, on_delete=models.PROTECT, related_name='away_fixtures')
+    season = models.CharField(max_length=20)
+    starts_at = models.DateTimeField()
+    venue = models.CharField(max_length=100, blank=True)
+    scans = models.PositiveIntegerField(default=0)
+    checked_in_home = models.PositiveIntegerField(default=0)
+    checked_in_away = models.PositiveIntegerField(default=0)
+    turned_away = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-starts_at']
+
+    def __str__(self):
+        return f"{self.home_team_id} v {self.away_team_id}"
+
+
+"""
+One scan of a member at a fixture's gate. Rows are only ever appended, in
+batches, and a member scanned again straight away isn't written twice.
+"""
+class CheckIn(models.Model):
+    HOME = 'home'
+    AWAY = 'away'
+    SIDE_CHOICES = ((HOME, 'Home'), (AWAY, 'Away'))
+
+    fixture = models.ForeignKey(Fixture, on_delete=models.CASCADE, related_name='check_ins')
+    member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='check_ins')
+    umpire = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='check_ins_made')
+    #Which team of the fixture the member plays for, blank if neither
+    side = models.CharField(max_length=4, choices=SIDE_CHOICES, blank=True)
+    eligible = models.BooleanField()
+    scanned_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fixture', 'member'], name='checkin_fixture_member_idx'),
+        ]
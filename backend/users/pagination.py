@@ -0,0 +1,27 @@
+"""
+Pagination classes for the listing endpoints.
+Cursor pagination is used so that every page is a range scan on an indexed
+column instead of an OFFSET that gets slower the further you page.
+"""
+from rest_framework.pagination import CursorPagination
+
+
+"""
+Used by the club admin dashboard to page through all the users in the club
+"""
+class UserCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+"""
+Used by the receipt listings, newest first. The id breaks ties between
+receipts uploaded at the same moment and matches the receipt listing indexes.
+"""
+class ReceiptCursorPagination(CursorPagination):
+    ordering = ('-uploaded_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
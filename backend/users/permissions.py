@@ -0,0 +1,67 @@
+"""
+Permission classes that authorize from the role claims in the access token
+(see tokens.RoleRefreshToken) instead of probing the profile tables on every
+request. Tokens issued before the claims existed, or requests authenticated
+some other way, fall back to the cached roles from roles.get_roles().
+"""
+from rest_framework.permissions import BasePermission
+
+from .roles import get_roles
+
+
+def request_claims(request):
+    """
+    Returns the role claims for the request as a dict with role, roles, team
+    and group, or None if the user isn't authenticated.
+    """
+    if not request.user or not request.user.is_authenticated:
+        return None
+
+    token = request.auth
+    if token is not None and hasattr(token, 'get') and token.get('roles') is not None:
+        return {
+            'role': token.get('role'),
+            'roles': token.get('roles'),
+            'team_name': token.get('team'),
+            'group': token.get('group'),
+        }
+    return get_roles(request.user.id)
+
+
+"""
+Allows the request if the user holds any of the roles in allowed_roles
+"""
+class HasRole(BasePermission):
+    allowed_roles = ()
+    message = 'Access denied.'
+
+    def has_permission(self, request, view):
+        claims = request_claims(request)
+        if claims is None:
+            return False
+        return any(role in claims['roles'] for role in self.allowed_roles)
+
+
+class IsClubAdmin(HasRole):
+    allowed_roles = ('club_admin',)
+    message = 'Access denied. You are not a club admin.'
+
+
+class IsTeamAdmin(HasRole):
+    allowed_roles = ('team_admin',)
+    message = 'You are not a team admin.'
+
+
+class IsUmpire(HasRole):
+    allowed_roles = ('umpire',)
+    message = 'Access denied. You are not an umpire.'
+
+
+class IsGateStaff(HasRole):
+    allowed_roles = ('umpire', 'club_admin')
+    message = 'Access denied. Only umpires and club admins can check players at the gate.'
+
+
+class IsPlayer(HasRole):
+    allowed_roles = ('player',)
+    message = 'Access denied. You are not a player.'
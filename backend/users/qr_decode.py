@@ -0,0 +1,202 @@
+"""
+Decoding qr codes out of uploaded photos.
+This is only used when the umpire's device can't read the qr code itself.
+Phone photos are large, so before pyzbar sees them they are greyscaled and
+shrunk (JPEGs are shrunk while decoding with Image.draft, which is much
+cheaper than decoding at full size), and the middle of the frame is tried
+before the whole frame since that is where people point the camera.
+
+The work runs in a small process pool so a slow frame can't hold the web
+worker, and every decode has a timeout. Async views await the pool with
+adecode_upload instead of blocking a thread on it.
+
+A decode that times out can't be stopped once a worker has started it, the
+request is answered but the worker stays busy until the decode finishes. So
+the cost of one decode is bounded instead: images over QR_DECODE_MAX_PIXELS
+are refused from their header before any pixels are read, and the rest are
+shrunk to QR_DECODE_MAX_SIDE. If a worker dies (killed for memory, say) the
+pool is replaced on the next request.
+"""
+import asyncio
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, TimeoutError
+from io import BytesIO
+from threading import Lock
+
+from django.conf import settings
+from PIL import Image
+
+_pool = None
+_pool_lock = Lock()
+
+#Fractions of the frame to try, in order. 1.0 is the whole frame
+CROPS = (0.6, 1.0)
+
+
+class QRDecodeError(Exception):
+    pass
+
+
+class QRDecodeTimeout(QRDecodeError):
+    pass
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'QR_DECODE_PROCESSES', 2))
+        return _pool
+
+
+def _drop_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+"""
+Submits the decode of data to the pool. A broken pool (a worker died) is
+dropped so the next request starts a new one.
+"""
+def submit_decode(data):
+    pool = get_pool()
+    try:
+        return pool, pool.submit(decode_image_bytes, data, _max_side(), _max_pixels())
+    except BrokenExecutor:
+        _drop_pool(pool)
+        raise QRDecodeError("The QR code reader stopped, try again")
+
+
+def prepare_image(data, max_side, max_pixels=None):
+    image = Image.open(BytesIO(data))
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise QRDecodeError(f"Image is too large ({width}x{height})")
+    #For JPEGs this picks a smaller scale to decode at, other formats ignore it
+    image.draft('L', (max_side, max_side))
+    image = image.convert('L')
+    image.thumbnail((max_side, max_side))
+    return image
+
+
+def center_crop(image, fraction):
+    if fraction >= 1.0:
+        return image
+    width, height = image.size
+    left = int(width * (1 - fraction) / 2)
+    top = int(height * (1 - fraction) / 2)
+    return image.crop((left, top, width - left, height - top))
+
+
+"""
+Returns the text of every qr code found in the image bytes, trying the crops
+in CROPS order and stopping at the first one that finds something.
+This runs inside the process pool so it must stay a plain function.
+"""
+def decode_image_bytes(data, max_side=1024, max_pixels=None):
+    try:
+        from pyzbar.pyzbar import decode, ZBarSymbol
+    except ImportError as e:
+        #libzbar missing, say
+        raise QRDecodeError(f"The QR code reader is not available: {e}")
+
+    try:
+        image = prepare_image(data, max_side, max_pixels)
+    except QRDecodeError:
+        raise
+    except Exception as e:
+        #Not only OSError, PIL's DecompressionBombError for one
+        raise QRDecodeError(f"Not a readable image: {e}")
+
+    try:
+        for fraction in CROPS:
+            found = decode(center_crop(image, fraction), symbols=[ZBarSymbol.QRCODE])
+            if found:
+                return [symbol.data.decode('utf-8') for symbol in found]
+    except Exception as e:
+        raise QRDecodeError(f"Could not read the QR code: {e}")
+    return []
+
+
+def _max_side():
+    return getattr(settings, 'QR_DECODE_MAX_SIDE', 1024)
+
+
+def _max_pixels():
+    return getattr(settings, 'QR_DECODE_MAX_PIXELS', 40_000_000)
+
+
+def _timeout():
+    return getattr(settings, 'QR_DECODE_TIMEOUT', 5)
+
+
+"""
+Decodes one uploaded file. Raises QRDecodeTimeout if the pool doesn't answer
+in time and QRDecodeError if the upload isn't an image.
+"""
+def decode_upload(upload):
+    pool, future = submit_decode(upload.read())
+    try:
+        return future.result(timeout=_timeout())
+    except TimeoutError:
+        future.cancel()
+        raise QRDecodeTimeout("Timed out reading the QR code")
+    except BrokenExecutor:
+        _drop_pool(pool)
+        raise QRDecodeError("The QR code reader stopped, try again")
+    except QRDecodeError:
+        raise
+    except Exception as e:
+        raise QRDecodeError(f"Could not read the QR code: {e}")
+
+
+"""
+decode_upload for async views, the event loop carries on while the pool works
+"""
+async def adecode_upload(upload):
+    pool, future = submit_decode(upload.read())
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), _timeout())
+    except asyncio.TimeoutError:
+        future.cancel()
+        raise QRDecodeTimeout("Timed out reading the QR code")
+    except BrokenExecutor:
+        _drop_pool(pool)
+        raise QRDecodeError("The QR code reader stopped, try again")
+    except QRDecodeError:
+        raise
+    except Exception as e:
+        raise QRDecodeError(f"Could not read the QR code: {e}")
+
+
+"""
+Decodes many uploaded files at once across the pool. Returns one entry per
+file in the same order, either a list of decoded strings or the
+QRDecodeError for that file. The timeout applies to the whole batch.
+"""
+def decode_uploads(uploads):
+    pool = get_pool()
+    try:
+        futures = [pool.submit(decode_image_bytes, upload.read(), _max_side(), _max_pixels()) for upload in uploads]
+    except BrokenExecutor:
+        _drop_pool(pool)
+        return [QRDecodeError("The QR code reader stopped, try again") for _ in uploads]
+    deadline = time.monotonic() + _timeout()
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+        except TimeoutError:
+            future.cancel()
+            results.append(QRDecodeTimeout("Timed out reading the QR code"))
+        except BrokenExecutor:
+            _drop_pool(pool)
+            results.append(QRDecodeError("The QR code reader stopped, try again"))
+        except QRDecodeError as e:
+            results.append(e)
+        except Exception as e:
+            results.append(QRDecodeError(f"Could not read the QR code: {e}"))
+    return results
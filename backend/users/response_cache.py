@@ -0,0 +1,155 @@
+"""
+Caching of whole responses of the dashboard listings.
+A dashboard refresh asks for the same pages over and over, so the serialized
+body of a listing is kept in the cache and served as it is until something
+it shows changes.
+
+Every cached body depends on one or more scopes, and each scope has a version
+number kept in the cache:
+
+    users               the club's user listing
+    receipts            every receipt listing
+    receipts:team:<t>   receipt listings filtered to team t
+    team:<t>            team t's own listings (the team admin's roster)
+
+The key of a body is made from the endpoint, what the caller sees it as
+(their role, team or id, see vary), the host, the query params and the
+current version of each of its scopes. A write bumps the versions of the
+scopes it touches (invalidate) and from then on the old bodies are never
+read again and just expire, nothing has to find and delete keys. Versions
+are bumped straight away and again when the transaction commits, so a
+request that read the old rows in between can't put them back.
+
+Hits and misses are counted per endpoint in the cache, see cache_metrics().
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+VERSION_KEY = 'response-version:{}'
+BODY_KEY = 'response:{}:{}'
+STATS_KEY = 'response-stats:{}:{}'
+#Endpoints cached with cached_response, for cache_metrics()
+ENDPOINTS = ('all-users', 'team-players', 'receipts-all', 'receipts-unverified')
+
+
+def _timeout():
+    return getattr(settings, 'RESPONSE_CACHE_SECONDS', 60)
+
+
+def scope_versions(scopes):
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            #Starting from the time means a version that was evicted can't come back as an old one
+            cache.add(key, time.time_ns() // 1000, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(scopes):
+    for scope in scopes:
+        try:
+            cache.incr(VERSION_KEY.format(scope))
+        except ValueError:
+            #Nothing was cached under it yet, so there is nothing to move away from
+            pass
+
+
+"""
+Bumps the versions of scopes, now and when the current transaction commits
+"""
+def invalidate(*scopes):
+    scopes = [scope for scope in scopes if scope]
+    if not scopes:
+        return
+    _bump(scopes)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _bump(scopes))
+
+
+def team_scopes(team_names):
+    names = [name for name in team_names if name]
+    return [f"team:{name}" for name in names] + [f"receipts:team:{name}" for name in names]
+
+
+def receipt_scopes(params):
+    team = params.get('team')
+    return [f"receipts:team:{team}"] if team else ['receipts']
+
+
+"""
+Invalidates the receipt listings showing the given players' receipts, for
+writes that don't send post_save (bulk_update, update())
+"""
+def receipts_changed(player_ids):
+    from .teams import teams_of
+    invalidate('receipts', *team_scopes(teams_of(player_ids)))
+
+
+def record(endpoint, event):
+    key = STATS_KEY.format(endpoint, event)
+    #add() is a no-op if the counter exists, incr() is atomic on shared caches
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def body_key(request, endpoint, scopes, vary=()):
+    parts = [
+        request.get_host(),
+        ','.join(str(part) for part in vary),
+        ','.join(str(version) for version in scope_versions(scopes)),
+        urlencode(sorted(request.GET.lists()), doseq=True),
+    ]
+    return BODY_KEY.format(endpoint, hashlib.sha1('|'.join(parts).encode()).hexdigest())
+
+
+"""
+The body of endpoint for this request, from the cache or made by build() and
+cached. scopes are what the body shows (see the module docstring) and vary is
+whatever else it depends on, like the caller's team. Only cache bodies that
+don't depend on anything else about the caller.
+"""
+def cached_response(request, endpoint, scopes, build, vary=()):
+    if not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+        return build()
+    key = body_key(request, endpoint, scopes, vary)
+    body = cache.get(key)
+    if body is not None:
+        record(endpoint, 'hit')
+        return body
+    record(endpoint, 'miss')
+    body = build()
+    cache.set(key, body, _timeout())
+    return body
+
+
+"""
+The hits, misses and hit ratio of every cached endpoint since the counters
+were last cleared, and in total
+"""
+def cache_metrics():
+    counts = cache.get_many([STATS_KEY.format(endpoint, event) for endpoint in ENDPOINTS for event in ('hit', 'miss')])
+    metrics = {'endpoints': {}}
+    for endpoint in ENDPOINTS:
+        hits = counts.get(STATS_KEY.format(endpoint, 'hit'), 0)
+        misses = counts.get(STATS_KEY.format(endpoint, 'miss'), 0)
+        metrics['endpoints'][endpoint] = {
+            'hits': hits, 'misses': misses, 'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    hits = sum(row['hits'] for row in metrics['endpoints'].values())
+    misses = sum(row['misses'] for row in metrics['endpoints'].values())
+    metrics.update(hits=hits, misses=misses, hit_ratio=round(hits / (hits + misses), 3) if hits + misses else None)
+    return metrics
+
+
+def clear_metrics():
+    cache.delete_many([STATS_KEY.format(endpoint, event) for endpoint in ENDPOINTS for event in ('hit', 'miss')])
@@ -0,0 +1,336 @@
+"""
+Refresh token rotation and revocation.
+Every refresh swaps the refresh token for a new one and revokes the old one,
+and a removed player, a whole team or a whole season can be cut off at once
+instead of waiting for their tokens to expire.
+
+A revocation is a cut off time for a key:
+
+    jti:<jti>         one refresh token (used when it is rotated)
+    user:<id>         every token of a user
+    team:<name>       every token carrying that team claim
+    season:<season>   every token carrying that season claim
+
+and a token is refused if it was issued (iat) before the cut off of any key
+it matches. The rows live in TokenRevocation but checking a token doesn't
+query the table on a warm process:
+
+  - user, team and season revocations are few, so each process keeps all of
+    them as one dict, loaded from the shared Django cache (or the table, in
+    one query) and reloaded every TOKEN_REVOCATION_LOCAL_SECONDS. Checking
+    an access token on every request is a few dict lookups.
+  - rotated refresh tokens are many, and only matter on a refresh, so they
+    are looked up one jti at a time in a per process LRU with a TTL, then
+    the shared cache, then the table. Tokens are put in the cache as not
+    revoked when they are issued (track_refresh_token), so the table is only
+    read for tokens the cache has lost.
+
+A revocation is written to the table and the shared cache straight away, and
+other processes pick it up once their local copy expires.
+
+Refreshes are counted per minute in the cache, see refresh_metrics().
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone as dt_timezone
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import TokenRevocation
+from .qr_tokens import current_season
+from .tokens import RoleRefreshToken
+
+CUTOFF_KEY = 'token-revoked:{}'
+SCOPES_KEY = 'token-revoked-scopes'
+METRICS_KEY = 'token-metrics:{}:{}'
+METRIC_EVENTS = ('refreshed', 'rejected', 'reused')
+#Stands in for the cut off of keys that have none
+NOT_REVOKED = 0
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A thread safe mapping that keeps at most maxsize entries, dropping the
+    least recently used, and forgets each entry ttl seconds after it was set
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_jtis = None
+_scopes = None
+_local_lock = Lock()
+
+
+def local_jtis():
+    global _jtis
+    with _local_lock:
+        if _jtis is None:
+            _jtis = LRUCache(
+                getattr(settings, 'TOKEN_REVOCATION_LOCAL_SIZE', 10000),
+                getattr(settings, 'TOKEN_REVOCATION_LOCAL_SECONDS', 30),
+            )
+        return _jtis
+
+
+def clear_local_cache():
+    global _scopes
+    local_jtis().clear()
+    with _local_lock:
+        _scopes = None
+
+
+def refresh_lifetime():
+    return api_settings.REFRESH_TOKEN_LIFETIME
+
+
+def revocation_keys(payload):
+    keys = [f"user:{payload.get(api_settings.USER_ID_CLAIM)}"]
+    if payload.get('team'):
+        keys.append(f"team:{payload['team']}")
+    if payload.get('season'):
+        keys.append(f"season:{payload['season']}")
+    return keys
+
+
+"""
+Every user, team and season cut off as key -> unix time, from this process'
+copy while it is fresh, then the shared cache, then the table
+"""
+def scope_cutoffs():
+    global _scopes
+    with _local_lock:
+        if _scopes is not None and _scopes[0] > time.monotonic():
+            return _scopes[1]
+
+    cutoffs = cache.get(SCOPES_KEY)
+    if cutoffs is None:
+        cutoffs = {
+            key: revoked_before.timestamp()
+            for key, revoked_before in TokenRevocation.objects.filter(
+                expires_at__gte=datetime.now(dt_timezone.utc),
+            ).exclude(key__startswith='jti:').values_list('key', 'revoked_before')
+        }
+        cache.set(SCOPES_KEY, cutoffs, getattr(settings, 'TOKEN_REVOCATION_CACHE_SECONDS', 300))
+    with _local_lock:
+        _scopes = (time.monotonic() + getattr(settings, 'TOKEN_REVOCATION_LOCAL_SECONDS', 30), cutoffs)
+    return cutoffs
+
+
+"""
+The cut off for one refresh token's jti (NOT_REVOKED if it has none), from
+the LRU, then the shared cache, then the table
+"""
+def jti_cutoff(jti):
+    key = f"jti:{jti}"
+    local = local_jtis()
+    cutoff = local.get(key, _MISSING)
+    if cutoff is _MISSING:
+        cutoff = cache.get(CUTOFF_KEY.format(key))
+        if cutoff is None:
+            revoked_before = TokenRevocation.objects.filter(key=key).values_list('revoked_before', flat=True).first()
+            cutoff = revoked_before.timestamp() if revoked_before else NOT_REVOKED
+            cache.set(CUTOFF_KEY.format(key), cutoff, getattr(settings, 'TOKEN_REVOCATION_CACHE_SECONDS', 300))
+        local.set(key, cutoff)
+    return cutoff
+
+
+"""
+Whether a token was issued before cutoff (unix time). iat is whole seconds,
+so it is compared with the cut off's second, and iat_us (see tokens.py)
+tells a token issued earlier in that second from one issued after it.
+"""
+def issued_before(payload, cutoff):
+    if 'iat_us' in payload:
+        #In whole microseconds, a float of them would round
+        return payload['iat_us'] < round(cutoff * 1_000_000)
+    return payload.get('iat', 0) < int(cutoff)
+
+
+"""
+The key of the revocation that catches a token, or None if it isn't revoked.
+The jti is only looked at for refresh tokens.
+"""
+def revoked_by(payload):
+    scopes = scope_cutoffs()
+    for key in revocation_keys(payload):
+        if issued_before(payload, scopes.get(key, NOT_REVOKED)):
+            return key
+    if payload.get(api_settings.TOKEN_TYPE_CLAIM) == 'refresh':
+        jti = payload.get(api_settings.JTI_CLAIM)
+        if issued_before(payload, jti_cutoff(jti)):
+            return f"jti:{jti}"
+    return None
+
+
+def is_revoked(payload):
+    return revoked_by(payload) is not None
+
+
+"""
+Refuses tokens of a user, team or season issued before revoked_before, until
+expires_at (by when every token it could catch has expired)
+"""
+def revoke(key, revoked_before=None, expires_at=None):
+    revoked_before = revoked_before or datetime.now(dt_timezone.utc)
+    TokenRevocation.objects.update_or_create(key=key, defaults={
+        'revoked_before': revoked_before, 'expires_at': expires_at or revoked_before + refresh_lifetime(),
+    })
+    #The next check anywhere reloads the scopes from the table. Again on commit,
+    #another worker may have cached them from before the row was committed
+    _drop_scopes()
+    if connection.in_atomic_block:
+        transaction.on_commit(_drop_scopes)
+
+
+def _drop_scopes():
+    global _scopes
+    cache.delete(SCOPES_KEY)
+    with _local_lock:
+        _scopes = None
+
+
+"""
+Records that a refresh token was just issued and isn't revoked, so refreshing
+with it later finds its jti in the cache instead of going to the table. The
+entry lasts as long as the token.
+"""
+def track_refresh_token(token):
+    key = f"jti:{token[api_settings.JTI_CLAIM]}"
+    cache.set(CUTOFF_KEY.format(key), NOT_REVOKED, max(int(token['exp'] - time.time()), 1))
+    local_jtis().set(key, NOT_REVOKED)
+
+
+"""
+Revokes one refresh token. The cut off is the token's own expiry, so it is
+refused whatever its iat. Raises IntegrityError if it was revoked already,
+which is how two refreshes racing with the same token are told apart.
+"""
+def revoke_refresh_token(token):
+    key = f"jti:{token[api_settings.JTI_CLAIM]}"
+    expires = datetime.fromtimestamp(token['exp'], dt_timezone.utc)
+    with transaction.atomic():
+        TokenRevocation.objects.create(key=key, revoked_before=expires, expires_at=expires)
+    cutoff = expires.timestamp()
+    cache.set(CUTOFF_KEY.format(key), cutoff, max(int(cutoff - time.time()), 1))
+    local_jtis().set(key, cutoff)
+
+
+def revoke_user(user_id):
+    revoke(f"user:{user_id}")
+
+
+def revoke_team(team_name):
+    revoke(f"team:{team_name}")
+
+
+def revoke_season(season=None):
+    revoke(f"season:{season or current_season()}")
+
+
+def prune_revocations():
+    deleted, _ = TokenRevocation.objects.filter(expires_at__lt=datetime.now(dt_timezone.utc)).delete()
+    return deleted
+
+
+"""
+Checks a refresh token, revokes it and returns a new RoleRefreshToken for
+the same user with fresh role claims. A refresh token that has already been
+rotated being used again means it was copied, so every token of that user
+is revoked.
+"""
+def rotate_refresh_token(raw_token):
+    try:
+        token = RoleRefreshToken(raw_token)
+    except TokenError as e:
+        record_refresh('rejected')
+        raise InvalidToken(str(e))
+
+    key = revoked_by(token.payload)
+    if key is not None and key.startswith('jti:'):
+        reused(token)
+    if key is not None:
+        record_refresh('rejected')
+        raise InvalidToken('Token has been revoked')
+
+    new_token = RoleRefreshToken.for_user_id(token[api_settings.USER_ID_CLAIM])
+    if new_token is None:
+        record_refresh('rejected')
+        raise InvalidToken('User not found')
+    try:
+        revoke_refresh_token(token)
+    except IntegrityError:
+        reused(token)
+    track_refresh_token(new_token)
+    record_refresh('refreshed')
+    return new_token
+
+
+def reused(token):
+    record_refresh('reused')
+    revoke_user(token[api_settings.USER_ID_CLAIM])
+    raise InvalidToken('Token has been revoked')
+
+
+def _minute(now=None):
+    return int((now if now is not None else time.time()) // 60)
+
+
+def record_refresh(event):
+    key = METRICS_KEY.format(event, _minute())
+    #add() is a no-op if the counter exists, incr() is atomic on shared caches
+    cache.add(key, 0, 2 * 3600)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, 2 * 3600)
+
+
+"""
+The refresh counts per minute over the last window minutes, oldest first,
+with the totals and the average refreshes per second
+"""
+def refresh_metrics(window=15, now=None):
+    minutes = list(range(_minute(now) - window + 1, _minute(now) + 1))
+    counts = cache.get_many([METRICS_KEY.format(event, minute) for event in METRIC_EVENTS for minute in minutes])
+    metrics = {'window_minutes': window, 'per_minute': []}
+    for minute in minutes:
+        row = {'minute': datetime.fromtimestamp(minute * 60, dt_timezone.utc).isoformat()}
+        for event in METRIC_EVENTS:
+            row[event] = counts.get(METRICS_KEY.format(event, minute), 0)
+        metrics['per_minute'].append(row)
+    for event in METRIC_EVENTS:
+        metrics[event] = sum(row[event] for row in metrics['per_minute'])
+    metrics['refreshes_per_second'] = round(metrics['refreshed'] / (window * 60), 3)
+    return metrics
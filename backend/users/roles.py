@@ -0,0 +1,56 @@
+"""
+Role resolution shared by login, the token claims and the user listings.
+A user's roles come from one query (User.objects.with_roles()) and are cached
+per user. The cache entry is dropped by the profile signals in signals.py.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import User
+
+ROLES_KEY = 'user-roles:{}'
+
+
+"""
+Looks up the roles of one user in a single query. Returns a dict with the
+primary role, every role the user holds, and their team and group (None if
+they aren't a player).
+"""
+def resolve_roles(user_id):
+    row = User.objects.with_roles().filter(id=user_id).values(
+        'role', 'is_club_admin', 'is_umpire', 'is_member', 'is_team_admin', 'team_name', 'group',
+    ).first()
+    if row is None:
+        return None
+
+    roles = []
+    if row['is_club_admin']:
+        roles.append('club_admin')
+    if row['is_umpire']:
+        roles.append('umpire')
+    if row['is_team_admin']:
+        roles.append('team_admin')
+    if row['is_team_admin'] is not None:
+        roles.append('player')
+    if row['is_member'] or not roles:
+        roles.append('member')
+
+    return {
+        'role': row['role'],
+        'roles': roles,
+        'team_name': row['team_name'],
+        'group': row['group'],
+    }
+
+
+def get_roles(user_id):
+    key = ROLES_KEY.format(user_id)
+    roles = cache.get(key)
+    if roles is None:
+        roles = resolve_roles(user_id)
+        cache.set(key, roles, getattr(settings, 'ROLE_CACHE_SECONDS', 600))
+    return roles
+
+
+def invalidate_roles(user_id):
+    cache.delete(ROLES_KEY.format(user_id))
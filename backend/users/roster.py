@@ -0,0 +1,335 @@
+"""
+Bulk roster import and export.
+The league office keeps rosters as spreadsheets of hundreds of players per
+team, so instead of one registration request per person a CSV or XLSX file
+is read row by row (never loaded whole) and imported in chunks:
+
+    - every row in a chunk is checked against the teams and GROUP_CHOICES,
+      and its password against AUTH_PASSWORD_VALIDATORS
+    - emails and id numbers already taken are found with one query per chunk
+    - passwords are hashed on a thread pool (hashlib's scrypt and PBKDF2
+      release the GIL)
+    - the users and their profiles go in with two bulk_creates
+
+Rows without a password get an unusable one and an invite token instead,
+which AcceptInviteView swaps for a password of the player's choosing.
+Rows with a team become players, rows without one become members.
+
+The export goes the other way and yields one row at a time from a server
+side iterator, so the whole table is never held in memory.
+
+Reading and writing XLSX needs openpyxl, CSV works without it.
+"""
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import password_validation
+from django.contrib.auth.hashers import make_password
+from django.core import signing
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import User, PlayerProfile, MemberProfile
+from .response_cache import invalidate
+from .teams import refresh_teams_on_commit, team_names
+
+REQUIRED_COLUMNS = ('email', 'fname', 'sname', 'id_num')
+COLUMNS = REQUIRED_COLUMNS + (
+    'contact', 'dob', 'nationality', 'postal_add', 'residential_add', 'team_name', 'group', 'is_team_admin',
+)
+GROUPS = {group for group, _ in PlayerProfile.GROUP_CHOICES}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'x'}
+MAX_LENGTHS = {
+    field.name: field.max_length for field in User._meta.get_fields()
+    if getattr(field, 'max_length', None)
+}
+
+
+class RosterError(Exception):
+    pass
+
+
+def chunk_size():
+    return getattr(settings, 'ROSTER_IMPORT_CHUNK_SIZE', 500)
+
+
+"""
+Yields each row of a roster file as a dict keyed by column name, with the
+spreadsheet line number under '_line'. Column names are matched loosely, so
+"Team Name" and "team_name" are the same column.
+"""
+def read_rows(handle, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        rows = csv.reader(line.decode('utf-8-sig') if isinstance(line, bytes) else line for line in handle)
+    elif extension == '.xlsx':
+        rows = xlsx_rows(handle)
+    else:
+        raise RosterError('Rosters must be a .csv or .xlsx file.')
+
+    header = next(rows, None)
+    if header is None:
+        raise RosterError('The roster is empty.')
+    header = [str(name or '').strip().lower().replace(' ', '_') for name in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise RosterError(f"Missing columns: {', '.join(missing)}.")
+
+    for line, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        row = dict(zip(header, values))
+        row['_line'] = line
+        yield row
+
+
+def xlsx_rows(handle):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RosterError('Reading .xlsx rosters needs openpyxl installed.')
+    #read_only streams the sheet instead of building every cell up front
+    workbook = load_workbook(handle, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def parse_dob(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=dt_timezone.utc)
+    value = str(value).strip()
+    parsed = parse_datetime(value)
+    if parsed is not None:
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=dt_timezone.utc)
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError
+    return datetime.combine(parsed, time.min, tzinfo=dt_timezone.utc)
+
+
+"""
+Cleans one row, returns (data, errors) where errors maps column to message
+"""
+def clean_row(row):
+    data = {}
+    errors = {}
+    for column in COLUMNS + ('password',):
+        value = row.get(column)
+        data[column] = '' if value is None else str(value).strip()
+
+    for column in REQUIRED_COLUMNS:
+        if not data[column]:
+            errors[column] = 'This field is required.'
+    for column, value in data.items():
+        if column in MAX_LENGTHS and len(value) > MAX_LENGTHS[column]:
+            errors[column] = f"At most {MAX_LENGTHS[column]} characters."
+
+    data['email'] = data['email'].lower()
+    if data['email'] and 'email' not in errors:
+        try:
+            validate_email(data['email'])
+        except DjangoValidationError:
+            errors['email'] = 'Enter a valid email address.'
+
+    if data['team_name'] and data['team_name'] not in team_names():
+        errors['team_name'] = 'Unknown team.'
+    data['group'] = data['group'].upper() or None
+    if data['group'] and data['group'] not in GROUPS:
+        errors['group'] = 'Group must be one of ' + ', '.join(sorted(GROUPS)) + '.'
+    if data['team_name'] and not data['group']:
+        errors['group'] = 'Players need a group.'
+    data['is_team_admin'] = data['is_team_admin'].lower() in TRUE_VALUES
+
+    try:
+        data['dob'] = parse_dob(row.get('dob'))
+    except ValueError:
+        errors['dob'] = 'Enter a date like 1990-05-31.'
+
+    #The same policy as a password set through an invite
+    if data['password']:
+        try:
+            password_validation.validate_password(
+                data['password'], User(email=data['email'], fname=data['fname'], sname=data['sname']),
+            )
+        except DjangoValidationError as e:
+            errors['password'] = ' '.join(e.messages)
+    return data, errors
+
+
+"""
+Hashes a list of passwords, None gives an unusable password. Spread over
+ROSTER_HASH_WORKERS threads (None is one per core, 0 hashes in this thread).
+"""
+def hash_passwords(passwords):
+    workers = getattr(settings, 'ROSTER_HASH_WORKERS', None)
+    if workers is None:
+        #ThreadPoolExecutor's own default is more threads than cores
+        workers = os.cpu_count() or 1
+    if workers == 0 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='roster-hash') as pool:
+        return list(pool.map(make_password, passwords))
+
+
+def _invite_signer():
+    return signing.TimestampSigner(salt='users.roster-invite')
+
+
+def make_invite(user_id):
+    return _invite_signer().sign(str(user_id))
+
+
+"""
+Returns the user an invite token was issued to, or None if the token is bad,
+expired or the user has set a password already (so a token works only once).
+"""
+def read_invite(token):
+    try:
+        user_id = _invite_signer().unsign(token, max_age=getattr(settings, 'ROSTER_INVITE_LIFETIME', 14 * 24 * 3600))
+    except signing.BadSignature:
+        return None
+    user = User.objects.filter(id=user_id).first()
+    if user is None or user.has_usable_password():
+        return None
+    return user
+
+
+"""
+Imports the rows of a roster in chunks. Returns a summary with the number of
+users created, the rows that were skipped and why, and an invite token for
+every user imported without a password. With dry_run the rows are checked
+and counted but nothing is written.
+"""
+def import_roster(rows, dry_run=False):
+    summary = {'created': 0, 'rejected': [], 'invites': []}
+    seen = set()
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size():
+            import_chunk(chunk, seen, summary, dry_run)
+            chunk = []
+    if chunk:
+        import_chunk(chunk, seen, summary, dry_run)
+    return summary
+
+
+def import_chunk(rows, seen, summary, dry_run):
+    cleaned = []
+    for row in rows:
+        data, errors = clean_row(row)
+        cleaned.append((row['_line'], data, errors))
+
+    emails = {data['email'] for _, data, errors in cleaned if not errors}
+    id_nums = {data['id_num'] for _, data, errors in cleaned if not errors}
+    taken = set()
+    for email, id_num in User.objects.filter(Q(email__in=emails) | Q(id_num__in=id_nums)).values_list('email', 'id_num'):
+        taken.update({('email', email.lower()), ('id_num', id_num)})
+
+    accepted = []
+    for line, data, errors in cleaned:
+        for column in ('email', 'id_num'):
+            if column not in errors and ((column, data[column]) in taken or (column, data[column]) in seen):
+                errors[column] = 'Already registered.'
+        if errors:
+            summary['rejected'].append({'line': line, 'email': data['email'], 'errors': errors})
+            continue
+        seen.update({('email', data['email']), ('id_num', data['id_num'])})
+        accepted.append(data)
+
+    if dry_run:
+        summary['created'] += len(accepted)
+        return
+    if not accepted:
+        return
+
+    hashes = hash_passwords([data['password'] or None for data in accepted])
+    users = [
+        User(
+            password=password_hash, **{
+                column: data[column] for column in COLUMNS
+                if column not in ('team_name', 'group', 'is_team_admin')
+            },
+        )
+        for data, password_hash in zip(accepted, hashes)
+    ]
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        if users[0].pk is None:
+            #MySQL doesn't hand back the ids from bulk_create
+            ids = dict(User.objects.filter(email__in=[user.email for user in users]).values_list('email', 'id'))
+            for user in users:
+                user.pk = ids[user.email]
+        PlayerProfile.objects.bulk_create([
+            PlayerProfile(user=user, team_name=data['team_name'], group=data['group'], is_team_admin=data['is_team_admin'])
+            for user, data in zip(users, accepted) if data['team_name']
+        ])
+        MemberProfile.objects.bulk_create([
+            MemberProfile(user=user) for user, data in zip(users, accepted) if not data['team_name']
+        ])
+        refresh_teams_on_commit({data['team_name'] for data in accepted}, roster=True)
+        invalidate('users')
+
+    summary['created'] += len(users)
+    summary['invites'].extend(
+        {'email': user.email, 'token': make_invite(user.pk)}
+        for user, data in zip(users, accepted) if not data['password']
+    )
+
+
+"""
+Yields the header and then one row per player and member. team is optional.
+The users are read with a server side iterator in chunks of 2000 rows.
+"""
+def export_rows(team=None):
+    users = User.objects.with_roles().filter(Q(is_member=True) | Q(is_team_admin__isnull=False))
+    if team:
+        users = users.filter(team_name=team)
+    yield list(COLUMNS)
+    for row in users.order_by('team_name', 'sname', 'id').values_list(*COLUMNS).iterator(chunk_size=2000):
+        row = list(row)
+        dob = row[COLUMNS.index('dob')]
+        row[COLUMNS.index('dob')] = dob.date().isoformat() if dob else ''
+        row[COLUMNS.index('is_team_admin')] = 'yes' if row[COLUMNS.index('is_team_admin')] else ''
+        yield ['' if value is None else value for value in row]
+
+
+class Echo:
+    """
+    A file-like object whose write just hands the line back, so csv.writer
+    can be used to build lines one at a time for a streaming response
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+"""
+Writes the rows to an XLSX file. openpyxl's write only mode keeps just the
+current row in memory.
+"""
+def write_xlsx(rows, handle):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RosterError('Writing .xlsx rosters needs openpyxl installed.')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Roster')
+    for row in rows:
+        sheet.append(row)
+    workbook.save(handle)
@@ -2,7 +2,11 @@
 Purpose of the serializer's is that it connects the backend code to the frontend code
 """
 from rest_framework import serializers
-from .models import User, PlayerProfile, ClubAdmin, UmpireProfile, MemberProfile, Receipt
+from .models import User, PlayerProfile, ClubAdmin, UmpireProfile, MemberProfile, Receipt, Fixture
+from .media import media_url
+from .qr_tokens import current_season
+from .teams import team_names
+from .thumbnails import current_thumbnails
 
 
 """
@@ -27,13 +31,18 @@ class UserSerializer(serializers.ModelSerializer):
 Includes fields from both User and PlayerProfile
 """
 class PlayerRegisterSerializer(UserSerializer):
-    team_name = serializers.ChoiceField(choices=PlayerProfile.TEAM_CHOICES)
+    team_name = serializers.CharField()
     group = serializers.ChoiceField(choices=PlayerProfile.GROUP_CHOICES)
     profile_photo = serializers.ImageField()
 
     class Meta(UserSerializer.Meta):  # Inherit User fields
         fields = UserSerializer.Meta.fields + ['team_name', 'group', 'profile_photo']
 
+    def validate_team_name(self, value):
+        if value not in team_names():
+            raise serializers.ValidationError(f'"{value}" is not a valid choice.')
+        return value
+
     def create(self, validated_data):
         team_name = validated_data.pop('team_name')
         group = validated_data.pop('group')
@@ -133,9 +142,12 @@ class BecomePlayerSerializer(serializers.Serializer):
 
 """
 This serializer is now responsible for displaying all the users in the club
-admin dashboard
+admin dashboard. It expects users from User.objects.with_roles() so that role,
+team_name and group are already on the row.
 """
 class UserListSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    email = serializers.EmailField()
     fname = serializers.CharField()
     sname = serializers.CharField()
     id_num = serializers.CharField()
@@ -144,25 +156,9 @@ class UserListSerializer(serializers.Serializer):
     postal_add = serializers.CharField()
     residential_add = serializers.CharField()
     nationality = serializers.CharField()
-    role = serializers.SerializerMethodField()
-    team_name = serializers.SerializerMethodField()
-
-    def get_role(self, user):
-        if hasattr(user, 'club_admin_profile')and user.club_admin_profile is not None:
-            return 'club_admin'
-        elif hasattr(user, 'umpire_profiles') and user.umpire_profiles is not None:
-            return 'umpire'
-        elif user.player_profiles.exists():
-            first_profiles = user.player_profiles.first()
-            return 'team_admin' if first_profiles.is_team_admin else 'player'
-        elif hasattr(user, 'member_profile') and user.member_profile is not None:
-            return 'member'
-        return 'unknown'
-
-    def get_team_name(self, user):
-        if user.player_profiles.exists():
-            return user.player_profiles.first().team_name
-        return None
+    role = serializers.CharField()
+    team_name = serializers.CharField()
+    group = serializers.CharField()
 
 
 """
@@ -186,9 +182,32 @@ class PlayerProfileSerializer(serializers.ModelSerializer):
             'nationality', 'team_name', 'group', 'is_team_admin', 'profile_photo'
         ]
 
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        request = self.context.get('request')
+        representation['profile_photo'] = media_url(request, instance.profile_photo)
+        representation['profile_photo_thumbnails'] = {
+            size: media_url(request, name) for size, name in current_thumbnails(instance).items()
+        }
+        return representation
+
+
+"""
+The same rows with the photos as stored names instead of signed urls, so a
+whole roster can be cached (see teams.py). Pass profiles with select_related('user').
+"""
+class RosterPlayerSerializer(PlayerProfileSerializer):
+    def to_representation(self, instance):
+        representation = serializers.ModelSerializer.to_representation(self, instance)
+        representation['profile_photo'] = instance.profile_photo.name or None
+        representation['profile_photo_thumbnails'] = current_thumbnails(instance)
+        return representation
+
 
 """
 This is responsible for handling the receipts information
+When serializing many receipts pass Receipt.objects.for_listing() so the
+players and their profiles aren't loaded one receipt at a time
 """
 class ReceiptSerializer(serializers.ModelSerializer):
     player_name = serializers.SerializerMethodField()
@@ -201,10 +220,11 @@ class ReceiptSerializer(serializers.ModelSerializer):
         model = Receipt
         fields = [
             'id', 'player', 'uploaded_by', 'file', 'note',
-            'is_verified', 'uploaded_at', 'qr_code', 
+            'is_verified', 'uploaded_at', 'qr_code', 'qr_status',
             'player_name', 'uploaded_by_name',
             'team_name', 'group', 'qr_code_url'
         ]
+        read_only_fields = ['qr_status']
 
     def get_player_name(self, obj):
         return f"{obj.player.fname} {obj.player.sname}"
@@ -212,33 +232,48 @@ class ReceiptSerializer(serializers.ModelSerializer):
     def get_uploaded_by_name(self, obj):
         return f"{obj.uploaded_by.fname} {obj.uploaded_by.sname}"
 
+    def get_player_profile(self, obj):
+        #Reads from the prefetch when the queryset came from Receipt.objects.for_listing()
+        return next(iter(obj.player.player_profiles.all()), None)
+
     def get_team_name(self, obj):
-        profile = obj.player.player_profiles.first()
+        profile = self.get_player_profile(obj)
         return profile.team_name if profile else None
 
     def get_group(self, obj):
-        profile = obj.player.player_profiles.first()
+        profile = self.get_player_profile(obj)
         return profile.group if profile else None
     
     def get_qr_code_url(self, obj):
-        request = self.context.get('request')
-        if obj.qr_code and hasattr(obj.qr_code, 'url'):
-            if request:
-                return request.build_absolute_uri(obj.qr_code.url)
-            return obj.qr_code.url
-        return None
+        return media_url(self.context.get('request'), obj.qr_code)
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         request = self.context.get('request')
 
-        if instance.file and hasattr(instance.file, 'url'):
-            if request:
-                representation['file'] = request.build_absolute_uri(instance.file.url)
-            else:
-                representation['file'] = instance.file.url
-        else:
-            representation['file'] = None
+        #Media urls are signed so the browser can load them without the JWT
+        representation['file'] = media_url(request, instance.file)
+        representation['qr_code'] = media_url(request, instance.qr_code)
 
         return representation
 
+
+"""
+A fixture with its attendance counters, which are read only (see attendance.py)
+"""
+class FixtureSerializer(serializers.ModelSerializer):
+    season = serializers.CharField(max_length=20, required=False)
+
+    class Meta:
+        model = Fixture
+        fields = [
+            'id', 'home_team', 'away_team', 'season', 'starts_at', 'venue',
+            'scans', 'checked_in_home', 'checked_in_away', 'turned_away',
+        ]
+        read_only_fields = ['scans', 'checked_in_home', 'checked_in_away', 'turned_away']
+
+    def validate(self, data):
+        if data.get('home_team') and data.get('home_team') == data.get('away_team'):
+            raise serializers.ValidationError("A team can't play itself.")
+        data.setdefault('season', current_season())
+        return data
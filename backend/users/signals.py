@@ -0,0 +1,128 @@
+"""
+Signal handlers that keep cached and derived data in step with the database.
+They are connected in UsersConfig.ready()
+"""
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import User, PlayerProfile, Receipt, ClubAdmin, UmpireProfile, MemberProfile, Team, Fixture
+from .attendance import invalidate_fixture
+from .eligibility import grant_eligibility, lapse_eligibility
+from .qr_tokens import invalidate_eligibility
+from .response_cache import invalidate, team_scopes
+from .revocation import revoke_user
+from .roles import invalidate_roles
+from .teams import ROSTER_USER_FIELDS, invalidate_team_names, refresh_teams_on_commit
+from .thumbnails import needs_thumbnails
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_eligibility(instance.id)
+    if kwargs.get('signal') is post_delete:
+        invalidate_roles(instance.id)
+
+
+@receiver(post_save, sender=User)
+def user_roster_changed(sender, instance, update_fields=None, **kwargs):
+    #Logins and password upgrades save the user too but don't show on a roster
+    if update_fields is None or ROSTER_USER_FIELDS & set(update_fields):
+        refresh_teams_on_commit(user_ids=[instance.id], roster=True)
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_listings_changed(sender, instance, update_fields=None, **kwargs):
+    #Nor in the listings, the receipts show the player's name
+    if update_fields is None or set(update_fields) - {'last_login', 'password'}:
+        invalidate('users', 'receipts')
+
+
+@receiver([post_save, post_delete], sender=PlayerProfile)
+def player_profile_changed(sender, instance, **kwargs):
+    invalidate_eligibility(instance.user_id)
+    invalidate_roles(instance.user_id)
+
+
+@receiver(pre_save, sender=PlayerProfile)
+def player_team_moving(sender, instance, update_fields=None, **kwargs):
+    #Remember the team being left so its counters and roster are refreshed too
+    if instance.pk and (update_fields is None or 'team_name' in update_fields):
+        instance._previous_team_name = PlayerProfile.objects.filter(pk=instance.pk).values_list(
+            'team_name', flat=True,
+        ).first()
+
+
+@receiver([post_save, post_delete], sender=PlayerProfile)
+def player_team_changed(sender, instance, **kwargs):
+    teams = {instance.team_name, getattr(instance, '_previous_team_name', None)}
+    refresh_teams_on_commit(teams, roster=True)
+    invalidate('users', 'receipts', *team_scopes(teams))
+
+
+@receiver(post_delete, sender=PlayerProfile)
+def player_removed(sender, instance, **kwargs):
+    #Their tokens still say they are in the team, so cut them off now
+    revoke_user(instance.user_id)
+
+
+@receiver(post_save, sender=PlayerProfile)
+def player_photo_saved(sender, instance, **kwargs):
+    if needs_thumbnails(instance):
+        from .tasks import enqueue_thumbnails
+        enqueue_thumbnails(instance.id)
+
+
+@receiver([post_save, post_delete], sender=ClubAdmin)
+@receiver([post_save, post_delete], sender=UmpireProfile)
+@receiver([post_save, post_delete], sender=MemberProfile)
+def role_profile_changed(sender, instance, **kwargs):
+    invalidate_roles(instance.user_id)
+    invalidate('users')
+
+
+@receiver([post_save, post_delete], sender=Receipt)
+def receipt_changed(sender, instance, **kwargs):
+    invalidate_eligibility(instance.player_id)
+    #The listings filtered to the player's team move when refresh_teams runs
+    invalidate('receipts')
+
+
+@receiver(pre_save, sender=Receipt)
+def receipt_verifying(sender, instance, update_fields=None, **kwargs):
+    #Remember whether it was verified, so saving a verified receipt again doesn't grant again
+    if update_fields is None or 'is_verified' in update_fields:
+        instance._was_verified = bool(instance.pk) and Receipt.objects.filter(pk=instance.pk, is_verified=True).exists()
+
+
+@receiver(post_save, sender=Receipt)
+def receipt_verified(sender, instance, **kwargs):
+    #Runs in the transaction of the save so the receipt and the eligibility row agree
+    was_verified = getattr(instance, '_was_verified', None)
+    if was_verified is None:
+        return
+    del instance._was_verified
+    if instance.is_verified and not was_verified:
+        grant_eligibility([(instance.player_id, instance.id)])
+    elif was_verified and not instance.is_verified:
+        lapse_eligibility([instance.id])
+
+
+@receiver(pre_delete, sender=Receipt)
+def receipt_deleting(sender, instance, **kwargs):
+    #Before the eligibility row's receipt is set to NULL and can't be found
+    lapse_eligibility([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Receipt)
+def receipt_team_counts(sender, instance, **kwargs):
+    refresh_teams_on_commit(user_ids=[instance.player_id])
+
+
+@receiver([post_save, post_delete], sender=Team)
+def team_changed(sender, instance, **kwargs):
+    invalidate_team_names()
+
+
+@receiver([post_save, post_delete], sender=Fixture)
+def fixture_changed(sender, instance, **kwargs):
+    invalidate_fixture(instance.id)
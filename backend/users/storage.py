@@ -0,0 +1,135 @@
+"""
+Content addressed storage for uploaded media.
+Captains upload the same receipt or photo over and over, and the default
+storage keeps every copy under a new suffixed name. This storage names a
+file after the SHA-256 of its bytes instead, sharded two levels deep so no
+directory gets huge:
+
+    receipts/3f/a2/3fa2...c9.pdf
+
+Saving identical bytes again returns the existing name without writing
+anything. The hash is worked out while the upload is streamed to a temporary
+file next to the blobs, so the file is read once and never held in memory,
+and the temporary file is renamed into place atomically. Files that are
+already on disk (large multipart uploads, finished chunked uploads) are
+hashed where they are and moved rather than copied.
+
+Since a blob can be shared by several rows, files are never deleted when a
+row changes. The gc_media command removes blobs nothing points at any more.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+TEMP_DIR = '.incoming'
+CHUNK_SIZE = 64 * 1024
+SHARD_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/')
+
+
+def blob_name(folder, digest, extension):
+    return f"{folder}/{digest[:2]}/{digest[2:4]}/{digest}{extension}".lstrip('/')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        #The real name is only known once the content is hashed in _save
+        return name
+
+    def _save(self, name, content):
+        folder, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+
+        if hasattr(content, 'temporary_file_path'):
+            #Already on disk (large uploads, finished chunked uploads): hash it and move it
+            return self._save_from_path(folder, extension, content.temporary_file_path())
+
+        temp_dir = self.path(TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf-8')
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            return self._store(folder, extension, digest, temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _save_from_path(self, folder, extension, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        temp_dir = self.path(TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        os.close(fd)
+        try:
+            #Same filesystem is a rename, otherwise a copy
+            file_move_safe(path, temp_path, allow_overwrite=True)
+            return self._store(folder, extension, digest, temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _store(self, folder, extension, digest, temp_path):
+        """
+        Moves a fully written temporary file to its blob name, or drops it if
+        the blob is already there.
+        """
+        name = blob_name(folder, digest.hexdigest(), extension)
+        full_path = self.path(name)
+        try:
+            #An orphan being reused has to look new to gc_media until its row is committed
+            os.utime(full_path)
+            os.remove(temp_path)
+            return name
+        except FileNotFoundError:
+            #Not stored yet, or gc_media got to it first
+            pass
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(temp_path, self.file_permissions_mode)
+        #If another request stored the same bytes meanwhile this just replaces them with themselves
+        os.replace(temp_path, full_path)
+        return name
+
+
+content_storage = ContentAddressedStorage()
+
+
+"""
+True for names inside the hash shards of folder, which covers the blobs and
+the thumbnails made next to them but not files from before this storage.
+"""
+def in_shards(name, folder):
+    prefix = folder.rstrip('/') + '/'
+    return name.startswith(prefix) and bool(SHARD_RE.match(name[len(prefix):]))
+
+
+"""
+Returns (model, field) for every file field kept in the content addressed
+storage, used by gc_media to find the folders it owns and the names in use.
+"""
+def content_addressed_fields():
+    from django.apps import apps
+
+    return [
+        (model, field)
+        for model in apps.get_models()
+        for field in model._meta.get_fields()
+        if isinstance(getattr(field, 'storage', None), ContentAddressedStorage)
+    ]
@@ -0,0 +1,211 @@
+"""
+Background work that shouldn't block a request.
+QR codes are rendered on a small local thread pool once the receipt has been
+verified and committed, so the club admin doesn't wait on image encoding and
+disk writes every time they verify a receipt. No broker is needed.
+
+Profile photo thumbnails are made on the same pool after a photo is saved.
+
+Set QR_WORKERS = 0 in settings to render inline (handy for tests and scripts).
+Batches of qr codes have their PNG encoding spread over a process pool sized
+by QR_PROCESSES (defaults to the number of CPU cores, 0 encodes in-process).
+
+The queue only lives in memory, so a restart loses the renders it held and
+leaves their receipts pending. requeue_stale_qr_codes (the requeue_qr_codes
+command) queues them again.
+"""
+import logging
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Receipt, PlayerProfile, render_qr_png
+from .qr_tokens import invalidate_eligibility
+from .response_cache import receipts_changed
+from .teams import refresh_teams
+from .thumbnails import make_derivatives, needs_thumbnails, read_photo, store_derivatives, thumbnail_format, thumbnail_sizes
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_process_pool = None
+_executor_lock = Lock()
+
+#Below this many images the process pool costs more than it saves
+MIN_PARALLEL_BATCH = 4
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'QR_WORKERS', 2),
+                thread_name_prefix='qr-render',
+            )
+        return _executor
+
+
+def get_process_pool():
+    global _process_pool
+    with _executor_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=getattr(settings, 'QR_PROCESSES', None))
+        return _process_pool
+
+
+"""
+Renders the QR code for a single receipt and returns the resulting qr_status.
+It loads its own copy of the receipt so it can run on any thread.
+"""
+def render_qr_code(receipt_id, for_role='player'):
+    try:
+        receipt = Receipt.objects.get(id=receipt_id)
+        receipt.generate_qr_code(for_role=for_role)
+        return Receipt.QR_READY
+    except Receipt.DoesNotExist:
+        logger.warning("Receipt %s was removed before its QR code was rendered", receipt_id)
+        return Receipt.QR_NONE
+    except Exception:
+        logger.exception("Failed to render QR code for receipt %s", receipt_id)
+        Receipt.objects.filter(id=receipt_id).update(qr_status=Receipt.QR_FAILED)
+        receipts_changed(Receipt.objects.filter(id=receipt_id).values_list('player_id', flat=True))
+        return Receipt.QR_FAILED
+
+
+"""
+Renders the QR codes for many receipts at once. The receipts are loaded in
+one query, the PNG encoding is spread over the process pool and
+the rows are written back with a single bulk_update.
+Returns a dict of receipt id -> qr_status.
+"""
+def render_qr_codes(receipt_ids, for_role='player'):
+    receipts = list(Receipt.objects.filter(id__in=receipt_ids))
+    payloads = [receipt.qr_payload(for_role) for receipt in receipts]
+
+    try:
+        if len(payloads) >= MIN_PARALLEL_BATCH and getattr(settings, 'QR_PROCESSES', None) != 0:
+            pngs = list(get_process_pool().map(render_qr_png, payloads, chunksize=8))
+        else:
+            pngs = [render_qr_png(payload) for payload in payloads]
+    except Exception:
+        logger.exception("Failed to render a batch of %s QR codes", len(payloads))
+        Receipt.objects.filter(id__in=[r.id for r in receipts]).update(qr_status=Receipt.QR_FAILED)
+        receipts_changed({receipt.player_id for receipt in receipts})
+        return {receipt.id: Receipt.QR_FAILED for receipt in receipts}
+
+    for receipt, png in zip(receipts, pngs):
+        #A failed write only fails its own receipt
+        try:
+            receipt.attach_qr_png(png, for_role)
+        except Exception:
+            logger.exception("Failed to store the QR code for receipt %s", receipt.id)
+            receipt.qr_status = Receipt.QR_FAILED
+    Receipt.objects.bulk_update(receipts, ['qr_code', 'qr_status'])
+    receipts_changed({receipt.player_id for receipt in receipts})
+
+    statuses = {receipt_id: Receipt.QR_NONE for receipt_id in receipt_ids}
+    statuses.update({receipt.id: receipt.qr_status for receipt in receipts})
+    return statuses
+
+
+"""
+Makes the thumbnails for one player profile if its photo doesn't have them yet
+"""
+def render_thumbnails(profile_id):
+    profile = PlayerProfile.objects.filter(id=profile_id).first()
+    if profile is None or not needs_thumbnails(profile):
+        return None
+    try:
+        image_format = thumbnail_format()
+        derivatives = make_derivatives(read_photo(profile), thumbnail_sizes(), image_format)
+    except Exception:
+        logger.exception("Failed to make thumbnails for player profile %s", profile_id)
+        return None
+    stored = store_derivatives(profile.profile_photo.name, derivatives, image_format)
+    #update() so the post_save signal doesn't queue this again
+    PlayerProfile.objects.filter(id=profile_id).update(photo_thumbnails=stored)
+    invalidate_eligibility(profile.user_id)
+    refresh_teams({profile.team_name}, roster=True)
+    return stored
+
+
+def _in_worker(func, *args):
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def _submit(func, args, future):
+    if getattr(settings, 'QR_WORKERS', 2) == 0:
+        future.set_result(func(*args))
+        return
+
+    def chain(done):
+        if done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result(done.result())
+
+    get_executor().submit(_in_worker, func, *args).add_done_callback(chain)
+
+
+"""
+Marks the receipt as pending and queues the render for after the current
+transaction commits. Returns a Future that resolves to the final qr_status.
+"""
+def enqueue_qr_code(receipt, for_role='player'):
+    receipt.qr_status = Receipt.QR_PENDING
+    receipt.qr_queued_at = timezone.now()
+    Receipt.objects.filter(id=receipt.id).update(qr_status=Receipt.QR_PENDING, qr_queued_at=receipt.qr_queued_at)
+    receipts_changed([receipt.player_id])
+
+    future = Future()
+    transaction.on_commit(lambda: _submit(render_qr_code, (receipt.id, for_role), future))
+    return future
+
+
+"""
+Same as enqueue_qr_code but for a batch of receipt ids, the whole batch is a
+single background job. The caller is expected to have set qr_status and
+qr_queued_at already (usually in the same bulk_update that verified the
+receipts).
+"""
+def enqueue_qr_codes(receipt_ids, for_role='player'):
+    future = Future()
+    receipt_ids = list(receipt_ids)
+    transaction.on_commit(lambda: _submit(render_qr_codes, (receipt_ids, for_role), future))
+    return future
+
+
+"""
+Queues the render again for the receipts that have been pending for longer
+than older_than (a timedelta), in batches of batch_size. Rows from before
+qr_queued_at was recorded count as stale. Returns a list of (receipt_ids,
+Future) per batch.
+"""
+def requeue_stale_qr_codes(older_than, batch_size=500, for_role='player'):
+    stale = Receipt.objects.filter(qr_status=Receipt.QR_PENDING).filter(
+        Q(qr_queued_at__lt=timezone.now() - older_than) | Q(qr_queued_at__isnull=True),
+    )
+    batches = []
+    with transaction.atomic():
+        receipt_ids = list(stale.select_for_update().order_by('id').values_list('id', flat=True))
+        #So a second run before these finish doesn't queue them again
+        Receipt.objects.filter(id__in=receipt_ids).update(qr_queued_at=timezone.now())
+        for start in range(0, len(receipt_ids), batch_size):
+            batch = receipt_ids[start:start + batch_size]
+            batches.append((batch, enqueue_qr_codes(batch, for_role=for_role)))
+    return batches
+
+
+def enqueue_thumbnails(profile_id):
+    future = Future()
+    transaction.on_commit(lambda: _submit(render_thumbnails, (profile_id,), future))
+    return future
@@ -0,0 +1,148 @@
+"""
+Teams, their counters and their cached rosters.
+The league's teams are rows of Team instead of a tuple in the code, and each
+row carries denormalized counters so the team screens don't count anything:
+
+    players_count       player profiles in the team
+    verified_receipts   verified receipts of those players
+    pending_receipts    receipts of those players still waiting on a club admin
+
+The counters are recomputed for the teams touched by a write with one UPDATE,
+after the transaction commits (refresh_teams_on_commit). The signals in
+signals.py cover single saves and the bulk paths call it themselves.
+
+A team's roster (the players as PlayerProfileSerializer shows them, with the
+photos as stored names) is cached under its roster_version, which is bumped
+whenever a player joins, leaves or changes. A roster request is then one
+primary key lookup of the Team row, and its ETag is made from the version and
+the counters so an unchanged roster answers with a 304.
+"""
+import hashlib
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .instrumentation import timed_serialization
+from .media import media_url
+from .models import PlayerProfile, Receipt, Team
+from .response_cache import invalidate, team_scopes
+
+TEAM_NAMES_KEY = 'team-names'
+ROSTER_KEY = 'team-roster:{}:{}'
+#User fields shown on a roster, saves that touch none of them leave it alone
+ROSTER_USER_FIELDS = {'fname', 'sname', 'id_num', 'contact', 'dob', 'nationality'}
+
+
+"""
+The names of every team, cached until a Team is saved or deleted
+"""
+def team_names():
+    names = cache.get(TEAM_NAMES_KEY)
+    if names is None:
+        names = set(Team.objects.values_list('name', flat=True))
+        cache.set(TEAM_NAMES_KEY, names, 3600)
+    return names
+
+
+def invalidate_team_names():
+    cache.delete(TEAM_NAMES_KEY)
+
+
+def teams_of(user_ids):
+    return set(
+        PlayerProfile.objects.filter(user_id__in=user_ids).exclude(team_name='')
+        .values_list('team_name', flat=True).distinct()
+    )
+
+
+def _count(queryset, team_field):
+    counts = queryset.filter(**{team_field: OuterRef('name')}).order_by().values(team_field).annotate(n=Count('id'))
+    return Coalesce(Subquery(counts.values('n')[:1]), Value(0))
+
+
+"""
+Recomputes the counters of the named teams with one UPDATE, and with roster
+bumps their roster_version so the cached rosters are rebuilt
+"""
+def refresh_teams(names, roster=False):
+    names = {name for name in names if name}
+    if not names:
+        return
+    changes = {
+        'players_count': _count(PlayerProfile.objects.all(), 'team_name'),
+        'verified_receipts': _count(Receipt.objects.filter(is_verified=True), 'player__player_profiles__team_name'),
+        'pending_receipts': _count(Receipt.objects.filter(is_verified=False), 'player__player_profiles__team_name'),
+    }
+    if roster:
+        changes['roster_version'] = F('roster_version') + 1
+    Team.objects.filter(name__in=names).update(**changes)
+    #The counters are in the team's cached listings too
+    invalidate(*team_scopes(names))
+
+
+"""
+Runs refresh_teams once the transaction commits, for the given team names
+and the teams of the given users (looked up then)
+"""
+def refresh_teams_on_commit(names=(), user_ids=(), roster=False):
+    names = set(names)
+    user_ids = set(user_ids)
+
+    def refresh():
+        refresh_teams(names | (teams_of(user_ids) if user_ids else set()), roster=roster)
+    transaction.on_commit(refresh)
+
+
+def roster_etag(team):
+    counters = f"{team.name}:{team.roster_version}:{team.players_count}:{team.verified_receipts}:{team.pending_receipts}"
+    return '"' + hashlib.sha1(counters.encode()).hexdigest()[:20] + '"'
+
+
+def build_roster(team_name):
+    from .serializers import RosterPlayerSerializer
+    profiles = list(PlayerProfile.objects.filter(team_name=team_name).select_related('user').order_by('id'))
+    with timed_serialization():
+        return [dict(row) for row in RosterPlayerSerializer(profiles, many=True).data]
+
+
+"""
+The roster rows of a team at its current roster_version, from the cache or
+built with one query
+"""
+def get_roster(team):
+    key = ROSTER_KEY.format(quote(team.name), team.roster_version)
+    rows = cache.get(key)
+    if rows is None:
+        rows = build_roster(team.name)
+        cache.set(key, rows, getattr(settings, 'TEAM_ROSTER_CACHE_SECONDS', 3600))
+    return rows
+
+
+async def aget_roster(team):
+    key = ROSTER_KEY.format(quote(team.name), team.roster_version)
+    rows = await cache.aget(key)
+    if rows is None:
+        rows = await sync_to_async(build_roster)(team.name)
+        await cache.aset(key, rows, getattr(settings, 'TEAM_ROSTER_CACHE_SECONDS', 3600))
+    return rows
+
+
+"""
+Swaps the stored photo names in roster rows for urls the client can load
+"""
+def with_media_urls(request, rows):
+    return [
+        {
+            **row,
+            'profile_photo': media_url(request, row['profile_photo']),
+            'profile_photo_thumbnails': {
+                size: media_url(request, name) for size, name in row['profile_photo_thumbnails'].items()
+            },
+        }
+        for row in rows
+    ]
@@ -1,3 +1,1857 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import views
+from .models import (
+    User, ClubAdmin, PlayerProfile, UmpireProfile, MemberProfile, Receipt, ReceiptUpload, TokenRevocation,
+    Eligibility, GateScan, Season, Team, Fixture, CheckIn,
+)
+from .qr_tokens import InvalidQRToken, current_season, make_token, read_token
+from . import qr_decode
+from .qr_decode import QRDecodeError, center_crop, decode_upload, prepare_image
+from .revocation import (
+    SCOPES_KEY, LRUCache, clear_local_cache, prune_revocations, refresh_metrics, revoke, revoke_season, revoke_user,
+    scope_cutoffs,
+)
+from .roles import get_roles
+from .tokens import RoleRefreshToken
+from . import attendance
+from . import instrumentation
+from .eligibility import grant_eligibility, rollover
+from .tasks import render_qr_codes, requeue_stale_qr_codes
+from .media import media_url
+from .serializers import PlayerProfileSerializer
+from .storage import content_storage
+from .gate import canonical_body, check_snapshot
+from .teams import get_roster
+from .thumbnails import make_derivatives
+from .uploads import create_receipts, match_inserted_ids, part_path
+from rest_framework_simplejwt.tokens import AccessToken
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+"""
+Helper for creating users without going through the registration serializers
+"""
+def make_user(n, **extra):
+    return User.objects.create_user(
+        email=f"user{n}@example.com", password='pass1234',
+        fname=f"First{n}", sname=f"Last{n}", id_num=f"ID{n}", **extra
+    )
+
+
+"""
+Authenticates the client with a real access token, the way the frontend does
+"""
+def use_token(client, user):
+    token = RoleRefreshToken.for_user(user).access_token
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    #A running server has the revocations loaded already
+    scope_cutoffs()
+
+
+"""
+Tests for the club admin all users listing
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AllUsersViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.client = APIClient()
+        use_token(self.client, self.admin)
+        self.url = reverse('all-users')
+
+    def create_users(self, count, start=1):
+        for n in range(start, start + count):
+            user = make_user(n)
+            if n % 4 == 0:
+                UmpireProfile.objects.create(user=user)
+            elif n % 4 == 1:
+                MemberProfile.objects.create(user=user)
+            else:
+                PlayerProfile.objects.create(
+                    user=user, team_name='Phoenix' if n % 2 else 'PWC',
+                    group='A', is_team_admin=(n % 4 == 3),
+                )
+
+    def test_roles_and_teams_are_annotated(self):
+        self.create_users(4)
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        roles = {row['email']: (row['role'], row['team_name']) for row in res.data['results']}
+        self.assertEqual(roles, {
+            'user1@example.com': ('member', None),
+            'user2@example.com': ('player', 'PWC'),
+            'user3@example.com': ('team_admin', 'Phoenix'),
+            'user4@example.com': ('umpire', None),
+        })
+
+    def test_filters(self):
+        self.create_users(8)
+        res = self.client.get(self.url, {'role': 'player'})
+        self.assertEqual({row['email'] for row in res.data['results']}, {'user2@example.com', 'user6@example.com'})
+        res = self.client.get(self.url, {'team': 'Phoenix'})
+        self.assertEqual({row['role'] for row in res.data['results']}, {'team_admin'})
+        res = self.client.get(self.url, {'group': 'A'})
+        self.assertEqual(len(res.data['results']), 4)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.create_users(60)
+        for page_size in (5, 50):
+            # one query to load the user from the token, one for the page itself
+            with self.assertNumQueries(2):
+                res = self.client.get(self.url, {'page_size': page_size})
+            self.assertEqual(len(res.data['results']), page_size)
+
+    @override_settings(JWT_STATELESS_READS=True)
+    def test_stateless_reads_skip_the_user_query(self):
+        self.create_users(10)
+        with self.assertNumQueries(1):
+            res = self.client.get(self.url)
+        self.assertEqual(len(res.data['results']), 10)
+
+    def test_cursor_walks_every_user_once(self):
+        self.create_users(12)
+        seen = []
+        url = self.url + '?page_size=5'
+        while url:
+            res = self.client.get(url)
+            seen.extend(row['id'] for row in res.data['results'])
+            url = res.data['next']
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(len(set(seen)), 12)
+
+    def test_non_admin_is_denied(self):
+        use_token(self.client, make_user(99))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+"""
+Tests for verifying receipts and the background qr code rendering
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    MEDIA_ROOT=MEDIA_ROOT, QR_WORKERS=0,
+)
+class VerifyReceiptViewTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.player = make_user(1)
+        PlayerProfile.objects.create(user=self.player, team_name='Phoenix', group='A')
+        self.receipt = Receipt.objects.create(
+            player=self.player, uploaded_by=self.player,
+            file=SimpleUploadedFile('receipt.pdf', b'%PDF-1.4 receipt'),
+        )
+        self.client = APIClient()
+
+    def test_verify_commits_before_qr_is_rendered(self):
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            res = self.client.post(reverse('receipts-verify', args=[self.receipt.id]))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['qr_status'], Receipt.QR_PENDING)
+
+        self.client.force_authenticate(self.player)
+        res = self.client.get(reverse('player-qr-code'))
+        self.assertEqual(res.data, {'qr_code': None, 'status': Receipt.QR_PENDING})
+
+        for callback in callbacks:
+            callback()
+        self.receipt.refresh_from_db()
+        self.assertTrue(self.receipt.is_verified)
+        self.assertEqual(self.receipt.qr_status, Receipt.QR_READY)
+        res = self.client.get(reverse('player-qr-code'))
+        self.assertEqual(res.data['status'], Receipt.QR_READY)
+        self.assertIn('.png?exp=', res.data['qr_code'])
+
+    def make_receipt(self, player):
+        return Receipt.objects.create(
+            player=player, uploaded_by=player,
+            file=SimpleUploadedFile('receipt.pdf', b'%PDF-1.4 receipt'),
+        )
+
+    def test_bulk_verify_by_ids_reports_each_receipt(self):
+        already = self.make_receipt(self.player)
+        already.is_verified = True
+        already.save()
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                reverse('receipts-verify-bulk'),
+                {'receipt_ids': [self.receipt.id, already.id, 9999]}, format='json',
+            )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['verified'], 1)
+        self.assertEqual(
+            [(row['id'], row['status']) for row in res.data['results']],
+            [(self.receipt.id, 'verified'), (already.id, 'already_verified'), (9999, 'not_found')],
+        )
+        self.assertEqual(res.data['results'][0]['qr_status'], Receipt.QR_PENDING)
+        self.receipt.refresh_from_db()
+        self.assertEqual(self.receipt.qr_status, Receipt.QR_READY)
+
+    def test_bulk_verify_team_renders_in_parallel(self):
+        others = []
+        for n in range(2, 7):
+            player = make_user(n)
+            PlayerProfile.objects.create(user=player, team_name='PWC' if n == 6 else 'Phoenix', group='A')
+            others.append(self.make_receipt(player))
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(reverse('receipts-verify-bulk'), {'team': 'Phoenix'}, format='json')
+        self.assertEqual(res.data['verified'], 5)
+        ready = Receipt.objects.filter(is_verified=True, qr_status=Receipt.QR_READY)
+        self.assertEqual(set(ready.values_list('id', flat=True)), {self.receipt.id, *[r.id for r in others[:4]]})
+        self.assertFalse(Receipt.objects.get(id=others[4].id).is_verified)
+
+    def test_a_failed_write_fails_only_its_receipt(self):
+        other = self.make_receipt(self.player)
+        Receipt.objects.filter(id__in=[self.receipt.id, other.id]).update(qr_status=Receipt.QR_PENDING)
+        attach = Receipt.attach_qr_png
+
+        def failing_attach(receipt, png, for_role='player'):
+            if receipt.id == other.id:
+                raise OSError('No space left on device')
+            attach(receipt, png, for_role)
+
+        with mock.patch.object(Receipt, 'attach_qr_png', failing_attach):
+            statuses = render_qr_codes([self.receipt.id, other.id])
+        self.assertEqual(statuses, {self.receipt.id: Receipt.QR_READY, other.id: Receipt.QR_FAILED})
+        self.assertEqual(Receipt.objects.get(id=self.receipt.id).qr_status, Receipt.QR_READY)
+        self.assertEqual(Receipt.objects.get(id=other.id).qr_status, Receipt.QR_FAILED)
+
+    def test_stale_pending_codes_are_requeued(self):
+        self.client.force_authenticate(self.admin)
+        #The render never runs, as if the worker was restarted
+        with self.captureOnCommitCallbacks(execute=False):
+            self.client.post(reverse('receipts-verify', args=[self.receipt.id]))
+        fresh = self.make_receipt(self.player)
+        Receipt.objects.filter(id=fresh.id).update(qr_status=Receipt.QR_PENDING, qr_queued_at=timezone.now())
+        Receipt.objects.filter(id=self.receipt.id).update(qr_queued_at=timezone.now() - timedelta(minutes=30))
+
+        #The command waits for the renders, which TestCase only runs when this block ends
+        with self.captureOnCommitCallbacks(execute=True):
+            batches = requeue_stale_qr_codes(timedelta(minutes=10))
+        self.assertEqual([receipt_ids for receipt_ids, _ in batches], [[self.receipt.id]])
+        self.assertEqual(batches[0][1].result(), {self.receipt.id: Receipt.QR_READY})
+        self.assertEqual(Receipt.objects.get(id=self.receipt.id).qr_status, Receipt.QR_READY)
+        self.assertEqual(Receipt.objects.get(id=fresh.id).qr_status, Receipt.QR_PENDING)
+
+
+"""
+Tests for the signed qr code tokens and the token scan endpoint
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ScanQRTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.umpire = make_user(0)
+        UmpireProfile.objects.create(user=self.umpire)
+        self.player = make_user(1)
+        PlayerProfile.objects.create(user=self.player, team_name='Phoenix', group='A')
+        self.receipt = Receipt.objects.create(player=self.player, uploaded_by=self.player, file='receipts/r.pdf')
+        self.client = APIClient()
+        self.client.force_authenticate(self.umpire)
+        self.url = reverse('scan-qr-token')
+
+    def test_token_round_trip(self):
+        token = make_token(self.player.id, self.receipt.id, season='2026', expires=2000000000)
+        self.assertEqual(read_token(token, now=0), (self.player.id, self.receipt.id, '2026', 2000000000))
+
+    def test_tampered_and_expired_tokens_are_rejected(self):
+        token = make_token(self.player.id, self.receipt.id, expires=100)
+        with self.assertRaises(InvalidQRToken):
+            read_token(token, now=200)
+        forged = token.replace(f":{self.receipt.id}:", f":{self.receipt.id + 1}:", 1)
+        with self.assertRaises(InvalidQRToken):
+            read_token(forged, now=0)
+        res = self.client.post(self.url, {'token': forged})
+        self.assertEqual(res.status_code, 400)
+
+    def test_scan_reports_payment_status_from_cache(self):
+        token = make_token(self.player.id, self.receipt.id)
+        res = self.client.post(self.url, {'token': token})
+        self.assertEqual(res.data['payment_status'], 'Not verified')
+
+        self.receipt.is_verified = True
+        self.receipt.save()
+        res = self.client.post(self.url, {'token': token})
+        self.assertEqual(res.data['payment_status'], 'Verified')
+        self.assertEqual(res.data['team_name'], 'Phoenix')
+
+        with self.assertNumQueries(0):
+            res = self.client.post(self.url, {'token': token})
+        self.assertTrue(res.data['eligible'])
+
+
+"""
+Tests for preparing uploaded photos before they are decoded
+"""
+class QRDecodeTests(TestCase):
+    def jpeg(self, size):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'white').save(buffer, format='JPEG')
+        return buffer.getvalue()
+
+    def test_photos_are_greyscaled_and_shrunk(self):
+        image = prepare_image(self.jpeg((4000, 3000)), max_side=1000)
+        self.assertEqual(image.mode, 'L')
+        self.assertEqual(image.size, (1000, 750))
+
+    def test_huge_images_are_refused_from_the_header(self):
+        with self.assertRaises(QRDecodeError):
+            prepare_image(self.jpeg((4000, 3000)), max_side=1000, max_pixels=1_000_000)
+
+    def test_a_broken_pool_is_replaced(self):
+        pool = mock.Mock()
+        pool.submit.side_effect = BrokenProcessPool('worker died')
+        with mock.patch.object(qr_decode, '_pool', pool):
+            with self.assertRaises(QRDecodeError):
+                decode_upload(SimpleUploadedFile('qr.jpg', self.jpeg((10, 10))))
+            self.assertIsNone(qr_decode._pool)
+        pool.shutdown.assert_called_once()
+
+    def test_center_crop(self):
+        image = Image.new('L', (1000, 500))
+        self.assertEqual(center_crop(image, 0.6).size, (600, 300))
+        self.assertIs(center_crop(image, 1.0), image)
+
+    def test_batch_reports_each_frame(self):
+        user = make_user(0)
+        member = make_user(1)
+        PlayerProfile.objects.create(user=member, team_name='Phoenix', group='A')
+        client = APIClient()
+        client.force_authenticate(user)
+        frames = [
+            SimpleUploadedFile('one.jpg', b'a qr code'),
+            SimpleUploadedFile('two.txt', b'not an image'),
+            SimpleUploadedFile('three.jpg', b'no qr code'),
+        ]
+
+        def decode(data, max_side, max_pixels):
+            if data == b'not an image':
+                raise ValueError('cannot identify image file')
+            return [make_token(member.id, 1)] if data == b'a qr code' else []
+
+        #A thread pool runs the stand in, the decoder's native library isn't needed
+        with ThreadPoolExecutor(1) as pool, mock.patch.object(qr_decode, '_pool', pool), \
+                mock.patch.object(qr_decode, 'decode_image_bytes', decode):
+            res = client.post(reverse('scan-qr-batch'), {'qr_codes': frames})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(row['name'], row['status']) for row in res.data['results']],
+            [('one.jpg', 200), ('two.txt', 400), ('three.jpg', 400)],
+        )
+        self.assertIn('cannot identify image file', res.data['results'][1]['error'])
+
+    def test_a_missing_reader_is_a_decode_error(self):
+        with mock.patch.dict(sys.modules, {'pyzbar.pyzbar': None}):
+            with self.assertRaises(QRDecodeError):
+                qr_decode.decode_image_bytes(self.jpeg((10, 10)))
+
+
+"""
+Tests that pin the number of queries the receipt listings run
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ReceiptListingQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.client = APIClient()
+
+    def create_receipts(self, count):
+        User.objects.bulk_create([
+            User(email=f"p{n}@example.com", fname=f"P{n}", sname='Player', id_num=f"P{n}")
+            for n in range(count)
+        ])
+        # MySQL doesn't return the ids from bulk_create
+        players = User.objects.filter(email__startswith='p', email__endswith='@example.com')
+        PlayerProfile.objects.bulk_create([
+            PlayerProfile(user=player, team_name='Phoenix', group='B') for player in players
+        ])
+        Receipt.objects.bulk_create([
+            Receipt(player=player, uploaded_by=self.admin, file=f"receipts/{player.id}.pdf")
+            for player in players
+        ])
+
+    def assert_listing_queries(self, url_name, count, queries):
+        self.create_receipts(count)
+        use_token(self.client, self.admin)
+        page_size = min(count, 500)
+        with self.assertNumQueries(queries):
+            res = self.client.get(reverse(url_name), {'page_size': page_size})
+        self.assertEqual(len(res.data['results']), page_size)
+        self.assertEqual(res.data['results'][0]['team_name'], 'Phoenix')
+        self.assertEqual(res.data['results'][0]['group'], 'B')
+
+    # one query loads the user from the token, then receipts and profiles
+    def test_all_receipts_10(self):
+        self.assert_listing_queries('receipts-all', 10, 3)
+
+    def test_all_receipts_100(self):
+        self.assert_listing_queries('receipts-all', 100, 3)
+
+    def test_all_receipts_1000(self):
+        self.assert_listing_queries('receipts-all', 1000, 3)
+
+    def test_unverified_receipts_10(self):
+        self.assert_listing_queries('receipts-unverified', 10, 3)
+
+    def test_unverified_receipts_100(self):
+        self.assert_listing_queries('receipts-unverified', 100, 3)
+
+    def test_unverified_receipts_1000(self):
+        self.assert_listing_queries('receipts-unverified', 1000, 3)
+
+
+"""
+Tests for paging and filtering the receipt listings
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ReceiptListingFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.captain = make_user(1)
+        PlayerProfile.objects.create(user=self.captain, team_name='Phoenix', group='A', is_team_admin=True)
+        self.other = make_user(2)
+        PlayerProfile.objects.create(user=self.other, team_name='PWC', group='B')
+        self.receipts = []
+        for n in range(6):
+            player = self.captain if n % 2 else self.other
+            self.receipts.append(Receipt.objects.create(
+                player=player, uploaded_by=player, file=f"receipts/{n}.pdf", is_verified=(n < 2),
+            ))
+        Receipt.objects.filter(id=self.receipts[0].id).update(uploaded_at='2024-01-15T10:00:00Z')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('receipts-all')
+
+    def ids(self, **params):
+        res = self.client.get(self.url, params)
+        self.assertEqual(res.status_code, 200, res.data)
+        return [row['id'] for row in res.data['results']]
+
+    def test_newest_first_and_cursor_walks_everything(self):
+        seen = []
+        url = self.url + '?page_size=4'
+        while url:
+            res = self.client.get(url)
+            seen.extend(row['id'] for row in res.data['results'])
+            url = res.data['next']
+        self.assertEqual(seen, [r.id for r in reversed(self.receipts[1:])] + [self.receipts[0].id])
+
+    def test_filters(self):
+        self.assertEqual(set(self.ids(team='Phoenix')), {self.receipts[n].id for n in (1, 3, 5)})
+        self.assertEqual(set(self.ids(group='B')), {self.receipts[n].id for n in (0, 2, 4)})
+        self.assertEqual(set(self.ids(verified='true')), {self.receipts[0].id, self.receipts[1].id})
+        self.assertEqual(set(self.ids(uploaded_by=self.other.id, verified='false')), {self.receipts[n].id for n in (2, 4)})
+        self.assertEqual(self.ids(to='2024-01-15'), [self.receipts[0].id])
+        self.assertNotIn(self.receipts[0].id, self.ids(**{'from': '2024-01-16'}))
+
+    def test_bad_filter_values_are_rejected(self):
+        self.assertEqual(self.client.get(self.url, {'verified': 'maybe'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'to': '2024-13-45'}).status_code, 400)
+
+
+"""
+Tests for the shared role resolution and the role claims in the tokens
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RoleResolutionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def login(self, user):
+        return self.client.post(reverse('login'), {'email': user.email, 'password': 'pass1234'}, format='json')
+
+    def test_login_puts_roles_in_the_token(self):
+        captain = make_user(1)
+        PlayerProfile.objects.create(user=captain, team_name='Phoenix', group='A', is_team_admin=True)
+        res = self.login(captain)
+        self.assertEqual(res.data['user']['role'], 'team_admin')
+        claims = AccessToken(res.data['access'])
+        self.assertEqual(claims['role'], 'team_admin')
+        self.assertEqual(claims['roles'], ['team_admin', 'player'])
+        self.assertEqual(claims['team'], 'Phoenix')
+
+    def test_roles_are_resolved_in_one_query_and_cached(self):
+        umpire = make_user(1)
+        UmpireProfile.objects.create(user=umpire)
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_roles(umpire.id)['roles'], ['umpire'])
+        with self.assertNumQueries(0):
+            get_roles(umpire.id)
+
+    def test_new_profile_invalidates_cached_roles(self):
+        admin = make_user(1)
+        ClubAdmin.objects.create(user=admin)
+        self.assertEqual(get_roles(admin.id)['roles'], ['club_admin'])
+        PlayerProfile.objects.create(user=admin, team_name='PWC', group='B')
+        self.assertEqual(get_roles(admin.id)['roles'], ['club_admin', 'player'])
+        self.assertEqual(get_roles(admin.id)['role'], 'club_admin')
+
+    def test_user_without_profile_is_a_member(self):
+        self.assertEqual(self.login(make_user(1)).data['user']['role'], 'member')
+
+
+"""
+Tests for authorizing from the token claims
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ClaimsPermissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.captain = make_user(1)
+        PlayerProfile.objects.create(user=self.captain, team_name='Phoenix', group='A', is_team_admin=True)
+        self.player = make_user(2)
+        PlayerProfile.objects.create(user=self.player, team_name='Phoenix', group='A')
+        other = make_user(3)
+        PlayerProfile.objects.create(user=other, team_name='PWC', group='A')
+        self.client = APIClient()
+
+    def test_team_admin_sees_their_team_from_the_claims(self):
+        use_token(self.client, self.captain)
+        res = self.client.get(reverse('team-players'))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual({row['id'] for row in res.data}, {self.captain.id, self.player.id})
+
+    def test_players_and_club_admin_endpoints_are_denied(self):
+        use_token(self.client, self.player)
+        self.assertEqual(self.client.get(reverse('team-players')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('receipts-unverified')).status_code, 403)
+        self.assertEqual(self.client.post(reverse('receipts-verify-bulk'), {'team': 'Phoenix'}).status_code, 403)
+
+
+"""
+Tests for serving uploaded media
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    MEDIA_ROOT=MEDIA_ROOT, MEDIA_REQUIRE_AUTH=True, MEDIA_OFFLOAD=None,
+)
+class MediaServingTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        os.makedirs(os.path.join(MEDIA_ROOT, 'receipts'), exist_ok=True)
+        with open(os.path.join(MEDIA_ROOT, 'receipts', 'big.pdf'), 'wb') as handle:
+            handle.write(bytes(range(256)) * 4)
+        self.name = 'receipts/big.pdf'
+
+    def test_unsigned_requests_are_refused(self):
+        self.assertEqual(self.client.get('/media/' + self.name).status_code, 403)
+        self.assertEqual(self.client.get('/media/' + self.name + '?exp=9999999999&sig=forged').status_code, 403)
+
+    def test_signed_url_streams_with_validators(self):
+        res = self.client.get(media_url(None, self.name))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), bytes(range(256)) * 4)
+        self.assertIn('private', res['Cache-Control'])
+        self.assertEqual(res['Content-Type'], 'application/pdf')
+
+        res = self.client.get(media_url(None, self.name), HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+
+    def test_jwt_header_is_accepted(self):
+        user = make_user(1)
+        token = RoleRefreshToken.for_user(user).access_token
+        res = self.client.get('/media/' + self.name, HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(res.status_code, 200)
+
+    def test_only_the_media_folders_are_served(self):
+        for name in ('.incoming/uploads/7.part', 'receipts/.incoming/tmp1234', 'backups/users.sql'):
+            os.makedirs(os.path.dirname(os.path.join(MEDIA_ROOT, name)), exist_ok=True)
+            with open(os.path.join(MEDIA_ROOT, name), 'wb') as handle:
+                handle.write(b'private')
+        token = RoleRefreshToken.for_user(make_user(1)).access_token
+        for name in ('.incoming/uploads/7.part', 'receipts/.incoming/tmp1234', 'backups/users.sql'):
+            self.assertEqual(self.client.get('/media/' + name, HTTP_AUTHORIZATION=f"Bearer {token}").status_code, 404)
+            self.assertEqual(self.client.get(media_url(None, name)).status_code, 404)
+
+    def test_byte_ranges(self):
+        url = media_url(None, self.name)
+        res = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(res.streaming_content), bytes(range(10, 20)))
+
+        res = self.client.get(url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(res.streaming_content), bytes(range(252, 256)))
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=5000-').status_code, 416)
+
+    @override_settings(MEDIA_OFFLOAD='x-accel')
+    def test_offload_to_the_proxy(self):
+        res = self.client.get(media_url(None, self.name))
+        self.assertEqual(res['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(res.content, b'')
+
+    def test_paths_outside_media_root_are_not_found(self):
+        res = self.client.get(media_url(None, '../settings.py'))
+        self.assertEqual(res.status_code, 404)
+
+
+"""
+Tests for the profile photo thumbnails
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    MEDIA_ROOT=MEDIA_ROOT, QR_WORKERS=0,
+    PROFILE_THUMBNAIL_SIZES={'small': 32, 'medium': 64}, PROFILE_THUMBNAIL_FORMAT='WEBP',
+)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def photo_bytes(self):
+        image = Image.new('RGB', (400, 200), 'red')
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees
+        exif[0x010F] = 'PhoneMaker'
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def test_derivatives_are_resized_rotated_and_stripped(self):
+        derivatives = make_derivatives(self.photo_bytes(), {'small': 32, 'medium': 64}, 'WEBP')
+        with Image.open(BytesIO(derivatives['medium'])) as medium:
+            self.assertEqual(medium.format, 'WEBP')
+            #Portrait after applying the orientation
+            self.assertEqual(medium.size, (32, 64))
+            self.assertFalse(medium.getexif())
+        with Image.open(BytesIO(derivatives['small'])) as small:
+            self.assertEqual(max(small.size), 32)
+
+    def test_saving_a_photo_makes_thumbnails(self):
+        user = make_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = PlayerProfile.objects.create(
+                user=user, team_name='Phoenix', group='A',
+                profile_photo=SimpleUploadedFile('face.jpg', self.photo_bytes()),
+            )
+        profile.refresh_from_db()
+        self.assertEqual(profile.photo_thumbnails['source'], profile.profile_photo.name)
+        self.assertTrue(profile.photo_thumbnails['small'].endswith('_small.webp'))
+        self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT, profile.photo_thumbnails['medium'])))
+
+        urls = PlayerProfileSerializer(profile).data['profile_photo_thumbnails']
+        self.assertEqual(set(urls), {'small', 'medium'})
+        self.assertEqual(self.client.get(urls['small']).status_code, 200)
+
+    def test_backfill_refreshes_the_cached_roster(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = PlayerProfile.objects.create(
+                user=make_user(1), team_name='Phoenix', group='A',
+                profile_photo=SimpleUploadedFile('face.jpg', self.photo_bytes()),
+            )
+        #As if the photo was uploaded before the thumbnails existed
+        PlayerProfile.objects.filter(id=profile.id).update(photo_thumbnails={})
+        cache.clear()
+        self.assertEqual(get_roster(Team.objects.get(name='Phoenix'))[0]['profile_photo_thumbnails'], {})
+
+        call_command('backfill_thumbnails', processes=1, stdout=StringIO())
+        row = get_roster(Team.objects.get(name='Phoenix'))[0]
+        self.assertEqual(set(row['profile_photo_thumbnails']), {'small', 'medium'})
+
+    def test_thumbnails_of_a_replaced_photo_are_not_served(self):
+        user = make_user(1)
+        with self.captureOnCommitCallbacks(execute=False):
+            profile = PlayerProfile.objects.create(
+                user=user, team_name='Phoenix', group='A',
+                profile_photo=SimpleUploadedFile('face.jpg', self.photo_bytes()),
+                photo_thumbnails={'source': 'profile_photos/old.jpg', 'small': 'profile_photos/thumbs/old_small.webp'},
+            )
+        self.assertEqual(PlayerProfileSerializer(profile).data['profile_photo_thumbnails'], {})
+
+
+"""
+Tests for the content addressed media storage and its garbage collection
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    MEDIA_ROOT=MEDIA_ROOT,
+)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_identical_uploads_share_one_blob(self):
+        player = make_user(1)
+        first = Receipt.objects.create(
+            player=player, uploaded_by=player, file=SimpleUploadedFile('captain.PDF', b'%PDF-1.4 same'),
+        )
+        second = Receipt.objects.create(
+            player=player, uploaded_by=player, file=SimpleUploadedFile('member.pdf', b'%PDF-1.4 same'),
+        )
+        other = Receipt.objects.create(
+            player=player, uploaded_by=player, file=SimpleUploadedFile('member.pdf', b'%PDF-1.4 other'),
+        )
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.file.name, other.file.name)
+        self.assertRegex(first.file.name, r'^receipts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        with first.file.open('rb') as handle:
+            self.assertEqual(handle.read(), b'%PDF-1.4 same')
+        self.assertEqual(os.listdir(content_storage.path('.incoming')), [])
+
+    def test_gc_removes_only_unreferenced_blobs(self):
+        player = make_user(1)
+        kept = Receipt.objects.create(
+            player=player, uploaded_by=player, file=SimpleUploadedFile('kept.pdf', b'%PDF-1.4 kept'),
+        )
+        orphan = content_storage.save('receipts/orphan.pdf', ContentFile(b'%PDF-1.4 orphan'))
+        legacy = 'receipts/legacy_7Vp5n9D.pdf'
+        with open(content_storage.path(legacy), 'wb') as handle:
+            handle.write(b'%PDF-1.4 legacy')
+
+        call_command('gc_media', min_age=0, dry_run=True, stdout=StringIO())
+        self.assertTrue(content_storage.exists(orphan))
+
+        call_command('gc_media', min_age=0, stdout=StringIO())
+        self.assertFalse(content_storage.exists(orphan))
+        self.assertTrue(content_storage.exists(kept.file.name))
+        self.assertTrue(content_storage.exists(legacy))
+
+    def test_reusing_an_old_orphan_makes_it_recent(self):
+        player = make_user(1)
+        name = content_storage.save('receipts/again.pdf', ContentFile(b'%PDF-1.4 again'))
+        os.utime(content_storage.path(name), (0, 0))
+        receipt = Receipt.objects.create(
+            player=player, uploaded_by=player, file=SimpleUploadedFile('again.pdf', b'%PDF-1.4 again'),
+        )
+        self.assertEqual(receipt.file.name, name)
+        Receipt.objects.filter(id=receipt.id).delete()
+        call_command('gc_media', stdout=StringIO())
+        self.assertTrue(content_storage.exists(name))
+
+    def test_gc_keeps_recent_files(self):
+        orphan = content_storage.save('receipts/fresh.pdf', ContentFile(b'%PDF-1.4 fresh'))
+        call_command('gc_media', stdout=StringIO())
+        self.assertTrue(content_storage.exists(orphan))
+
+
+"""
+Tests for chunked, resumable receipt uploads
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    MEDIA_ROOT=MEDIA_ROOT, RECEIPT_UPLOAD_CHUNK_SIZE=16,
+    RECEIPT_UPLOAD_QUOTAS={'player': 64, 'member': 32},
+)
+class ChunkedUploadTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.player = make_user(1)
+        PlayerProfile.objects.create(user=self.player, team_name='Phoenix', group='A')
+        use_token(self.client, self.player)
+        self.content = b'%PDF-1.4 ' + b'x' * 31
+
+    def start(self, size=None):
+        res = self.client.post(reverse('receipt-uploads'), {
+            'player': self.player.id, 'filename': 'receipt.exe', 'size': size or len(self.content),
+        }, format='json')
+        return res
+
+    def put(self, upload_id, offset, data):
+        return self.client.put(
+            reverse('receipt-upload', args=[upload_id]) + f"?offset={offset}", data=data,
+            content_type='application/octet-stream',
+        )
+
+    def test_resumable_upload_creates_receipt_on_completion(self):
+        upload_id = self.start().data['upload_id']
+        self.assertEqual(self.put(upload_id, 0, self.content[:16]).data['offset'], 16)
+
+        #A retried or out of order chunk is refused with the offset to resume from
+        self.assertEqual(self.put(upload_id, 0, self.content[:16]).status_code, 409)
+        self.assertEqual(self.client.get(reverse('receipt-upload', args=[upload_id])).data['offset'], 16)
+        self.assertEqual(self.client.post(reverse('receipt-upload-complete', args=[upload_id])).status_code, 409)
+        self.assertFalse(Receipt.objects.exists())
+
+        self.put(upload_id, 16, self.content[16:32])
+        self.assertEqual(self.put(upload_id, 32, self.content[32:]).data['content_type'], 'application/pdf')
+        res = self.client.post(reverse('receipt-upload-complete', args=[upload_id]))
+        self.assertEqual(res.status_code, 201)
+
+        receipt = Receipt.objects.get()
+        self.assertTrue(receipt.file.name.endswith('.pdf'))
+        with receipt.file.open('rb') as handle:
+            self.assertEqual(handle.read(), self.content)
+        self.assertFalse(ReceiptUpload.objects.exists())
+
+    def test_type_is_sniffed_across_short_first_chunks(self):
+        upload_id = self.start().data['upload_id']
+        self.assertFalse(self.put(upload_id, 0, self.content[:5]).data['content_type'])
+        self.assertEqual(self.put(upload_id, 5, self.content[5:21]).data['content_type'], 'application/pdf')
+        self.put(upload_id, 21, self.content[21:37])
+        self.put(upload_id, 37, self.content[37:])
+        self.assertEqual(self.client.post(reverse('receipt-upload-complete', args=[upload_id])).status_code, 201)
+
+    def test_part_file_is_kept_until_the_receipt_commits(self):
+        upload_id = self.start().data['upload_id']
+        for offset in range(0, len(self.content), 16):
+            self.put(upload_id, offset, self.content[offset:offset + 16])
+        path = part_path(ReceiptUpload.objects.get())
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.client.post(reverse('receipt-upload-complete', args=[upload_id])).status_code, 201)
+        self.assertTrue(os.path.exists(path))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(os.path.exists(path))
+
+    def test_lost_part_file_is_a_conflict(self):
+        upload_id = self.start().data['upload_id']
+        for offset in range(0, len(self.content), 16):
+            self.put(upload_id, offset, self.content[offset:offset + 16])
+        os.remove(part_path(ReceiptUpload.objects.get()))
+        res = self.client.post(reverse('receipt-upload-complete', args=[upload_id]))
+        self.assertEqual((res.status_code, res.data['detail'].code), (409, 'upload_lost'))
+
+    def test_type_is_checked_from_magic_bytes(self):
+        upload_id = self.start().data['upload_id']
+        res = self.put(upload_id, 0, b'MZ\x90\x00 not a pdf!')
+        self.assertEqual(res.status_code, 415)
+        self.assertFalse(ReceiptUpload.objects.exists())
+
+    def test_quota_follows_role(self):
+        self.assertEqual(self.start(size=65).status_code, 413)
+        self.assertEqual(self.start(size=64).status_code, 201)
+
+        member = make_user(2)
+        MemberProfile.objects.create(user=member)
+        use_token(self.client, member)
+        self.assertEqual(self.start(size=64).status_code, 413)
+
+    def test_oversized_chunks_are_refused(self):
+        upload_id = self.start().data['upload_id']
+        self.assertEqual(self.put(upload_id, 0, self.content[:17]).status_code, 413)
+
+    def test_single_request_upload_is_validated(self):
+        res = self.client.post(reverse('receipts-upload'), {
+            'player': self.player.id, 'file': SimpleUploadedFile('receipt.pdf', b'<html>not a pdf</html>'),
+        })
+        self.assertEqual(res.status_code, 415)
+        res = self.client.post(reverse('receipts-upload'), {
+            'player': self.player.id, 'file': SimpleUploadedFile('receipt.pdf', b'%PDF-1.4 ' + b'x' * 100),
+        })
+        self.assertEqual(res.status_code, 413)
+
+
+"""
+Tests for the captain's batch receipt upload
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    MEDIA_ROOT=MEDIA_ROOT, RECEIPT_UPLOAD_QUOTAS={'team_admin': 64, 'member': 32},
+)
+class BatchUploadTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.captain = make_user(0)
+        PlayerProfile.objects.create(user=self.captain, team_name='Phoenix', group='A', is_team_admin=True)
+        self.players = [make_user(n) for n in range(1, 4)]
+        for player in self.players:
+            PlayerProfile.objects.create(user=player, team_name='Phoenix', group='A')
+        self.outsider = make_user(9)
+        PlayerProfile.objects.create(user=self.outsider, team_name='PWC', group='A')
+        use_token(self.client, self.captain)
+        self.url = reverse('receipts-upload-batch')
+
+    def test_pairs_are_checked_and_inserted_together(self):
+        files = [
+            SimpleUploadedFile('a.pdf', b'%PDF-1.4 first'),
+            SimpleUploadedFile('b.png', b'%PDF-1.4 second'),
+            SimpleUploadedFile('c.pdf', b'%PDF-1.4 outsider'),
+            SimpleUploadedFile('d.pdf', b'MZ not a receipt'),
+        ]
+        players = [self.players[0].id, self.players[1].id, self.outsider.id, self.players[2].id]
+        res = self.client.post(self.url, {'player': players, 'file': files, 'note': ['june']})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['created'], 2)
+        self.assertEqual([row['status'] for row in res.data['results']], ['created', 'created', 'rejected', 'rejected'])
+        self.assertEqual(res.data['results'][0]['receipt']['note'], 'june')
+        self.assertEqual(res.data['results'][1]['receipt']['team_name'], 'Phoenix')
+
+        receipts = Receipt.objects.order_by('id')
+        self.assertEqual([receipt.player_id for receipt in receipts], players[:2])
+        self.assertTrue(receipts[1].file.name.endswith('.pdf'))
+        self.assertEqual({receipt.uploaded_by_id for receipt in receipts}, {self.captain.id})
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def upload(players):
+            files = [SimpleUploadedFile(f"{n}.pdf", b'%PDF-1.4 ' + bytes([n])) for n in range(len(players))]
+            return self.client.post(self.url, {'player': players, 'file': files})
+
+        with self.assertNumQueries(7) as small:
+            upload([self.players[0].id])
+        with self.assertNumQueries(len(small.captured_queries)):
+            res = upload([player.id for player in self.players] * 3)
+        self.assertEqual(res.data['created'], 9)
+
+    def test_ids_are_read_back_when_the_insert_does_not_return_them(self):
+        files = [SimpleUploadedFile('same.pdf', b'%PDF-1.4 same') for _ in range(3)]
+        receipts = create_receipts([(self.players[0].id, files[0], 'a'), (self.players[1].id, files[1], 'b'),
+                                    (self.players[0].id, files[2], 'c')], self.captain)
+        expected = [receipt.pk for receipt in receipts]
+        for receipt in receipts:
+            receipt.pk = None
+        match_inserted_ids(receipts, self.captain)
+        self.assertEqual([receipt.pk for receipt in receipts], expected)
+
+    def test_zip_is_split_by_player_id(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as entries:
+            entries.writestr(f"{self.players[0].id}-june.pdf", b'%PDF-1.4 one')
+            entries.writestr(f"team/{self.players[1].id}.jpg", b'\xff\xd8\xff receipt')
+            entries.writestr('notes.txt', b'no player')
+            entries.writestr(f"{self.players[2].id}.pdf", b'%PDF-1.4 ' + b'x' * 100)
+        archive.seek(0)
+        res = self.client.post(self.url, {'archive': SimpleUploadedFile('team.zip', archive.read()), 'note': 'june'})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual([row['status'] for row in res.data['results']], ['created', 'created', 'rejected', 'rejected'])
+        self.assertEqual(Receipt.objects.filter(note='june').count(), 2)
+        with Receipt.objects.get(player=self.players[0], note='june').file.open('rb') as handle:
+            self.assertEqual(handle.read(), b'%PDF-1.4 one')
+
+    def test_only_team_admins_can_batch(self):
+        use_token(self.client, self.players[0])
+        res = self.client.post(self.url, {'player': [self.players[0].id], 'file': [SimpleUploadedFile('a.pdf', b'%PDF-1.4')]})
+        self.assertEqual(res.status_code, 403)
+
+
+"""
+Tests for the bulk roster import and export
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    ROSTER_IMPORT_CHUNK_SIZE=2, ROSTER_HASH_WORKERS=2,
+)
+class RosterTests(TestCase):
+    def setUp(self):
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.client = APIClient()
+        use_token(self.client, self.admin)
+
+    def roster(self, *rows):
+        lines = ['email,fname,sname,id_num,password,team_name,group,is_team_admin,dob'] + list(rows)
+        return SimpleUploadedFile('roster.csv', '\r\n'.join(lines).encode('utf-8-sig'))
+
+    def test_rows_are_checked_and_imported_in_chunks(self):
+        res = self.client.post(reverse('roster-import'), {'file': self.roster(
+            'A@Example.com,Ann,One,R1,plum-kettle-93,Phoenix,a,yes,1990-05-31',
+            'b@example.com,Ben,Two,R2,,Phoenix,A,,',
+            'c@example.com,Cat,Three,R3,,,,,',
+            'user0@example.com,Dup,Email,R4,,,,,',
+            'd@example.com,Bad,Team,R5,,Nowhere,A,,',
+            'e@example.com,Dup,Row,R1,,,,,',
+            'f@example.com,Bad,Date,R6,,,,,yesterday',
+            'g@example.com,Weak,Password,R7,12345,,,,',
+        )})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['created'], 3)
+        self.assertEqual(
+            [(row['line'], list(row['errors'])) for row in res.data['rejected']],
+            [(5, ['email']), (6, ['team_name']), (7, ['id_num']), (8, ['dob']), (9, ['password'])],
+        )
+
+        ann = User.objects.get(email='a@example.com')
+        self.assertTrue(ann.check_password('plum-kettle-93'))
+        self.assertEqual(ann.dob.date().isoformat(), '1990-05-31')
+        profile = ann.player_profiles.get()
+        self.assertEqual((profile.team_name, profile.group, profile.is_team_admin), ('Phoenix', 'A', True))
+        self.assertTrue(MemberProfile.objects.filter(user__email='c@example.com').exists())
+
+        #Users without a password get a single use invite
+        self.assertEqual([invite['email'] for invite in res.data['invites']], ['b@example.com', 'c@example.com'])
+        token = res.data['invites'][0]['token']
+        self.assertFalse(User.objects.get(email='b@example.com').has_usable_password())
+        res = self.client.post(reverse('accept-invite'), {'token': token, 'password': '12345'})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('This password is entirely numeric.', res.data['error'])
+        self.assertEqual(self.client.post(reverse('accept-invite'), {'token': token, 'password': 'plum-kettle-93'}).status_code, 200)
+        self.assertTrue(User.objects.get(email='b@example.com').check_password('plum-kettle-93'))
+        self.assertEqual(self.client.post(reverse('accept-invite'), {'token': token, 'password': 'again'}).status_code, 400)
+
+    def test_dry_run_writes_nothing(self):
+        res = self.client.post(reverse('roster-import'), {
+            'file': self.roster('a@example.com,Ann,One,R1,,Phoenix,A,,'), 'dry_run': 'true',
+        })
+        self.assertEqual((res.status_code, res.data['created']), (200, 1))
+        self.assertFalse(User.objects.filter(email='a@example.com').exists())
+
+    def test_bad_files_are_refused(self):
+        res = self.client.post(reverse('roster-import'), {'file': SimpleUploadedFile('roster.txt', b'email')})
+        self.assertEqual(res.status_code, 400)
+        res = self.client.post(reverse('roster-import'), {'file': SimpleUploadedFile('roster.csv', b'email,fname\r\n')})
+        self.assertIn('id_num', res.data['error'])
+
+    def test_export_streams_what_import_reads(self):
+        self.client.post(reverse('roster-import'), {'file': self.roster(
+            'a@example.com,Ann,One,R1,,Phoenix,A,yes,1990-05-31',
+            'b@example.com,Ben,Two,R2,,PWC,B,,',
+            'c@example.com,Cat,Three,R3,,,,,',
+        )})
+        res = self.client.get(reverse('roster-export'))
+        self.assertTrue(res.streaming)
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['email', 'fname', 'sname', 'id_num'])
+        self.assertEqual(len(lines), 4)
+        self.assertIn('a@example.com,Ann,One,R1,,1990-05-31,,,,Phoenix,A,yes', lines)
+
+        res = self.client.get(reverse('roster-export'), {'team': 'PWC'})
+        self.assertEqual(len(b''.join(res.streaming_content).decode().splitlines()), 2)
+
+    def test_xlsx_round_trip(self):
+        if importlib.util.find_spec('openpyxl') is None:
+            self.skipTest('openpyxl is not installed')
+        self.client.post(reverse('roster-import'), {'file': self.roster('a@example.com,Ann,One,R1,,Phoenix,A,,')})
+        res = self.client.get(reverse('roster-export'), {'type': 'xlsx'})
+        data = b''.join(res.streaming_content)
+        User.objects.filter(email='a@example.com').delete()
+
+        out = StringIO()
+        path = os.path.join(tempfile.mkdtemp(), 'roster.xlsx')
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        call_command('import_roster', path, stdout=out, stderr=StringIO())
+        self.assertIn('Imported 1 users', out.getvalue())
+        self.assertEqual(PlayerProfile.objects.get(user__email='a@example.com').team_name, 'Phoenix')
+
+
+"""
+Tests for the email backend, password upgrades and the login slots
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginTests(TestCase):
+    def setUp(self):
+        self.user = make_user(1)
+        MemberProfile.objects.create(user=self.user)
+        self.client = APIClient()
+
+    def tearDown(self):
+        views._login_slots = None
+
+    def login(self, email='user1@example.com', password='pass1234'):
+        return self.client.post(reverse('login'), {'email': email, 'password': password}, format='json')
+
+    def test_email_is_matched_case_insensitively_in_one_query(self):
+        # the user lookup and the role lookup for the token claims
+        with self.assertNumQueries(2):
+            res = self.login(email=' User1@Example.COM')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+
+    def test_missing_users_still_cost_a_hash(self):
+        with mock.patch('users.backends.User.set_password') as dummy_hash:
+            self.assertEqual(self.login(email='nobody@example.com').status_code, 401)
+        dummy_hash.assert_called_once_with('pass1234')
+
+    def test_old_hashes_are_upgraded_on_login(self):
+        hashers = ['users.hashers.ConfigurableScryptPasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher']
+        with override_settings(PASSWORD_HASHERS=hashers, PASSWORD_SCRYPT={'work_factor': 2 ** 10}):
+            self.assertEqual(self.login().status_code, 200)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith('scrypt$1024$'))
+        with override_settings(PASSWORD_HASHERS=hashers, PASSWORD_SCRYPT={'work_factor': 2 ** 11, 'parallelism': 2}):
+            self.assertEqual(self.login().status_code, 200)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith('scrypt$2048$'))
+            self.assertEqual(self.user.password.split('$')[4], '2')
+
+    @override_settings(LOGIN_MAX_CONCURRENT_HASHES=1, LOGIN_QUEUE_TIMEOUT=0)
+    def test_logins_past_the_limit_are_told_to_retry(self):
+        with views.login_slot():
+            res = self.login()
+        self.assertEqual(res.status_code, 429)
+        self.assertIn('Retry-After', res)
+        self.assertEqual(self.login().status_code, 200)
+
+
+"""
+Tests for refresh token rotation and revocation
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_cache()
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.player = make_user(1)
+        PlayerProfile.objects.create(user=self.player, team_name='Phoenix', group='A')
+        self.client = APIClient()
+
+    def tearDown(self):
+        cache.clear()
+        clear_local_cache()
+
+    def login(self, user):
+        res = self.client.post(reverse('login'), {'email': user.email, 'password': 'pass1234'}, format='json')
+        return res.data['refresh'], res.data['access']
+
+    def refresh(self, token):
+        return self.client.post(reverse('token-refresh'), {'refresh': token}, format='json')
+
+    def qr_code(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        status_code = self.client.get(reverse('player-qr-code')).status_code
+        self.client.credentials()
+        return status_code
+
+    def test_refresh_rotates_without_queries_on_a_warm_cache(self):
+        refresh, _ = self.login(self.player)
+        res = self.refresh(refresh)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(RoleRefreshToken(res.data['refresh'])['team'], 'Phoenix')
+        # only the insert revoking the old token (in a savepoint)
+        with self.assertNumQueries(3):
+            res = self.refresh(res.data['refresh'])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.qr_code(res.data['access']), 200)
+
+    def test_reusing_a_rotated_token_revokes_the_user(self):
+        refresh, _ = self.login(self.player)
+        rotated = self.refresh(refresh).data
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+        self.assertEqual(self.refresh(rotated['refresh']).status_code, 401)
+        self.assertEqual(self.qr_code(rotated['access']), 401)
+
+        metrics = refresh_metrics(window=5)
+        self.assertEqual((metrics['refreshed'], metrics['reused'], metrics['rejected']), (1, 1, 1))
+
+    def test_team_and_season_revocation(self):
+        refresh, access = self.login(self.player)
+        admin_refresh, admin_access = self.login(self.admin)
+        use_token(self.client, self.admin)
+        self.assertEqual(self.client.post(reverse('token-revoke'), {'team': 'Phoenix'}).status_code, 200)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+        self.assertEqual(self.qr_code(access), 401)
+        self.assertEqual(self.qr_code(admin_access), 200)
+
+        revoke_season(current_season())
+        self.assertEqual(self.refresh(admin_refresh).status_code, 401)
+
+    def test_removed_players_are_cut_off(self):
+        refresh, access = self.login(self.player)
+        self.player.player_profiles.all().delete()
+        self.assertEqual(self.qr_code(access), 401)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+    def test_revocations_are_shared_through_the_table(self):
+        refresh, access = self.login(self.player)
+        revoke_user(self.player.id)
+        #Another process with an empty cache
+        cache.clear()
+        clear_local_cache()
+        self.assertEqual(self.qr_code(access), 401)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+        TokenRevocation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(prune_revocations(), 1)
+
+    def test_scopes_are_dropped_again_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            revoke_user(self.player.id)
+            #Another worker reading the table before the commit
+            cache.set(SCOPES_KEY, {})
+        self.assertEqual(scope_cutoffs(), {})
+        for callback in callbacks:
+            callback()
+        self.assertIn(f"user:{self.player.id}", scope_cutoffs())
+
+    def test_logging_in_again_in_the_same_second_works(self):
+        old_refresh, old_access = self.login(self.player)
+        revoke_user(self.player.id)
+        refresh, access = self.login(self.player)
+        self.assertEqual(self.qr_code(access), 200)
+        self.assertEqual(self.refresh(refresh).status_code, 200)
+        self.assertEqual(self.qr_code(old_access), 401)
+
+        #A token without iat_us only has the second it was issued in
+        legacy = AccessToken(access)
+        del legacy['iat_us']
+        revoke(f"user:{self.player.id}", revoked_before=datetime.fromtimestamp(legacy['iat'] + 0.9, dt_timezone.utc))
+        self.assertEqual(self.qr_code(str(legacy)), 200)
+
+    def test_lru_cache(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        lru.ttl = -1
+        lru.set('d', 4)
+        self.assertIsNone(lru.get('d'))
+
+
+
+"""
+Tests for the per season eligibility table
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], CURRENT_SEASON='2026')
+class EligibilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.players = []
+        self.receipts = []
+        for n in range(1, 4):
+            player = make_user(n)
+            PlayerProfile.objects.create(user=player, team_name='Phoenix', group='A')
+            self.players.append(player)
+            self.receipts.append(Receipt.objects.create(player=player, uploaded_by=player, file='receipts/r.pdf'))
+        self.client = APIClient()
+
+    def scan(self, player, season='2026'):
+        self.client.force_authenticate(self.admin)
+        token = make_token(player.id, 1, season=season)
+        return self.client.post(reverse('scan-qr-token'), {'token': token}).data
+
+    def test_verifying_grants_the_season(self):
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('receipts-verify', args=[self.receipts[0].id]))
+            self.client.post(reverse('receipts-verify-bulk'), {'receipt_ids': [self.receipts[1].id]}, format='json')
+
+        rows = Eligibility.objects.filter(season_id='2026').order_by('user_id')
+        self.assertEqual(
+            [(row.user_id, row.status, row.receipt_id) for row in rows],
+            [(self.players[0].id, 'eligible', self.receipts[0].id), (self.players[1].id, 'eligible', self.receipts[1].id)],
+        )
+        self.assertEqual(rows[0].valid_until.isoformat(), '2026-12-31')
+        self.assertTrue(self.scan(self.players[1])['eligible'])
+        self.assertFalse(self.scan(self.players[2])['eligible'])
+        #A token for another season doesn't get in on this season's payment
+        self.assertFalse(self.scan(self.players[1], season='2025')['eligible'])
+
+    def test_only_a_change_of_verification_moves_the_row(self):
+        receipt = self.receipts[0]
+        receipt.is_verified = True
+        receipt.save()
+        row = Eligibility.objects.get(user=self.players[0])
+        self.assertEqual((row.status, row.receipt_id), ('eligible', receipt.id))
+
+        #Saving it again doesn't undo a rollover
+        Eligibility.objects.update(status='lapsed')
+        receipt.note = 'Paid in cash'
+        receipt.save()
+        self.assertEqual(Eligibility.objects.get(user=self.players[0]).status, 'lapsed')
+
+        Eligibility.objects.update(status='eligible')
+        receipt.is_verified = False
+        receipt.save(update_fields=['is_verified'])
+        self.assertEqual(Eligibility.objects.get(user=self.players[0]).status, 'lapsed')
+
+    def test_deleting_the_receipt_lapses_the_row(self):
+        first = self.receipts[0]
+        first.is_verified = True
+        first.save()
+        second = Receipt.objects.create(player=self.players[0], uploaded_by=self.players[0], file='receipts/r.pdf', is_verified=True)
+        self.assertEqual(Eligibility.objects.get(user=self.players[0]).receipt_id, second.id)
+
+        #Another verified receipt still pays for it
+        second.delete()
+        row = Eligibility.objects.get(user=self.players[0])
+        self.assertEqual((row.status, row.receipt_id), ('eligible', first.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        row = Eligibility.objects.get(user=self.players[0])
+        self.assertEqual((row.status, row.receipt_id), ('lapsed', None))
+        self.assertFalse(self.scan(self.players[0])['eligible'])
+
+    def test_dashboard_status_is_one_lookup(self):
+        grant_eligibility([(self.players[0].id, self.receipts[0].id)])
+        self.client.force_authenticate(self.players[0])
+        with self.assertNumQueries(1):
+            res = self.client.get(reverse('player-eligibility'))
+        self.assertEqual(res.data, {'season': '2026', 'status': 'eligible', 'valid_until': '2026-12-31', 'eligible': True})
+        res = self.client.get(reverse('player-eligibility'), {'season': '2027'})
+        self.assertEqual(res.data['status'], None)
+
+    def test_rollover_lapses_and_carries_over(self):
+        grant_eligibility([(player.id, receipt.id) for player, receipt in zip(self.players[:2], self.receipts)])
+        self.assertTrue(self.scan(self.players[0])['eligible'])
+        grant_eligibility([(self.players[1].id, self.receipts[1].id)], season='2027')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lapsed, carried = rollover('2027', grace_days=30)
+        self.assertEqual((lapsed, carried), (2, 1))
+        self.assertEqual(Season.objects.get(name='2027').ends_on.isoformat(), '2027-12-31')
+        self.assertEqual(set(Eligibility.objects.filter(season_id='2026').values_list('status', flat=True)), {'lapsed'})
+        grace = Eligibility.objects.get(user=self.players[0], season_id='2027')
+        self.assertEqual((grace.status, grace.valid_until.isoformat()), ('grace', '2027-01-31'))
+        #The cached entry was dropped, so the old season's qr code stops working straight away
+        self.assertFalse(self.scan(self.players[0])['eligible'])
+        self.assertEqual(Eligibility.objects.get(user=self.players[1], season_id='2027').status, 'eligible')
+
+    def test_rollover_command(self):
+        grant_eligibility([(self.players[0].id, self.receipts[0].id)])
+        out = StringIO()
+        call_command('rollover_season', '2027', '--starts-on', '2027-03-01', '--ends-on', '2028-02-28', stdout=out)
+        self.assertIn('1 lapsed, 0 carried over', out.getvalue())
+        self.assertEqual(Season.objects.get(name='2027').starts_on.isoformat(), '2027-03-01')
+        self.assertFalse(Eligibility.objects.filter(season_id='2027').exists())
+
+
+"""
+Tests for the team counters and the cached rosters
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], JWT_STATELESS_READS=True,
+)
+class TeamRosterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.captain = make_user(1)
+        self.player = make_user(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            PlayerProfile.objects.create(user=self.captain, team_name='Phoenix', group='A', is_team_admin=True)
+            PlayerProfile.objects.create(user=self.player, team_name='Phoenix', group='A')
+            self.receipt = Receipt.objects.create(player=self.player, uploaded_by=self.captain, file='receipts/r.pdf')
+        self.client = APIClient()
+        self.url = reverse('team-roster', args=['Phoenix'])
+
+    def test_counters_follow_writes(self):
+        team = Team.objects.get(name='Phoenix')
+        self.assertEqual((team.players_count, team.verified_receipts, team.pending_receipts), (2, 0, 1))
+
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('receipts-verify-bulk'), {'team': 'Phoenix'}, format='json')
+        team.refresh_from_db()
+        self.assertEqual((team.verified_receipts, team.pending_receipts), (1, 0))
+
+        profile = self.player.player_profiles.get()
+        profile.team_name = 'PWC'
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        counts = dict(Team.objects.filter(name__in=['Phoenix', 'PWC']).values_list('name', 'verified_receipts'))
+        self.assertEqual(counts, {'Phoenix': 0, 'PWC': 1})
+        self.assertEqual(Team.objects.get(name='Phoenix').players_count, 1)
+
+    def test_roster_is_one_query_and_revalidates(self):
+        use_token(self.client, self.admin)
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((res.data['players_count'], res.data['pending_receipts']), (2, 1))
+        self.assertEqual([row['id'] for row in res.data['players']], [self.captain.id, self.player.id])
+
+        with self.assertNumQueries(1):
+            res = self.client.get(self.url)
+        etag = res['ETag']
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+        self.player.fname = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.player.save()
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['players'][1]['fname'], 'Renamed')
+
+    def test_team_admins_only_see_their_own_team(self):
+        use_token(self.client, self.captain)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(self.client.get(reverse('team-roster', args=['PWC'])).status_code, 403)
+        res = self.client.get(reverse('team-players'))
+        self.assertEqual({row['id'] for row in res.data}, {self.captain.id, self.player.id})
+
+        use_token(self.client, self.admin)
+        self.assertEqual(self.client.get(reverse('team-roster', args=['Nobody'])).status_code, 404)
+        res = self.client.get(reverse('teams'))
+        self.assertIn({'team': 'Phoenix', 'players_count': 2, 'verified_receipts': 0, 'pending_receipts': 1}, res.data)
+
+
+"""
+Tests for the offline gate snapshot and the upload of offline scans
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], CURRENT_SEASON='2026')
+class GateSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.umpire = make_user(0)
+        UmpireProfile.objects.create(user=self.umpire)
+        self.home = make_user(1)
+        self.away = make_user(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            PlayerProfile.objects.create(user=self.home, team_name='Phoenix', group='A')
+            PlayerProfile.objects.create(user=self.away, team_name='PWC', group='A')
+        grant_eligibility([(self.home.id, None)])
+        self.client = APIClient()
+        self.client.force_authenticate(self.umpire)
+
+    def snapshot(self):
+        return self.client.get(reverse('gate-snapshot'), {'teams': 'Phoenix,PWC'})
+
+    def delta(self, version):
+        return self.client.get(reverse('gate-snapshot-delta'), {'since': version})
+
+    def test_snapshot_lists_both_teams(self):
+        res = self.snapshot()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['season'], '2026')
+        self.assertEqual(
+            {team: [(row['id'], row['eligible']) for row in rows] for team, rows in res.data['teams'].items()},
+            {'Phoenix': [(self.home.id, True)], 'PWC': [(self.away.id, False)]},
+        )
+        self.assertEqual(self.client.get(reverse('gate-snapshot'), {'teams': 'Phoenix,Nobody'}).status_code, 400)
+
+        self.client.force_authenticate(self.home)
+        self.assertEqual(self.snapshot().status_code, 403)
+
+    @override_settings(GATE_SNAPSHOT_KEY='device-key')
+    def test_body_is_signed(self):
+        body = json.loads(self.snapshot().content)
+        self.assertTrue(check_snapshot(body))
+        expected = hmac.new(b'device-key', canonical_body(body), hashlib.sha256).hexdigest()
+        self.assertEqual(body['signature'], expected)
+
+        #Flipping a player to eligible on the device is caught
+        body['teams']['PWC'][0]['eligible'] = True
+        self.assertFalse(check_snapshot(body))
+        delta = json.loads(self.delta(body['version']).content)
+        self.assertTrue(check_snapshot(delta))
+
+    def test_delta_returns_only_changes(self):
+        version = self.snapshot().data['version']
+        res = self.delta(version)
+        self.assertEqual((res.data['teams'], res.data['members']), ({}, []))
+
+        grant_eligibility([(self.away.id, None)])
+        res = self.delta(version)
+        self.assertEqual([(row['id'], row['eligible']) for row in res.data['members']], [(self.away.id, True)])
+
+        newcomer = make_user(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            PlayerProfile.objects.create(user=newcomer, team_name='Phoenix', group='A')
+        res = self.delta(res.data['version'])
+        self.assertEqual([row['id'] for row in res.data['teams']['Phoenix']], [self.home.id, newcomer.id])
+        self.assertEqual(res.data['members'], [])
+
+        self.assertEqual(self.delta(version[:-2] + 'xx').status_code, 409)
+
+    def test_offline_scans_are_recorded_once(self):
+        now = timezone.now()
+        scans = [
+            {'id': '6f1c0a52-0d1b-4f3e-9a51-1b2c3d4e5f60', 'token': make_token(self.home.id, 1),
+             'scanned_at': now.isoformat(), 'eligible': True},
+            {'id': '6f1c0a52-0d1b-4f3e-9a51-1b2c3d4e5f61', 'token': make_token(self.away.id, 1),
+             'scanned_at': now.isoformat(), 'eligible': True},
+            {'id': '6f1c0a52-0d1b-4f3e-9a51-1b2c3d4e5f62', 'token': 'v1:forged',
+             'scanned_at': now.isoformat()},
+            {'id': 'not-a-uuid', 'token': make_token(self.home.id, 1), 'scanned_at': now.isoformat()},
+        ]
+        url = reverse('gate-offline-scans')
+        res = self.client.post(url, {'scans': scans}, format='json')
+        self.assertEqual(res.data['recorded'], 2)
+        self.assertEqual(
+            [(row['status'], row.get('eligible'), row.get('agreed')) for row in res.data['results']],
+            [('recorded', True, True), ('recorded', False, False), ('rejected', None, None), ('rejected', None, None)],
+        )
+        self.assertEqual(GateScan.objects.filter(umpire=self.umpire).count(), 2)
+
+        res = self.client.post(url, {'scans': scans[:2]}, format='json')
+        self.assertEqual([row['status'] for row in res.data['results']], ['duplicate', 'duplicate'])
+        self.assertEqual(GateScan.objects.count(), 2)
+
+
+"""
+Tests for the fixtures and the buffered check-ins
+"""
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], CURRENT_SEASON='2026',
+    ATTENDANCE_FLUSH_MS=0, ATTENDANCE_BATCH_SIZE=3,
+)
+class AttendanceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        attendance.reset()
+        self.umpire = make_user(0)
+        UmpireProfile.objects.create(user=self.umpire)
+        self.home = [make_user(1), make_user(2)]
+        self.away = make_user(3)
+        self.outsider = make_user(4)
+        for player in self.home:
+            PlayerProfile.objects.create(user=player, team_name='Phoenix', group='A')
+        PlayerProfile.objects.create(user=self.away, team_name='PWC', group='A')
+        PlayerProfile.objects.create(user=self.outsider, team_name='Friends', group='A')
+        grant_eligibility([(player.id, None) for player in (*self.home, self.outsider)])
+        self.fixture = Fixture.objects.create(
+            home_team_id='Phoenix', away_team_id='PWC', season='2026', starts_at=timezone.now(),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.umpire)
+
+    def tearDown(self):
+        attendance.reset()
+
+    def scan(self, player):
+        return self.client.post(
+            reverse('scan-qr-token'), {'token': make_token(player.id, 1), 'fixture': self.fixture.id},
+        ).data
+
+    def test_scans_are_written_in_batches_and_counted_once(self):
+        self.assertEqual(self.scan(self.home[0])['check_in'], 'recorded')
+        self.assertEqual(self.scan(self.home[0])['check_in'], 'duplicate')
+        data = self.scan(self.away)
+        self.assertEqual((data['side'], data['eligible']), ('away', False))
+        self.assertFalse(CheckIn.objects.exists())
+
+        data = self.scan(self.outsider)
+        self.assertEqual((data['side'], data['check_in']), (None, 'recorded'))
+        self.assertEqual(CheckIn.objects.count(), 3)
+
+        self.scan(self.home[1])
+        self.assertEqual(attendance.get_buffer().flush(), 1)
+        self.fixture.refresh_from_db()
+        self.assertEqual(
+            (self.fixture.scans, self.fixture.checked_in_home, self.fixture.checked_in_away, self.fixture.turned_away),
+            (4, 2, 0, 2),
+        )
+
+        #Past the duplicate window a second scan is logged but not counted again
+        attendance.recent_scans().clear()
+        self.scan(self.home[0])
+        attendance.get_buffer().flush()
+        self.fixture.refresh_from_db()
+        self.assertEqual((self.fixture.scans, self.fixture.checked_in_home), (5, 2))
+
+    def test_only_gate_staff_record_check_ins(self):
+        self.client.force_authenticate(self.home[0])
+        token = make_token(self.home[0].id, 1)
+        res = self.client.post(reverse('scan-qr-token'), {'token': token, 'fixture': self.fixture.id})
+        self.assertEqual(res.status_code, 403)
+        #Without a fixture it is a plain scan, open to everyone
+        self.assertEqual(self.client.post(reverse('scan-qr-token'), {'token': token}).status_code, 200)
+        self.assertEqual(attendance.get_buffer().pending(), 0)
+
+    def test_buffer_writes_after_the_interval(self):
+        buffer = attendance.CheckInBuffer(batch_size=100, interval=0.01)
+        with mock.patch.object(attendance, 'write_check_ins') as write:
+            buffer.add('event')
+            for _ in range(100):
+                if write.called:
+                    break
+                time.sleep(0.01)
+            buffer._writer.shutdown(wait=True)
+        write.assert_called_once_with(['event'])
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_fixtures_and_attendance_endpoints(self):
+        admin = make_user(5)
+        ClubAdmin.objects.create(user=admin)
+        self.client.force_authenticate(admin)
+        res = self.client.post(reverse('fixtures'), {
+            'home_team': 'Phoenix', 'away_team': 'Phoenix', 'starts_at': '2026-11-01T10:00:00Z',
+        })
+        self.assertEqual(res.status_code, 400)
+        res = self.client.post(reverse('fixtures'), {
+            'home_team': 'Friends', 'away_team': 'PWC', 'starts_at': '2026-11-01T10:00:00Z',
+        })
+        self.assertEqual((res.status_code, res.data['season']), (201, '2026'))
+
+        self.client.force_authenticate(self.umpire)
+        self.scan(self.home[0])
+        attendance.get_buffer().flush()
+        res = self.client.get(reverse('fixture-attendance', args=[self.fixture.id]))
+        self.assertEqual(res.data['checked_in_home'], 1)
+        self.assertEqual([(row['id'], row['side']) for row in res.data['checked_in']], [(self.home[0].id, 'home')])
+        res = self.client.get(reverse('fixtures'), {'team': 'Friends'})
+        self.assertEqual([row['home_team'] for row in res.data], ['Friends'])
+
+
+"""
+Tests for the async versions of the read and scan endpoints
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], CURRENT_SEASON='2026')
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        attendance.reset()
+        self.umpire = make_user(0)
+        UmpireProfile.objects.create(user=self.umpire)
+        self.admin = make_user(1)
+        ClubAdmin.objects.create(user=self.admin)
+        self.captain = make_user(2)
+        self.player = make_user(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            PlayerProfile.objects.create(user=self.captain, team_name='Phoenix', group='A', is_team_admin=True)
+            PlayerProfile.objects.create(user=self.player, team_name='Phoenix', group='A')
+            self.receipt = Receipt.objects.create(player=self.player, uploaded_by=self.captain, file='receipts/r.pdf')
+        grant_eligibility([(self.player.id, self.receipt.id)])
+        self.fixture = Fixture.objects.create(
+            home_team_id='Phoenix', away_team_id='PWC', season='2026', starts_at=timezone.now(),
+        )
+        #Tokens are made here, the async tests can't query the database directly
+        self.tokens = {
+            user.id: str(RoleRefreshToken.for_user(user).access_token)
+            for user in (self.umpire, self.admin, self.captain, self.player)
+        }
+        scope_cutoffs()
+        self.client = AsyncClient()
+
+    def tearDown(self):
+        attendance.get_buffer().flush()
+        attendance.reset()
+
+    def get(self, user, name, **headers):
+        return self.client.get(reverse(name), headers={'authorization': f"Bearer {self.tokens[user.id]}", **headers})
+
+    def scan(self, body, user=None):
+        headers = {'authorization': f"Bearer {self.tokens[user.id]}"} if user else {}
+        return self.client.post(reverse('scan-qr-token-async'), body, content_type='application/json', headers=headers)
+
+    async def test_scan_token_matches_the_sync_view(self):
+        token = make_token(self.player.id, self.receipt.id)
+        res = await self.scan({'token': token}, self.umpire)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), {**res.json(), 'team_name': 'Phoenix', 'eligible': True, 'payment_status': 'Verified'})
+
+        res = await self.scan({'token': token, 'fixture': self.fixture.id}, self.umpire)
+        self.assertEqual((res.json()['side'], res.json()['check_in']), ('home', 'recorded'))
+        self.assertEqual((await self.scan({'token': token, 'fixture': 999}, self.umpire)).status_code, 404)
+        self.assertEqual((await self.scan({'token': token + 'x'}, self.umpire)).status_code, 400)
+        #Only the gate staff record check-ins
+        res = await self.scan({'token': token, 'fixture': self.fixture.id}, self.player)
+        self.assertEqual(res.status_code, 403)
+
+        res = await self.scan({'token': token})
+        self.assertEqual(res.status_code, 401)
+        self.assertIn('WWW-Authenticate', res)
+
+    async def test_roster_and_qr_code(self):
+        res = await self.get(self.captain, 'team-players-async')
+        self.assertEqual([row['id'] for row in res.json()], [self.captain.id, self.player.id])
+        res = await self.get(self.captain, 'team-players-async', **{'if-none-match': res['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+        res = await self.get(self.player, 'player-qr-code-async')
+        self.assertEqual(res.json(), {'qr_code': None, 'status': Receipt.QR_NONE})
+
+    async def test_unverified_receipts_are_for_club_admins(self):
+        self.assertEqual((await self.get(self.captain, 'receipts-unverified-async')).status_code, 403)
+        res = await self.get(self.admin, 'receipts-unverified-async')
+        self.assertEqual([row['id'] for row in res.json()['results']], [self.receipt.id])
+
+"""
+Tests for the cached listing responses and their invalidation
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.captain = make_user(1)
+        self.other = make_user(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            PlayerProfile.objects.create(user=self.captain, team_name='Phoenix', group='A', is_team_admin=True)
+            PlayerProfile.objects.create(user=self.other, team_name='PWC', group='B')
+            Receipt.objects.create(player=self.captain, uploaded_by=self.captain, file='receipts/a.pdf')
+            Receipt.objects.create(player=self.other, uploaded_by=self.other, file='receipts/b.pdf')
+        self.client = APIClient()
+
+    def test_repeats_are_served_without_queries(self):
+        use_token(self.client, self.admin)
+        for name in ('all-users', 'receipts-all', 'receipts-unverified'):
+            first = self.client.get(reverse(name))
+            # only the user from the token is loaded
+            with self.assertNumQueries(1):
+                res = self.client.get(reverse(name))
+            self.assertEqual(res.data, first.data)
+
+        use_token(self.client, self.captain)
+        first = self.client.get(reverse('team-players'))
+        with self.assertNumQueries(1):
+            res = self.client.get(reverse('team-players'))
+        self.assertEqual(res.data, first.data)
+        self.assertEqual(res['ETag'], first['ETag'])
+
+    def test_writes_invalidate_the_listings(self):
+        use_token(self.client, self.admin)
+        self.assertEqual(len(self.client.get(reverse('receipts-all')).data['results']), 2)
+        self.client.get(reverse('all-users'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Receipt.objects.create(player=self.other, uploaded_by=self.admin, file='receipts/c.pdf')
+        self.assertEqual(len(self.client.get(reverse('receipts-all')).data['results']), 3)
+
+        self.other.fname = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.save()
+        names = {row['player_name'] for row in self.client.get(reverse('receipts-all')).data['results']}
+        self.assertIn('Renamed Last2', names)
+        users = self.client.get(reverse('all-users')).data['results']
+        self.assertIn('Renamed', {row['fname'] for row in users})
+
+        #A login only touches last_login, the cached listing stays
+        self.other.save(update_fields=['last_login'])
+        with self.assertNumQueries(1):
+            self.client.get(reverse('all-users'))
+
+    def test_team_listings_only_move_with_their_team(self):
+        use_token(self.client, self.admin)
+        self.client.get(reverse('receipts-all'), {'team': 'PWC'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Receipt.objects.create(player=self.captain, uploaded_by=self.admin, file='receipts/c.pdf')
+        with self.assertNumQueries(1):
+            res = self.client.get(reverse('receipts-all'), {'team': 'PWC'})
+        self.assertEqual(len(res.data['results']), 1)
+        res = self.client.get(reverse('receipts-all'), {'team': 'Phoenix'})
+        self.assertEqual(len(res.data['results']), 2)
+
+        use_token(self.client, self.captain)
+        self.client.get(reverse('team-players'))
+        profile = self.other.player_profiles.get()
+        profile.team_name = 'Phoenix'
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        res = self.client.get(reverse('team-players'))
+        self.assertEqual({row['id'] for row in res.data}, {self.captain.id, self.other.id})
+
+    def test_metrics(self):
+        use_token(self.client, self.admin)
+        self.client.get(reverse('cache-metrics'))
+        self.client.delete(reverse('cache-metrics'))
+        for _ in range(3):
+            self.client.get(reverse('receipts-all'))
+        res = self.client.get(reverse('cache-metrics'))
+        self.assertEqual(res.data['endpoints']['receipts-all'], {'hits': 2, 'misses': 1, 'hit_ratio': 0.667})
+        self.assertEqual((res.data['hits'], res.data['misses']), (2, 1))
+
+        self.assertEqual(self.client.delete(reverse('cache-metrics')).status_code, 204)
+        self.assertEqual(self.client.get(reverse('cache-metrics')).data['hits'], 0)
+
+        use_token(self.client, self.captain)
+        self.assertEqual(self.client.get(reverse('cache-metrics')).status_code, 403)
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_can_be_turned_off(self):
+        use_token(self.client, self.admin)
+        self.client.get(reverse('all-users'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('all-users'))
+
+"""
+Tests for the request metrics, /metrics and the sampled logs
+"""
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], REQUEST_LOG_SAMPLE_RATE=0)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        instrumentation.reset_metrics()
+        self.admin = make_user(0)
+        ClubAdmin.objects.create(user=self.admin)
+        self.client = APIClient()
+        use_token(self.client, self.admin)
+
+    def metrics(self):
+        res = self.client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return res.content.decode()
+
+    def test_requests_are_measured_per_view(self):
+        for n in range(1, 4):
+            make_user(n)
+        res = self.client.get(reverse('all-users'))
+        self.client.get('/users/nowhere/')
+
+        text = self.metrics()
+        self.assertIn('http_requests_total{view="all-users",method="GET",status="200"} 1', text)
+        self.assertIn('http_requests_total{view="unmatched",method="GET",status="404"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{view="all-users",method="GET"} 1', text)
+        # the user from the token and the page
+        self.assertIn('http_request_db_queries_bucket{view="all-users",le="1"} 0', text)
+        self.assertIn('http_request_db_queries_bucket{view="all-users",le="2"} 1', text)
+        self.assertIn(f'http_response_size_bytes_sum{{view="all-users"}} {len(res.content)}', text)
+        serialize = [line for line in text.splitlines() if line.startswith('http_request_serialize_seconds_sum{view="all-users"}')]
+        self.assertGreater(float(serialize[0].split()[-1]), 0)
+
+    async def test_async_views_are_measured(self):
+        client = AsyncClient()
+        await client.get(reverse('receipts-all-async'))
+        text = instrumentation.render_metrics()
+        self.assertIn('http_requests_total{view="receipts-all-async",method="GET",status="401"} 1', text)
+
+    @override_settings(REQUEST_QUERY_BUDGET=1)
+    def test_requests_over_the_query_budget_are_flagged(self):
+        with self.assertLogs('users.requests', 'WARNING') as logs:
+            self.client.get(reverse('all-users'))
+        self.assertIn('"event": "over_query_budget"', logs.output[0])
+        self.assertIn('"queries": 2', logs.output[0])
+        self.assertIn('http_requests_over_query_budget_total{view="all-users"} 1', self.metrics())
+
+    def test_view_events_are_sampled(self):
+        url = reverse('register_member')
+        with self.assertNoLogs('users', 'INFO'):
+            self.client.post(url, {'email': 'not an email'}, format='json')
+        with override_settings(REQUEST_LOG_SAMPLE_RATE=1), self.assertLogs('users', 'INFO') as logs:
+            self.client.post(url, {'email': 'not an email'}, format='json')
+        self.assertEqual([record.fields['event'] for record in logs.records], ['registration_rejected', 'request'])
+        self.assertNotIn('not an email', ''.join(logs.output))
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.9'])
+    def test_metrics_are_only_for_the_scraper(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.9').status_code, 200)
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""
+Smaller copies of the profile photos.
+Phones upload photos of several MB, which is far too much for a dashboard
+list or for an umpire checking faces at the gate on mobile data. Every photo
+gets a few fixed size derivatives, re-encoded (WebP by default) with the EXIF
+data dropped, stored next to the original under profile_photos/thumbs/.
+The stored names are kept on PlayerProfile.photo_thumbnails together with the
+name of the photo they were made from, so a new photo is noticed.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+DEFAULT_SIZES = {'small': 96, 'medium': 320}
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def thumbnail_sizes():
+    return getattr(settings, 'PROFILE_THUMBNAIL_SIZES', DEFAULT_SIZES)
+
+
+def thumbnail_format():
+    return getattr(settings, 'PROFILE_THUMBNAIL_FORMAT', 'WEBP')
+
+
+"""
+Makes every derivative of one photo and returns {size name: encoded bytes}.
+It only works on bytes so it can run in a process pool.
+"""
+def make_derivatives(data, sizes, image_format):
+    with Image.open(BytesIO(data)) as image:
+        image.draft('RGB', (max(sizes.values()) * 2,) * 2)
+        #Turn the photo the right way up before the EXIF orientation is dropped
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+        derivatives = {}
+        for name, side in sizes.items():
+            copy = image.copy()
+            copy.thumbnail((side, side))
+            buffer = BytesIO()
+            #No exif= argument, so none of the camera metadata is written out
+            copy.save(buffer, format=image_format, quality=80)
+            derivatives[name] = buffer.getvalue()
+        return derivatives
+
+
+def derivative_name(photo_name, size_name, image_format):
+    folder, filename = os.path.split(photo_name)
+    stem = os.path.splitext(filename)[0]
+    return f"{folder}/thumbs/{stem}_{size_name}.{EXTENSIONS[image_format]}"
+
+
+"""
+Writes the derivatives to storage and returns what belongs in
+PlayerProfile.photo_thumbnails. Nothing is saved on the profile itself.
+"""
+def store_derivatives(photo_name, derivatives, image_format):
+    stored = {'source': photo_name}
+    for size_name, data in derivatives.items():
+        name = derivative_name(photo_name, size_name, image_format)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        stored[size_name] = default_storage.save(name, ContentFile(data))
+    return stored
+
+
+def needs_thumbnails(profile):
+    return bool(profile.profile_photo) and profile.photo_thumbnails.get('source') != profile.profile_photo.name
+
+
+def current_thumbnails(profile):
+    """
+    Returns {size name: stored name} for the profile's photo, or {} while the
+    thumbnails are missing or were made from an older photo
+    """
+    if profile is None or needs_thumbnails(profile) or not profile.profile_photo:
+        return {}
+    return {size: name for size, name in profile.photo_thumbnails.items() if size != 'source'}
+
+
+def read_photo(profile):
+    with profile.profile_photo.open('rb') as photo:
+        return photo.read()
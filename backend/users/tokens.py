@@ -0,0 +1,43 @@
+"""
+JWT tokens that carry the user's roles as claims, so views can tell who they
+are dealing with without going back to the database.
+The claims are put on the refresh token and SimpleJWT copies them onto every
+access token made from it. The season claim lets a whole season's tokens be
+revoked at once (see revocation.py). iat is in whole seconds, so the issue
+time is also kept in microseconds (iat_us) for the revocation checks.
+"""
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .qr_tokens import current_season
+from .roles import get_roles
+
+
+class RoleRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.add_role_claims(get_roles(user.id))
+        return token
+
+    @classmethod
+    def for_user_id(cls, user_id):
+        """
+        Same as for_user but without loading the user, for refreshes. Returns
+        None if the user no longer exists.
+        """
+        roles = get_roles(user_id)
+        if roles is None:
+            return None
+        token = cls()
+        token[api_settings.USER_ID_CLAIM] = str(user_id)
+        token.add_role_claims(roles)
+        return token
+
+    def add_role_claims(self, roles):
+        self['role'] = roles['role']
+        self['roles'] = roles['roles']
+        self['team'] = roles['team_name']
+        self['group'] = roles['group']
+        self['season'] = current_season()
+        self['iat_us'] = round(self.current_time.timestamp() * 1_000_000)
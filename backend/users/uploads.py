@@ -0,0 +1,370 @@
+"""
+Chunked, resumable receipt uploads.
+Receipts are often phone photos or scanned PDFs sent over poor connections,
+so instead of one multipart request that restarts from zero when it drops,
+the client sends the file in chunks:
+
+    POST   receipts/uploads/                   {player, filename, size, note}
+    PUT    receipts/uploads/<id>/?offset=<n>   raw bytes of the next chunk
+    GET    receipts/uploads/<id>/              the offset the server has got to
+    POST   receipts/uploads/<id>/complete/     creates the Receipt
+
+Chunks are streamed straight onto a part file next to the content addressed
+blobs, never held in memory. The type is checked from the magic bytes at the
+start of the file (across chunks if the first ones are tiny) rather than the
+file name or the client's Content-Type, and the declared size is held to a
+per-role quota (RECEIPT_UPLOAD_QUOTAS) before any bytes are accepted. On
+completion the part file is hashed and moved into the storage and the
+Receipt row is created.
+
+Captains can also send a whole team's receipts in one request, either as
+player/file pairs or as a zip with one file per player named after the
+player's id (12.pdf, 12-june.jpg). See BatchUploadReceiptView.
+"""
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import Receipt, ReceiptUpload
+from .response_cache import invalidate
+from .storage import CHUNK_SIZE, TEMP_DIR, content_storage
+from .teams import refresh_teams_on_commit
+
+SNIFF_BYTES = 12
+EXTENSIONS = {
+    'application/pdf': '.pdf',
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+}
+DEFAULT_QUOTAS = {
+    'club_admin': 50 * 1024 * 1024,
+    'team_admin': 25 * 1024 * 1024,
+    'player': 10 * 1024 * 1024,
+    'member': 5 * 1024 * 1024,
+}
+
+
+class UploadTooLarge(APIException):
+    status_code = 413
+    default_detail = 'File is larger than your upload limit.'
+    default_code = 'upload_too_large'
+
+
+class UnsupportedUploadType(APIException):
+    status_code = 415
+    default_detail = 'Receipts must be a PDF, JPEG, PNG or WebP file.'
+    default_code = 'unsupported_upload_type'
+
+
+class UploadOffsetMismatch(APIException):
+    status_code = 409
+    default_detail = 'Chunk does not continue the upload.'
+    default_code = 'upload_offset_mismatch'
+
+
+class UploadLost(APIException):
+    status_code = 409
+    default_detail = 'The uploaded data is missing, start the upload again.'
+    default_code = 'upload_lost'
+
+
+def sniff_type(head):
+    """
+    Returns the content type for the first bytes of a file, or None if it
+    isn't one of the accepted receipt formats.
+    """
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def upload_quota(roles):
+    quotas = getattr(settings, 'RECEIPT_UPLOAD_QUOTAS', DEFAULT_QUOTAS)
+    return max((quotas.get(role, 0) for role in roles), default=0) or quotas.get('member', 0)
+
+
+def chunk_size():
+    return getattr(settings, 'RECEIPT_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+
+
+def check_size(size, roles):
+    if size <= 0:
+        raise ValidationError({'size': 'Must be more than 0 bytes.'})
+    if size > upload_quota(roles):
+        raise UploadTooLarge(f"File is larger than your upload limit of {upload_quota(roles)} bytes.")
+
+
+"""
+Checks a file that arrived in one piece (UploadReceiptView) the same way a
+chunked upload is checked and returns the sniffed content type.
+"""
+def check_file(file, roles):
+    check_size(file.size, roles)
+    head = file.read(SNIFF_BYTES)
+    file.seek(0)
+    content_type = sniff_type(head)
+    if content_type is None:
+        raise UnsupportedUploadType()
+    return content_type
+
+
+def receipt_filename(filename, content_type):
+    #The extension follows the real type, whatever the client called the file
+    stem = os.path.splitext(os.path.basename(filename))[0] or 'receipt'
+    return stem + EXTENSIONS[content_type]
+
+
+def part_path(upload):
+    return content_storage.path(f"{TEMP_DIR}/uploads/{upload.id}.part")
+
+
+def upload_status(upload):
+    return {
+        'upload_id': str(upload.id),
+        'offset': upload.received,
+        'size': upload.size,
+        'chunk_size': chunk_size(),
+        'content_type': upload.content_type,
+    }
+
+
+"""
+Appends one chunk read from stream to the part file.
+The caller holds a row lock on the upload so chunks for one upload can't
+interleave. The part file is cut back to the saved offset first, so a chunk
+that was half written when a request died is simply overwritten.
+"""
+def append_chunk(upload, offset, stream, length):
+    if offset != upload.received:
+        raise UploadOffsetMismatch(f"Expected offset {upload.received}.")
+    if length <= 0:
+        raise ValidationError({'chunk': 'Chunk is empty.'})
+    if length > chunk_size():
+        raise UploadTooLarge(f"Chunks can't be more than {chunk_size()} bytes.")
+    if upload.received + length > upload.size:
+        raise UploadTooLarge("Chunk goes past the declared size.")
+
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    head = b''
+    if not upload.content_type and upload.received:
+        #The first chunks were shorter than the magic bytes, carry on from them
+        with open(path, 'rb') as part:
+            head = part.read(min(upload.received, SNIFF_BYTES))
+    with open(path, 'ab') as part:
+        part.truncate(upload.received)
+        while written < length:
+            data = stream.read(min(CHUNK_SIZE, length - written))
+            if not data:
+                break
+            if not upload.content_type and len(head) < SNIFF_BYTES:
+                head += data[:SNIFF_BYTES - len(head)]
+                if len(head) >= min(SNIFF_BYTES, upload.size):
+                    upload.content_type = sniff_type(head) or ''
+                    if not upload.content_type:
+                        raise UnsupportedUploadType()
+            part.write(data)
+            written += len(data)
+
+    if written != length:
+        raise ValidationError({'chunk': 'Chunk is shorter than its Content-Length.'})
+    upload.received += written
+    upload.save(update_fields=['received', 'content_type', 'updated_at'])
+    return upload
+
+
+class PartFile(File):
+    """
+    A staged copy of the finished part file, which the storage can move
+    rather than copy
+    """
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def stage_part(path):
+    """
+    Links the part file to a new name for the storage to move, so the part
+    file itself stays put until the receipt is committed. Copies it where
+    hard links aren't supported.
+    """
+    fd, staged = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.staged')
+    os.close(fd)
+    os.remove(staged)
+    try:
+        os.link(path, staged)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        #Raises FileNotFoundError too if the part file is gone
+        shutil.copyfile(path, staged)
+    return staged
+
+
+"""
+Creates the Receipt from a finished upload. The part file is only removed
+once the transaction commits, so if it rolls back the upload can be
+completed again.
+"""
+def finish_upload(upload):
+    if upload.received != upload.size:
+        raise UploadOffsetMismatch(f"Upload is incomplete, {upload.received} of {upload.size} bytes received.")
+    if not upload.content_type:
+        raise UnsupportedUploadType()
+
+    path = part_path(upload)
+    try:
+        staged = stage_part(path)
+    except FileNotFoundError:
+        raise UploadLost()
+    try:
+        with open(staged, 'rb') as part:
+            with transaction.atomic():
+                receipt = Receipt.objects.create(
+                    player_id=upload.player_id,
+                    uploaded_by_id=upload.uploaded_by_id,
+                    file=PartFile(part, name=receipt_filename(upload.filename, upload.content_type)),
+                    note=upload.note,
+                )
+                upload.delete()
+    finally:
+        #Gone if the storage moved it into place
+        if os.path.exists(staged):
+            os.remove(staged)
+    transaction.on_commit(lambda: discard_part(path))
+    return receipt
+
+
+def discard_part(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_upload(upload):
+    discard_part(part_path(upload))
+    upload.delete()
+
+
+def expired_uploads():
+    lifetime = getattr(settings, 'RECEIPT_UPLOAD_EXPIRY', 24 * 3600)
+    return ReceiptUpload.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=lifetime))
+
+
+def batch_limit():
+    return getattr(settings, 'RECEIPT_BATCH_MAX_ITEMS', 30)
+
+
+"""
+check_file for one item of a batch, returns (content_type, error) so a bad
+file is reported against its item instead of failing the whole batch.
+"""
+def check_batch_file(file, roles):
+    try:
+        return check_file(file, roles), None
+    except ValidationError:
+        return None, 'File is empty.'
+    except (UploadTooLarge, UnsupportedUploadType) as e:
+        return None, str(e.detail)
+
+
+"""
+Splits a zip of receipts into (player_id, file, error) items. The player id
+is the start of each entry's name, up to the first character that isn't a
+digit. Entries are held to the quota from their header before anything is
+extracted, so a small archive can't expand into something huge, and each is
+streamed to a temporary file rather than read into memory.
+"""
+def split_archive(archive, roles):
+    try:
+        entries = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise ValidationError({'archive': 'Not a zip file.'})
+
+    infos = [
+        info for info in entries.infolist()
+        if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+    ]
+    if len(infos) > batch_limit():
+        raise ValidationError({'archive': f"At most {batch_limit()} files per batch."})
+
+    items = []
+    for info in infos:
+        name = os.path.basename(info.filename)
+        digits = len(name) - len(name.lstrip('0123456789'))
+        if not digits:
+            items.append((None, name, 'File name must start with the player id.'))
+        elif info.file_size > upload_quota(roles):
+            items.append((int(name[:digits]), name, UploadTooLarge.default_detail))
+        else:
+            items.append((int(name[:digits]), extract_entry(entries, info, name), None))
+    return items
+
+
+def extract_entry(entries, info, name):
+    file = TemporaryUploadedFile(name, None, info.file_size, None)
+    with entries.open(info) as entry:
+        shutil.copyfileobj(entry, file, CHUNK_SIZE)
+    file.seek(0)
+    return file
+
+
+"""
+Creates the receipts for a batch with one insert inside one transaction.
+pending is a list of (player_id, file, note) whose files have already been
+through check_batch_file. Returns the receipts in the same order.
+"""
+def create_receipts(pending, uploaded_by):
+    receipts = [
+        Receipt(player_id=player_id, uploaded_by=uploaded_by, file=file, note=note)
+        for player_id, file, note in pending
+    ]
+    with transaction.atomic():
+        #Each row's pre_save writes its file to the storage during the insert
+        Receipt.objects.bulk_create(receipts)
+        if receipts and receipts[0].pk is None:
+            match_inserted_ids(receipts, uploaded_by)
+        #bulk_create doesn't send post_save
+        refresh_teams_on_commit(user_ids={receipt.player_id for receipt in receipts})
+        invalidate('receipts')
+    return receipts
+
+
+"""
+MySQL doesn't hand back the ids from a bulk insert, so they are read back.
+Rows are keyed by player and blob name, and for each key the newest rows are
+the ones just inserted, in insert order.
+"""
+def match_inserted_ids(receipts, uploaded_by):
+    keys = [(receipt.player_id, receipt.file.name) for receipt in receipts]
+    rows = Receipt.objects.filter(
+        uploaded_by=uploaded_by,
+        player_id__in={player_id for player_id, _ in keys},
+        file__in={name for _, name in keys},
+        uploaded_at__gte=min(receipt.uploaded_at for receipt in receipts),
+    ).order_by('id').values_list('id', 'player_id', 'file')
+    ids = {}
+    for receipt_id, player_id, name in rows:
+        ids.setdefault((player_id, name), []).append(receipt_id)
+    for key in set(keys):
+        ids[key] = ids[key][-keys.count(key):]
+    for receipt, key in zip(receipts, keys):
+        receipt.pk = ids[key].pop(0)
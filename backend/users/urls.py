@@ -7,6 +7,10 @@ This file acts as the "table of contents" for your web application's URLs.
 
 from django.urls import path
 from .views import *
+from .async_views import (
+    AsyncListAllReceipts, AsyncListUnverifiedReceipts, AsyncPlayerQRCodeView, AsyncScanQRCodeView,
+    AsyncScanQRTokenView, AsyncTeamPlayersView,
+)
 
 urlpatterns = [
     path('register/player/', RegisterPlayerView.as_view(), name='register_player'),
@@ -16,13 +20,42 @@ urlpatterns = [
     path('register/member/', RegisterMemberView.as_view(), name='register_member'),
     path('become-player/', BecomePlayerView.as_view(), name='become_player'),
     path('login/', LoginView.as_view(), name='login'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('token/revoke/', TokenRevokeView.as_view(), name='token-revoke'),
+    path('token/metrics/', TokenMetricsView.as_view(), name='token-metrics'),
+    path('cache/metrics/', ResponseCacheMetricsView.as_view(), name='cache-metrics'),
     path('all-users/', AllUsersView.as_view(), name='all-users'),
+    path('roster/import/', RosterImportView.as_view(), name='roster-import'),
+    path('roster/export/', RosterExportView.as_view(), name='roster-export'),
+    path('invites/accept/', AcceptInviteView.as_view(), name='accept-invite'),
     path('team-players/', TeamPlayersView.as_view(), name='team-players'),
+    path('teams/', TeamListView.as_view(), name='teams'),
+    path('teams/<str:team_name>/roster/', TeamRosterView.as_view(), name='team-roster'),
     path('receipts/upload/', UploadReceiptView.as_view(), name='receipts-upload' ),
+    path('receipts/upload/batch/', BatchUploadReceiptView.as_view(), name='receipts-upload-batch'),
+    path('receipts/uploads/', ReceiptUploadStartView.as_view(), name='receipt-uploads'),
+    path('receipts/uploads/<uuid:upload_id>/', ReceiptUploadChunkView.as_view(), name='receipt-upload'),
+    path('receipts/uploads/<uuid:upload_id>/complete/', ReceiptUploadCompleteView.as_view(), name='receipt-upload-complete'),
     path('receipts/unverified/', ListUnverifiedReceipts.as_view(), name='receipts-unverified'),
     path('receipts/verify/<int:receipt_id>/', VerifyReceiptView.as_view(), name='receipts-verify'),
+    path('receipts/verify/bulk/', BulkVerifyReceiptsView.as_view(), name='receipts-verify-bulk'),
     path('receipts/all/', ListAllReceipts.as_view(), name='receipts-all'),
     path('player/qr-code/', PlayerQRCodeView.as_view(), name='player-qr-code'),
+    path('player/eligibility/', PlayerEligibilityView.as_view(), name='player-eligibility'),
     path('team-admin/qr-code/', TeamAdminQRCodeView.as_view(), name='team-admin-qr-code'),#THIS CAN BE REMOVED
     path('scan-qr/', ScanQRCodeView.as_view(), name='scan-qr'),
+    path('scan-qr/token/', ScanQRTokenView.as_view(), name='scan-qr-token'),
+    path('scan-qr/batch/', ScanQRCodeBatchView.as_view(), name='scan-qr-batch'),
+    path('scan-qr/snapshot/', GateSnapshotView.as_view(), name='gate-snapshot'),
+    path('scan-qr/snapshot/delta/', GateSnapshotDeltaView.as_view(), name='gate-snapshot-delta'),
+    path('scan-qr/offline/', OfflineScanUploadView.as_view(), name='gate-offline-scans'),
+    path('fixtures/', FixtureListView.as_view(), name='fixtures'),
+    path('fixtures/<int:fixture_id>/attendance/', FixtureAttendanceView.as_view(), name='fixture-attendance'),
+    #The same endpoints for ASGI deployments, see async_views.py
+    path('async/team-players/', AsyncTeamPlayersView.as_view(), name='team-players-async'),
+    path('async/receipts/unverified/', AsyncListUnverifiedReceipts.as_view(), name='receipts-unverified-async'),
+    path('async/receipts/all/', AsyncListAllReceipts.as_view(), name='receipts-all-async'),
+    path('async/player/qr-code/', AsyncPlayerQRCodeView.as_view(), name='player-qr-code-async'),
+    path('async/scan-qr/', AsyncScanQRCodeView.as_view(), name='scan-qr-async'),
+    path('async/scan-qr/token/', AsyncScanQRTokenView.as_view(), name='scan-qr-token-async'),
 ]
\ No newline at end of file
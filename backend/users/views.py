@@ -6,19 +6,49 @@ and returning appropriate HTTP responses.
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from django.contrib.auth import authenticate
-from pyzbar.pyzbar import decode
-from PIL import Image
+from rest_framework.exceptions import NotFound, PermissionDenied, Throttled
+from django.contrib.auth import authenticate, password_validation
+from django.core.exceptions import ValidationError as DjangoValidationError
 import json
 from .serializers import *
 from django.shortcuts import render
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from .models import *
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.http import FileResponse, Http404
+from .pagination import UserCursorPagination, ReceiptCursorPagination
+from .filters import filter_receipts, parse_int
+from .permissions import IsClubAdmin, IsGateStaff, IsTeamAdmin, request_claims
+from .media import media_url
+from .tasks import enqueue_qr_code, enqueue_qr_codes
+from .uploads import (
+    UnsupportedUploadType, append_chunk, batch_limit, check_batch_file, check_file, check_size,
+    create_receipts, discard_upload, finish_upload, receipt_filename, split_archive, upload_status,
+)
+from .roster import RosterError, csv_lines, export_rows, import_roster, read_invite, read_rows, write_xlsx
+from .qr_tokens import TOKEN_VERSION, InvalidQRToken, current_season, get_eligibility, read_token
+from .eligibility import grant_eligibility, is_eligible
+from .attendance import check_in, get_fixture, side_of
+from .gate import SnapshotError, build_delta, build_snapshot, max_scans, record_offline_scans
+from .teams import get_roster, refresh_teams_on_commit, roster_etag, team_names, with_media_urls
+from .response_cache import cache_metrics, cached_response, clear_metrics, invalidate, receipt_scopes
+from .instrumentation import log_event, timed_serialization
+from .qr_decode import QRDecodeError, QRDecodeTimeout, decode_upload, decode_uploads
+from django.db import transaction
+from django.db.models import Q
+from .tokens import RoleRefreshToken
+from .revocation import (
+    refresh_metrics, revoke_season, revoke_team, revoke_user, rotate_refresh_token, track_refresh_token,
+)
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+import logging
 import os
+import tempfile
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
 
+logger = logging.getLogger(__name__)
 
 
 """
@@ -31,7 +61,7 @@ class RegisterPlayerView(APIView):
         if serializer.is_valid():
             serializer.save()
             return Response({'message':'Player registered successfully!'}, status=201)
-        print("Serializer errors:", serializer.errors)
+        log_event(logger, 'registration_rejected', role='player', fields=sorted(serializer.errors))
         return Response(serializer.errors, status=400)
 
 
@@ -44,7 +74,7 @@ class RegisterTeamAdminView(APIView):
         if serializer.is_valid():
             serializer.save()
             return Response({'message':'Team Admin registered successfully!'}, status=201)
-        print("Serializer errors:", serializer.errors)
+        log_event(logger, 'registration_rejected', role='team_admin', fields=sorted(serializer.errors))
         return Response(serializer.errors, status=400)
 
 
@@ -53,12 +83,11 @@ This view is responsible for registering the club admin
 """
 class RegisterClubAdminView(APIView):
     def post(self, request):
-        print("Received data:", request.data)
         serializer = ClubAdminRegisterSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
             return Response({'message':'Club Admin registered successfully!'}, status=201)
-        print("Serializer errors:", serializer.errors)
+        log_event(logger, 'registration_rejected', role='club_admin', fields=sorted(serializer.errors))
         return Response(serializer.errors, status=400)
 
 
@@ -83,7 +112,7 @@ class RegisterMemberView(APIView):
         if serializer.is_valid():
             serializer.save()
             return Response({'message':'Member registered successfully!'}, status=201)
-        print("Serializer errors:", serializer.errors)
+        log_event(logger, 'registration_rejected', role='member', fields=sorted(serializer.errors))
         return Response(serializer.errors, status=400)
 
 
@@ -113,6 +142,33 @@ class BecomePlayerView(APIView):
         return Response(serializer.errors, status=400)
 
 
+_login_slots = None
+_login_slots_lock = Lock()
+
+
+"""
+Caps how many password hashes this process runs at once (LOGIN_MAX_CONCURRENT_HASHES).
+Past that, logins wait up to LOGIN_QUEUE_TIMEOUT seconds for a slot and are
+then told to retry, instead of every request slowing down together.
+"""
+@contextmanager
+def login_slot():
+    global _login_slots
+    limit = getattr(settings, 'LOGIN_MAX_CONCURRENT_HASHES', None)
+    if not limit:
+        yield
+        return
+    with _login_slots_lock:
+        if _login_slots is None:
+            _login_slots = BoundedSemaphore(limit)
+    if not _login_slots.acquire(timeout=getattr(settings, 'LOGIN_QUEUE_TIMEOUT', 2)):
+        raise Throttled(wait=1, detail='Too many logins at once, try again in a moment.')
+    try:
+        yield
+    finally:
+        _login_slots.release()
+
+
 """
 This is a single login for all users, which will take them to their respective dashboards!
 """
@@ -122,25 +178,14 @@ class LoginView(APIView):
         email=request.data.get('email')
         password = request.data.get('password')
 
-        user = authenticate(request, email=email, password=password)
+        with login_slot():
+            user = authenticate(request, email=email, password=password)
 
         if user is not None:
-            refresh = RefreshToken.for_user(user)
-
-            #We are detecting the role here
-            role = "member"  # default fallback
-
-            if hasattr(user, 'club_admin_profile'):
-                role = "club_admin"
-            elif hasattr(user, 'umpire_profiles'):
-                role = "umpire"
-            elif user.player_profiles.exists():
-                first_profile = user.player_profiles.first()
-                if first_profile.is_team_admin:
-                    role = "team_admin"
-                else:
-                    role = "player"
-
+            #The role is resolved (and cached) once and carried in the token claims
+            refresh = RoleRefreshToken.for_user(user)
+            track_refresh_token(refresh)
+            role = refresh['role']
 
             return Response({
                 'refresh': str(refresh),
@@ -150,12 +195,86 @@ class LoginView(APIView):
                     'fname':user.fname,
                     'sname':user.sname,
                     'role':role,
+                    'roles':refresh['roles'],
                 }
             })
         else:
             return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
     
 
+"""
+Swaps a refresh token for a new access and refresh token (see revocation.py).
+The old refresh token stops working, and using it again revokes every token
+of that user.
+"""
+class TokenRefreshView(APIView):
+    permission_classes = [AllowAny]
+    #The access token is usually expired by now, so it isn't looked at
+    authentication_classes = []
+
+    def get_authenticate_header(self, request):
+        #Makes a refused refresh token a 401 rather than a 403
+        return 'Bearer realm="api"'
+
+    def post(self, request):
+        raw_token = request.data.get('refresh')
+        if not raw_token:
+            return Response({'error': 'refresh is required.'}, status=400)
+        refresh = rotate_refresh_token(str(raw_token))
+        return Response({'refresh': str(refresh), 'access': str(refresh.access_token)})
+
+
+"""
+This lets the club admin cut off tokens straight away instead of waiting for
+them to expire, for one user, a whole team or a whole season. The users
+then have to log in again.
+"""
+class TokenRevokeView(APIView):
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+
+    def post(self, request):
+        user_id = request.data.get('user')
+        team = request.data.get('team')
+        season = request.data.get('season')
+        if user_id is not None:
+            revoke_user(parse_int('user', str(user_id)))
+        elif team:
+            if team not in team_names():
+                return Response({'error': 'Unknown team'}, status=400)
+            revoke_team(team)
+        elif season:
+            revoke_season(str(season))
+        else:
+            return Response({'error': 'Provide user, team or season'}, status=400)
+        return Response({'message': 'Tokens revoked'})
+
+
+"""
+Refreshes per minute over the last ?minutes= (default 15, at most 120)
+"""
+class TokenMetricsView(APIView):
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+
+    def get(self, request):
+        window = min(parse_int('minutes', request.query_params.get('minutes', '15')), 120)
+        return Response(refresh_metrics(max(window, 1)))
+
+
+"""
+Hit ratios of the cached listings for the club admins, DELETE starts the
+counters again
+"""
+class ResponseCacheMetricsView(APIView):
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+
+    def get(self, request):
+        return Response(cache_metrics())
+
+    def delete(self, request):
+        clear_metrics()
+        return Response(status=204)
+
+
 """
 This allows a user to become a player, note this will only be available to
 umpires and club admins
@@ -171,52 +290,199 @@ class BecomePlayerView(APIView):
             return Response({"detail": "You are already registered as a player."}, status=status.HTTP_400_BAD_REQUEST)
 
         serializer = BecomePlayerSerializer(data=request.data, context={'request': request})
-        print("Serializer context keys:", serializer.context.keys())  # <-- should include 'request'
         if serializer.is_valid():
             serializer.save(user=user)
             return Response({"detail": "Successfully registered as a player."}, status=status.HTTP_201_CREATED)
+        log_event(logger, 'become_player_rejected', user=user.id, fields=sorted(serializer.errors))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 """
 This view will allow club admins to be able to view all the users
+The role, team and group are computed in the database and the results are
+cursor paginated, so a page always costs the same number of queries.
+Filter with ?role=, ?team= and ?group=
 """
 class AllUsersView(APIView):
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+    pagination_class = UserCursorPagination
 
     def get(self, request):
-        user = request.user
-        if not hasattr(user, 'club_admin_profile'):
-            return Response({'detail': 'Access denied. You are not a club admin.'}, status=403)
+        #The admin is left out of their own listing, so it varies by admin
+        return Response(cached_response(request, 'all-users', ['users'], lambda: self.page(request), vary=[request.user.id]))
 
+    def page(self, request):
         #This will collect all the users except the requesting club admin
-        users = User.objects.exclude(id=user.id)
-        serializer = UserListSerializer(users, many=True)
-        return Response(serializer.data, status=200)
+        users = User.objects.with_roles().exclude(id=request.user.id)
+
+        role = request.query_params.get('role')
+        team = request.query_params.get('team')
+        group = request.query_params.get('group')
+        if role:
+            users = users.filter(role=role)
+        if team:
+            users = users.filter(team_name=team)
+        if group:
+            users = users.filter(group=group)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(users, request, view=self)
+        with timed_serialization():
+            data = UserListSerializer(page, many=True).data
+        return paginator.get_paginated_response(data).data
+
+
+"""
+This lets the club admin import a whole roster spreadsheet (CSV or XLSX) in
+one request, see roster.py. Pass dry_run=true to only check the rows.
+Rows that can't be imported are reported with their line and the reasons,
+and users imported without a password get an invite token.
+"""
+class RosterImportView(APIView):
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+
+    def post(self, request):
+        roster = request.FILES.get('file')
+        if roster is None:
+            return Response({'error': 'No file uploaded.'}, status=400)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        try:
+            summary = import_roster(read_rows(roster, roster.name), dry_run=dry_run)
+        except RosterError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(summary, status=200 if dry_run else 201)
+
+
+"""
+Streams every player and member as a CSV (or ?type=xlsx), optionally just
+one ?team=. The CSV is written a row at a time as it is sent.
+"""
+class RosterExportView(APIView):
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+
+    def get(self, request):
+        team = request.query_params.get('team')
+        if request.query_params.get('type', 'csv') == 'xlsx':
+            #openpyxl has to finish the file before it can be sent
+            handle = tempfile.TemporaryFile()
+            try:
+                write_xlsx(export_rows(team), handle)
+            except RosterError as e:
+                handle.close()
+                return Response({'error': str(e)}, status=400)
+            handle.seek(0)
+            return FileResponse(handle, as_attachment=True, filename='roster.xlsx')
+
+        response = StreamingHttpResponse(csv_lines(export_rows(team)), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="roster.csv"'
+        return response
+
+
+"""
+Sets the password of a user imported from a roster without one, using the
+invite token they were given. A token stops working once it has been used.
+"""
+class AcceptInviteView(APIView):
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        password = request.data.get('password')
+        if not password:
+            return Response({'error': 'password is required.'}, status=400)
+        user = read_invite(str(request.data.get('token', '')))
+        if user is None:
+            return Response({'error': 'Invite is invalid or has expired.'}, status=400)
+        try:
+            password_validation.validate_password(password, user)
+        except DjangoValidationError as e:
+            return Response({'error': e.messages}, status=400)
+        user.set_password(password)
+        user.save(update_fields=['password'])
+        return Response({'message': 'Password set, you can now log in.'})
+
+
+"""
+Answers a roster request for a Team from its cached snapshot. An If-None-Match
+that matches the team's ETag gets a 304, otherwise body(team, rows) builds
+the response data.
+"""
+def roster_response(request, team, body):
+    return etag_response(request, roster_etag(team), lambda: body(team, with_media_urls(request, get_roster(team))))
+
+
+def etag_response(request, etag, body):
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        response = not_modified
+    else:
+        response = Response(body(), status=200)
+    response['ETag'] = etag
+    #The photo urls in the body are signed, so only the client keeps a copy
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 """
 This view is responsible for displaying all the players in the team admins
-team!!
+team!! The team comes from the token claims
+The whole response is cached per team (see response_cache.py), so a warm
+request doesn't query anything
 """
 class TeamPlayersView(APIView):
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsTeamAdmin]
 
     def get(self, request):
-        try:
-            user = request.user
-            player_profile = PlayerProfile.objects.get(user=user)
+        team_name = request_claims(request)['team_name']
+        etag, rows = cached_response(
+            request, 'team-players', [f"team:{team_name}"], lambda: self.roster(request, team_name), vary=[team_name],
+        )
+        if etag is None:
+            return Response([], status=200)
+        return etag_response(request, etag, lambda: rows)
 
-            if not player_profile.is_team_admin:
-                return Response({"detail":"You are not a team admin."}, status=403)
+    def roster(self, request, team_name):
+        team = Team.objects.filter(name=team_name).first()
+        if team is None:
+            return None, []
+        return roster_etag(team), with_media_urls(request, get_roster(team))
 
-            team_name = player_profile.team_name
-            players = PlayerProfile.objects.filter(team_name=team_name)
-            serializer = PlayerProfileSerializer(players, many=True)
-            return Response(serializer.data, status=200)
 
-        except PlayerProfile.DoesNotExist:
-            return Response({"detail": "Player profile not found"}, status=404)
+"""
+A team's roster with its counters. Club admins can read any team, team
+admins only their own. Supports If-None-Match.
+"""
+class TeamRosterView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, team_name):
+        claims = request_claims(request)
+        if 'club_admin' not in claims['roles'] and not (
+            'team_admin' in claims['roles'] and claims['team_name'] == team_name
+        ):
+            return Response({'error': 'You can only see the roster of your own team.'}, status=403)
+        team = Team.objects.filter(name=team_name).first()
+        if team is None:
+            return Response({'error': 'Team not found'}, status=404)
+        return roster_response(request, team, lambda team, rows: {**team_counters(team), 'players': rows})
+
+
+def team_counters(team):
+    return {
+        'team': team.name,
+        'players_count': team.players_count,
+        'verified_receipts': team.verified_receipts,
+        'pending_receipts': team.pending_receipts,
+    }
+
+
+"""
+Every team with its counters for the club admin dashboard, in one query
+"""
+class TeamListView(APIView):
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+
+    def get(self, request):
+        return Response([team_counters(team) for team in Team.objects.all()])
 
 
 """
@@ -236,6 +502,11 @@ class UploadReceiptView(APIView):
         except User.DoesNotExist:
             return Response({'error':'Player not found.'}, status=404)
 
+        if file is None:
+            return Response({'error': 'No file uploaded.'}, status=400)
+        content_type = check_file(file, request_claims(request)['roles'])
+        file.name = receipt_filename(file.name, content_type)
+
         receipt = Receipt.objects.create(
             player=player,
             uploaded_by = request.user,
@@ -247,28 +518,175 @@ class UploadReceiptView(APIView):
         return Response(serializer.data, status=201)
 
 
+"""
+This lets a team admin upload the receipts for their whole team in one request,
+either as repeated player/file (and optional note) fields paired up in order,
+or as a zip with one file per player named after the player id.
+Every player is checked against the captain's team in one query and the
+receipts are inserted with one bulk_create. A result is returned for every
+item, in the same order, and a bad item doesn't stop the rest.
+"""
+class BatchUploadReceiptView(APIView):
+    permission_classes = [IsAuthenticated, IsTeamAdmin]
+
+    def post(self, request):
+        claims = request_claims(request)
+        archive = request.FILES.get('archive')
+        if archive is not None:
+            note = request.data.get('note', '')
+            items = [(player, file, error, note) for player, file, error in split_archive(archive, claims['roles'])]
+        else:
+            players = request.data.getlist('player')
+            files = request.FILES.getlist('file')
+            notes = request.data.getlist('note')
+            if not files:
+                return Response({'error': 'Provide player and file pairs or an archive'}, status=400)
+            if len(players) != len(files):
+                return Response({'error': 'Send one player for every file'}, status=400)
+            if len(files) > batch_limit():
+                return Response({'error': f'At most {batch_limit()} files per batch'}, status=400)
+            items = []
+            for n, (player, file) in enumerate(zip(players, files)):
+                note = notes[n] if n < len(notes) else ''
+                try:
+                    items.append((int(player), file, None, note))
+                except ValueError:
+                    items.append((None, file, 'Player must be an id.', note))
+
+        try:
+            team_members = set(PlayerProfile.objects.filter(
+                team_name=claims['team_name'],
+                user_id__in={player for player, _, error, _ in items if error is None},
+            ).values_list('user_id', flat=True))
+
+            results = []
+            pending = []
+            for player, file, error, note in items:
+                result = {'name': getattr(file, 'name', file), 'player': player}
+                results.append(result)
+                if error is None and player not in team_members:
+                    error = 'Player is not in your team.'
+                if error is None:
+                    content_type, error = check_batch_file(file, claims['roles'])
+                if error is not None:
+                    result.update(status='rejected', error=error)
+                    continue
+                file.name = receipt_filename(file.name, content_type)
+                pending.append((player, file, note, result))
+
+            receipts = create_receipts([item[:3] for item in pending], request.user)
+            listed = Receipt.objects.for_listing().in_bulk([receipt.pk for receipt in receipts])
+            for (_, _, _, result), receipt in zip(pending, receipts):
+                result['status'] = 'created'
+                result['receipt'] = ReceiptSerializer(listed[receipt.pk], context={'request': request}).data
+
+            return Response({'created': len(receipts), 'results': results}, status=201 if receipts else 400)
+        finally:
+            #The zip's entries were extracted to temporary files
+            if archive is not None:
+                for _, file, _, _ in items:
+                    if not isinstance(file, str):
+                        file.close()
+
+
+"""
+Starts a chunked receipt upload (see uploads.py for the protocol)
+The declared size is checked against the uploader's quota before any bytes
+are sent.
+"""
+class ReceiptUploadStartView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        filename = str(request.data.get('filename', '')).strip()
+        if not filename:
+            return Response({'error': 'filename is required.'}, status=400)
+        size = parse_int('size', str(request.data.get('size', '')))
+        check_size(size, request_claims(request)['roles'])
+
+        try:
+            player = User.objects.get(id=request.data.get('player'))
+        except (User.DoesNotExist, ValueError, TypeError):
+            return Response({'error':'Player not found.'}, status=404)
+
+        upload = ReceiptUpload.objects.create(
+            player=player, uploaded_by=request.user,
+            filename=filename[:255], size=size, note=request.data.get('note', ''),
+        )
+        return Response(upload_status(upload), status=201)
+
+
+"""
+Reports how far a chunked upload has got (so the client knows where to
+resume), takes the next chunk as the raw request body, or cancels it
+"""
+class ReceiptUploadChunkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, upload_id, lock=False):
+        uploads = ReceiptUpload.objects.filter(id=upload_id, uploaded_by_id=request.user.id)
+        upload = (uploads.select_for_update() if lock else uploads).first()
+        if upload is None:
+            raise Http404("Upload not found")
+        return upload
+
+    def get(self, request, upload_id):
+        return Response(upload_status(self.get_upload(request, upload_id)))
+
+    def put(self, request, upload_id):
+        offset = parse_int('offset', request.query_params.get('offset', '0'))
+        length = parse_int('Content-Length', request.META.get('CONTENT_LENGTH') or '0')
+        try:
+            with transaction.atomic():
+                upload = self.get_upload(request, upload_id, lock=True)
+                append_chunk(upload, offset, request.stream, length)
+        except UnsupportedUploadType:
+            #Not a receipt, no point keeping what was sent
+            discard_upload(self.get_upload(request, upload_id))
+            raise
+        return Response(upload_status(upload))
+
+    def delete(self, request, upload_id):
+        discard_upload(self.get_upload(request, upload_id))
+        return Response(status=204)
+
+
+"""
+Finishes a chunked upload once every byte is in and creates the Receipt
+"""
+class ReceiptUploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        with transaction.atomic():
+            upload = ReceiptUploadChunkView().get_upload(request, upload_id, lock=True)
+            receipt = finish_upload(upload)
+        return Response(ReceiptSerializer(receipt, context={'request': request}).data, status=201)
+
+
 """
 This view returns a list of unverified receipts to the club admin
+It is cursor paginated newest first and takes the same filters as
+ListAllReceipts (see filters.filter_receipts)
 """
 class ListUnverifiedReceipts(APIView):
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+    pagination_class = ReceiptCursorPagination
 
     def get(self, request):
-        # Check if user is club admin
-        if not hasattr(request.user, 'club_admin_profile') or request.user.club_admin_profile is None:
-            return Response({'error': 'Unauthorized'}, status=403)
-
-        receipts = Receipt.objects.filter(is_verified=False)
-        serializer = ReceiptSerializer(receipts, many=True, context={'request': request})
-        return Response(serializer.data)
+        return Response(cached_response(
+            request, 'receipts-unverified', receipt_scopes(request.query_params),
+            lambda: receipt_page(request, self, is_verified=False),
+        ))
 
 
 """
 This view is for verifiying the receipts once downloaded
-this will then generate a qr code
+The verification is committed straight away and the qr code is rendered in
+the background, the qr endpoints report "pending" until it is ready
 """
 class VerifyReceiptView(APIView):
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, IsClubAdmin]
 
     def post(self, request, receipt_id):
         try:
@@ -276,28 +694,116 @@ class VerifyReceiptView(APIView):
         except Receipt.DoesNotExist:
             return Response({'error':'Receipt not found'}, status=404)
 
-        if not hasattr(request.user, 'club_admin_profile'):
-            return Response({'error': 'Unauthorized'}, status=403)
+        with transaction.atomic():
+            receipt.is_verified = True
+            receipt.save(update_fields=['is_verified'])
+            enqueue_qr_code(receipt, for_role='player')
 
-        receipt.is_verified = True
-        receipt.save()
-        receipt.generate_qr_code(for_role='player')
+        data = ReceiptSerializer(receipt, context={'request': request}).data
+        data['message'] = 'Receipt verified, QR code is being generated'
+        return Response(data)
 
-        
-        return Response({'message':'Receipt verified and QR code generated'})
+
+"""
+This view lets the club admin verify many receipts in one request, either a
+list of receipt_ids or every unverified receipt for a team. The receipts are
+flipped with one bulk_update and their qr codes are rendered as a single
+background batch. A result is returned for every receipt asked for.
+"""
+class BulkVerifyReceiptsView(APIView):
+    permission_classes = [IsAuthenticated, IsClubAdmin]
+
+    def post(self, request):
+        receipt_ids = request.data.get('receipt_ids')
+        team = request.data.get('team')
+        if receipt_ids is not None:
+            if not isinstance(receipt_ids, list):
+                return Response({'error': 'receipt_ids must be a list'}, status=400)
+            try:
+                receipt_ids = [int(receipt_id) for receipt_id in receipt_ids]
+            except (TypeError, ValueError):
+                return Response({'error': 'receipt_ids must be integers'}, status=400)
+            receipts = Receipt.objects.filter(id__in=receipt_ids)
+        elif team:
+            receipts = Receipt.objects.filter(
+                is_verified=False,
+                player__in=PlayerProfile.objects.filter(team_name=team).values('user'),
+            )
+        else:
+            return Response({'error': 'Provide receipt_ids or team'}, status=400)
+
+        receipts = list(receipts.only('id', 'player', 'is_verified', 'qr_status'))
+        if receipt_ids is None:
+            receipt_ids = [receipt.id for receipt in receipts]
+
+        to_verify = [receipt for receipt in receipts if not receipt.is_verified]
+        queued_at = timezone.now()
+        for receipt in to_verify:
+            receipt.is_verified = True
+            receipt.qr_status = Receipt.QR_PENDING
+            receipt.qr_queued_at = queued_at
+
+        with transaction.atomic():
+            Receipt.objects.bulk_update(to_verify, ['is_verified', 'qr_status', 'qr_queued_at'])
+            #bulk_update doesn't send post_save, this also drops the cached eligibility
+            grant_eligibility([(receipt.player_id, receipt.id) for receipt in to_verify])
+            refresh_teams_on_commit(user_ids={receipt.player_id for receipt in to_verify})
+            invalidate('receipts')
+            enqueue_qr_codes([receipt.id for receipt in to_verify], for_role='player')
+
+        found = {receipt.id: receipt for receipt in receipts}
+        verified = {receipt.id for receipt in to_verify}
+        qr_statuses = dict(Receipt.objects.filter(id__in=found).values_list('id', 'qr_status'))
+        results = []
+        for receipt_id in receipt_ids:
+            if receipt_id not in found:
+                results.append({'id': receipt_id, 'status': 'not_found'})
+            else:
+                results.append({
+                    'id': receipt_id,
+                    'status': 'verified' if receipt_id in verified else 'already_verified',
+                    'qr_status': qr_statuses.get(receipt_id),
+                })
+        return Response({'verified': len(verified), 'results': results})
 
 
 """
 To be able to list all the receipts(verified and unverified) this view will'
 allow me to do so
+Cursor paginated newest first, filter with ?team=, ?group=, ?verified=,
+?uploaded_by=, ?from= and ?to=
 """
 class ListAllReceipts(APIView):
     permission_classes = [IsAuthenticated]
+    pagination_class = ReceiptCursorPagination
 
     def get(self, request):
-        receipts = Receipt.objects.all()
-        serializer = ReceiptSerializer(receipts, many=True)
-        return Response(serializer.data)
+        return Response(cached_response(
+            request, 'receipts-all', receipt_scopes(request.query_params), lambda: receipt_page(request, self),
+        ))
+
+
+"""
+One page of the receipt listing for the query params, narrowed by filters
+"""
+def receipt_page(request, view, **filters):
+    receipts = filter_receipts(Receipt.objects.for_listing(), request.query_params).filter(**filters)
+    paginator = view.pagination_class()
+    page = paginator.paginate_queryset(receipts, request, view=view)
+    with timed_serialization():
+        data = ReceiptSerializer(page, many=True, context={'request': request}).data
+    return paginator.get_paginated_response(data).data
+
+
+"""
+What the qr code endpoints answer for the latest verified receipt (or None)
+"""
+def qr_code_data(request, receipt):
+    if receipt and receipt.qr_status == Receipt.QR_READY and receipt.qr_code:
+        return {"qr_code": media_url(request, receipt.qr_code), "status": Receipt.QR_READY}
+    if receipt and receipt.qr_status in (Receipt.QR_PENDING, Receipt.QR_FAILED):
+        return {"qr_code": None, "status": receipt.qr_status}
+    return {"qr_code": None, "status": Receipt.QR_NONE}
 
 
 """
@@ -311,19 +817,35 @@ class PlayerQRCodeView(APIView):
         try:
             # Get the latest verified receipt for this player
             receipt = Receipt.objects.filter(
-                player=user, 
+                player_id=user.id, 
                 is_verified=True
             ).order_by('-uploaded_at').first()
-            
-            if receipt and receipt.qr_code:
-                qr_url = request.build_absolute_uri(receipt.qr_code.url)
-                return Response({"qr_code": qr_url})
-            return Response({"qr_code": None})
-        except Exception as e:
-            print(f"Error in PlayerQRCodeView: {str(e)}")
+            return Response(qr_code_data(request, receipt))
+        except Exception:
+            logger.exception("Failed to look up the qr code of player %s", user.id)
             return Response({"qr_code": None})
 
 
+"""
+The player's dashboard status for a season (?season=, the current one by
+default), read from one row of the eligibility table
+"""
+class PlayerEligibilityView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        season = request.query_params.get('season') or current_season()
+        row = Eligibility.objects.filter(user_id=request.user.id, season_id=season).only('status', 'valid_until').first()
+        if row is None:
+            return Response({'season': season, 'status': None, 'valid_until': None, 'eligible': False})
+        return Response({
+            'season': season,
+            'status': row.status,
+            'valid_until': row.valid_until.isoformat(),
+            'eligible': row.is_valid(timezone.localdate()),
+        })
+
+
 """
 This will allow team admins to view their qr codes-----THIS DOESNT NEED TO EXIST!!!
 """
@@ -335,21 +857,264 @@ class TeamAdminQRCodeView(APIView):
         try:
             # Get the latest verified receipt uploaded by this team admin
             receipt = Receipt.objects.filter(
-                uploaded_by=user, 
+                uploaded_by_id=user.id, 
                 is_verified=True
             ).order_by('-uploaded_at').first()
-            
-            if receipt and receipt.qr_code:
-                qr_url = request.build_absolute_uri(receipt.qr_code.url)
-                return Response({"qr_code": qr_url})
-            return Response({"qr_code": None})
-        except Exception as e:
-            print(f"Error in TeamAdminQRCodeView: {str(e)}")
+            return Response(qr_code_data(request, receipt))
+        except Exception:
+            logger.exception("Failed to look up the qr code of team admin %s", user.id)
             return Response({"qr_code": None})
 
 
+"""
+Works out who a decoded qr code belongs to. New qr codes hold a signed token,
+older ones hold a python dict with the user id. Returns (member_id, season)
+where season is None for the old format.
+"""
+def identify_qr_data(raw_data):
+    if raw_data.startswith(TOKEN_VERSION + ':'):
+        parsed = read_token(raw_data)
+        return parsed.member_id, parsed.season
+
+    #QR codes printed before the signed tokens hold a python dict
+    try:
+        qr_data = json.loads(raw_data.replace("'", '"'))  # Fix malformed JSON
+        user_id = qr_data.get('id')  # or use email if id isn't included
+    except (ValueError, AttributeError):
+        raise InvalidQRToken('Unknown QR code format')
+    if not user_id:
+        raise InvalidQRToken('User ID not found in QR data')
+    return int(user_id), None
+
+
+"""
+Builds the scan result for a member from the cached eligibility entry.
+The member has to be eligible (or in grace) for the season of the token, or
+the current season for old qr codes. Returns the data and the status code.
+With a fixture (from get_fixture) the season is the fixture's and the scan
+is recorded as a check-in, see attendance.py.
+"""
+def scan_result(request, member_id, season=None, fixture=None):
+    data, code = scan_data(request, get_eligibility(member_id), season, fixture)
+    if fixture is not None and code == status.HTTP_200_OK:
+        data['check_in'] = check_in(fixture, member_id, request.user.id, data['team_name'], data['eligible'])
+    return data, code
+
+
+"""
+The scan result for a cached eligibility entry, without recording anything
+"""
+def scan_data(request, entry, season=None, fixture=None):
+    if not entry['exists']:
+        return {'error': 'User not found'}, status.HTTP_404_NOT_FOUND
+    if entry['team_name'] is None:
+        return {'error': 'Player profile not found'}, status.HTTP_404_NOT_FOUND
+
+    if fixture is not None:
+        season = fixture['season']
+    eligible = is_eligible(entry['seasons'], season)
+
+    profile_photo_url = media_url(request, entry['profile_photo']) or ''
+    thumbnails = {size: media_url(request, name) for size, name in entry.get('thumbnails', {}).items()}
+
+    data = {
+        'fname': entry['fname'],
+        'sname': entry['sname'],
+        'team_name': entry['team_name'],
+        'profile_photo_url': profile_photo_url,
+        'profile_photo_thumbnails': thumbnails,
+        'payment_status': 'Verified' if eligible else 'Not verified',
+        'eligible': eligible,
+    }
+    if fixture is not None:
+        data['side'] = side_of(fixture, entry['team_name']) or None
+    return data, status.HTTP_200_OK
+
+
+"""
+Scanning anyone's code is open to every user, but only the gate staff may
+record check-ins, or anyone could check themselves in
+"""
+def require_gate_staff(request):
+    if not IsGateStaff().has_permission(request, None):
+        raise PermissionDenied(IsGateStaff.message)
+
+
+"""
+The fixture a scan request is for (the optional "fixture" field of the
+request data), or None. Raises a 403 if the user isn't gate staff and a 404
+if there is no such fixture.
+"""
+def requested_fixture(request):
+    fixture_id = request.data.get('fixture')
+    if fixture_id in (None, ''):
+        return None
+    require_gate_staff(request)
+    fixture = get_fixture(parse_int('fixture', str(fixture_id)))
+    if fixture is None:
+        raise NotFound('Fixture not found')
+    return fixture
+
+
+"""
+Works out whose qr code the decoder read in one frame. Returns
+((member_id, season), None), or (None, (error data, status code)) if the
+frame can't be used.
+"""
+def frame_member(decoded):
+    if isinstance(decoded, QRDecodeTimeout):
+        return None, ({'error': str(decoded)}, status.HTTP_504_GATEWAY_TIMEOUT)
+    if isinstance(decoded, QRDecodeError):
+        return None, ({'error': str(decoded)}, status.HTTP_400_BAD_REQUEST)
+    if not decoded:
+        return None, ({'error': 'QR code could not be read'}, status.HTTP_400_BAD_REQUEST)
+    try:
+        return identify_qr_data(decoded[0]), None
+    except InvalidQRToken as e:
+        return None, ({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+
+"""
+Turns the output of the decoder for one frame into a scan result
+"""
+def decoded_frame_result(request, decoded, fixture=None):
+    member, error = frame_member(decoded)
+    if error is not None:
+        return error
+    return scan_result(request, *member, fixture)
+
+
+"""
+This is the fast scan path, the umpire's device decodes the qr code itself and
+posts the token string. Only the signature is checked and the member is looked
+up in the cache, no image work happens on the server.
+"""
+class ScanQRTokenView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        token = request.data.get('token')
+        if not token:
+            return Response({'error': 'QR code token required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            parsed = read_token(token)
+        except InvalidQRToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data, code = scan_result(request, parsed.member_id, parsed.season, requested_fixture(request))
+        return Response(data, status=code)
+
+
+"""
+Lists the fixtures, newest first (?team= for one team's), and lets club
+admins add one
+"""
+class FixtureListView(APIView):
+    def get_permissions(self):
+        if self.request.method == 'POST':
+            return [IsAuthenticated(), IsClubAdmin()]
+        return [IsAuthenticated(), IsGateStaff()]
+
+    def get(self, request):
+        fixtures = Fixture.objects.all()
+        team = request.query_params.get('team')
+        if team:
+            fixtures = fixtures.filter(Q(home_team=team) | Q(away_team=team))
+        return Response(FixtureSerializer(fixtures[:100], many=True).data)
+
+    def post(self, request):
+        serializer = FixtureSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=201)
+        return Response(serializer.errors, status=400)
+
+
+"""
+The attendance summary of a fixture and who was let in. The counters are
+kept as check-ins are written, so they can trail the gate by a moment.
+"""
+class FixtureAttendanceView(APIView):
+    permission_classes = [IsAuthenticated, IsGateStaff]
+
+    def get(self, request, fixture_id):
+        fixture = Fixture.objects.filter(id=fixture_id).first()
+        if fixture is None:
+            return Response({'error': 'Fixture not found'}, status=404)
+        checked_in = {}
+        for check in CheckIn.objects.filter(fixture=fixture, eligible=True).select_related('member').order_by('scanned_at'):
+            checked_in.setdefault(check.member_id, {
+                'id': check.member_id,
+                'fname': check.member.fname,
+                'sname': check.member.sname,
+                'side': check.side,
+                'scanned_at': check.scanned_at,
+            })
+        return Response({**FixtureSerializer(fixture).data, 'checked_in': list(checked_in.values())})
+
+
+"""
+Downloads the offline snapshot of a fixture for the umpire's device, see gate.py
+?teams= is given twice (or comma separated) with the two teams, ?season= is optional
+"""
+class GateSnapshotView(APIView):
+    permission_classes = [IsAuthenticated, IsGateStaff]
+
+    def get(self, request):
+        teams = [
+            team.strip() for value in request.query_params.getlist('teams')
+            for team in value.split(',') if team.strip()
+        ]
+        if not 1 <= len(set(teams)) <= 2:
+            return Response({'error': 'Provide the two teams of the fixture'}, status=400)
+        try:
+            return Response(build_snapshot(request, list(dict.fromkeys(teams)), request.query_params.get('season')))
+        except SnapshotError as e:
+            return Response({'error': str(e)}, status=400)
+
+
+"""
+The changes since a snapshot, ?since= is the version of the device's copy
+"""
+class GateSnapshotDeltaView(APIView):
+    permission_classes = [IsAuthenticated, IsGateStaff]
+
+    def get(self, request):
+        since = request.query_params.get('since')
+        if not since:
+            return Response({'error': 'since is required'}, status=400)
+        try:
+            return Response(build_delta(request, since))
+        except SnapshotError as e:
+            return Response({'error': str(e)}, status=409)
+
+
+"""
+Uploads the scans a device recorded while offline, {"scans": [...]}
+A result is returned for every scan, see gate.record_offline_scans
+"""
+class OfflineScanUploadView(APIView):
+    permission_classes = [IsAuthenticated, IsGateStaff]
+
+    def post(self, request):
+        scans = request.data.get('scans')
+        if not isinstance(scans, list) or not scans:
+            return Response({'error': 'scans must be a non-empty list'}, status=400)
+        if len(scans) > max_scans():
+            return Response({'error': f'At most {max_scans()} scans per request'}, status=400)
+        results = record_offline_scans(request.user, scans)
+        return Response({
+            'recorded': sum(result['status'] == 'recorded' for result in results),
+            'results': results,
+        })
+
+
 """
 This view allows umpires to be able to scan qr codes of the players on the day
+This is the fallback for when the device can't decode the qr code itself, the
+image is uploaded and decoded in the decode pool (see qr_decode.py).
+Use ScanQRTokenView whenever possible.
 """
 class ScanQRCodeView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -359,35 +1124,35 @@ class ScanQRCodeView(APIView):
         if not qr_image:
             return Response({'error': 'QR code image required'}, status=status.HTTP_400_BAD_REQUEST)
 
+        fixture = requested_fixture(request)
         try:
-            image = Image.open(qr_image)
-            decoded = decode(image)
-            if not decoded:
-                return Response({'error': 'QR code could not be read'}, status=status.HTTP_400_BAD_REQUEST)
-
-            raw_data = decoded[0].data.decode('utf-8')
-            qr_data = json.loads(raw_data.replace("'", '"'))  # Fix malformed JSON
+            decoded = decode_upload(qr_image)
+        except QRDecodeError as e:
+            decoded = e
 
-            user_id = qr_data.get('id')  # or use email if id isn't included
-            if not user_id:
-                return Response({'error': 'User ID not found in QR data'}, status=status.HTTP_400_BAD_REQUEST)
+        data, code = decoded_frame_result(request, decoded, fixture)
+        return Response(data, status=code)
 
-            user = User.objects.get(id=user_id)
-            profile = user.player_profiles.first()
-            if not profile:
-                return Response({'error': 'Player profile not found'}, status=status.HTTP_404_NOT_FOUND)
 
-            profile_photo_url = ''
-            if profile.profile_photo and hasattr(profile.profile_photo, 'url'):
-                profile_photo_url = request.build_absolute_uri(profile.profile_photo.url)
-
-            return Response({
-                'fname': user.fname,
-                'sname': user.sname,
-                'team_name': profile.team_name,
-                'profile_photo_url': profile_photo_url,
-                'payment_status': 'Verified'
-            })
+"""
+This lets an umpire upload many frames in one request, for example a photo of
+each player in a team's line-up. Every frame is decoded in parallel and a
+result is returned for each one, in the same order as the uploads.
+"""
+class ScanQRCodeBatchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
 
-        except Exception as e:
-            return Response({'error': f'Failed to scan QR: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    def post(self, request):
+        frames = request.FILES.getlist('qr_codes')
+        if not frames:
+            return Response({'error': 'At least one QR code image required'}, status=status.HTTP_400_BAD_REQUEST)
+        max_frames = getattr(settings, 'QR_DECODE_MAX_BATCH', 30)
+        if len(frames) > max_frames:
+            return Response({'error': f'At most {max_frames} images per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        fixture = requested_fixture(request)
+        results = []
+        for frame, decoded in zip(frames, decode_uploads(frames)):
+            data, code = decoded_frame_result(request, decoded, fixture)
+            results.append({'name': frame.name, 'status': code, **data})
+        return Response({'results': results})
@@ -63,10 +63,17 @@ const ClubAdminDashboard = () => {
         const fetchUsers = async () => {
             try {
                 const token = localStorage.getItem('token');
-                const res = await axios.get('http://127.0.0.1:8000/users/all-users/', {
-                    headers: { Authorization: `Bearer ${token}` },
-                });
-                setUsers(res.data);
+                // all-users is cursor paginated, so follow the next links
+                const allUsers = [];
+                let url = 'http://127.0.0.1:8000/users/all-users/';
+                while (url) {
+                    const res = await axios.get(url, {
+                        headers: { Authorization: `Bearer ${token}` },
+                    });
+                    allUsers.push(...res.data.results);
+                    url = res.data.next;
+                }
+                setUsers(allUsers);
             } catch (err) {
                 console.error('Error fetching users:', err.response ? err.response.data : err.message);
             } finally {
@@ -81,10 +88,17 @@ const ClubAdminDashboard = () => {
         const fetchReceipts = async () => {
             try {
                 const token = localStorage.getItem('token');
-                const res = await axios.get('http://127.0.0.1:8000/users/receipts/all/', {
-                    headers: { Authorization: `Bearer ${token}` },
-                });
-                setReceipts(res.data);
+                // receipts/all is cursor paginated, so follow the next links
+                const allReceipts = [];
+                let url = 'http://127.0.0.1:8000/users/receipts/all/';
+                while (url) {
+                    const res = await axios.get(url, {
+                        headers: { Authorization: `Bearer ${token}` },
+                    });
+                    allReceipts.push(...res.data.results);
+                    url = res.data.next;
+                }
+                setReceipts(allReceipts);
             } catch (err) {
                 console.error('Error fetching receipts:', err.response ? err.response.data : err.message);
             } finally {
@@ -303,8 +317,8 @@ const ClubAdminDashboard = () => {
                                                             <td className="px-4 py-3 whitespace-nowrap text-sm text-gray-900">{receipt.uploaded_by_name}</td>
                                                             <td className="px-4 py-3 whitespace-nowrap text-sm text-blue-600">
                                                                 <a
-                                                                    href={`http://127.0.0.1:8000${receipt.file}`}
-                                                                    download={receipt.file.split('/').pop()}
+                                                                    href={receipt.file}
+                                                                    download={new URL(receipt.file, window.location.href).pathname.split('/').pop()}
                                                                     rel="noopener noreferrer"
                                                                     className="hover:underline"
                                                                 >